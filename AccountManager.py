@@ -158,3 +158,101 @@ class AccountManager(ABC):
         new user accounts in the target database.
         """
         pass
+
+    @abstractmethod
+    def getLinkedUserInfo(self, linkID: str, *attributes: str) -> dict:
+        """
+        Implementations of AccountManager should return the requested
+        attributes of the target database user linked to the provided linkid
+        as a dictionary of { attribute name: [values] }, or None if there is
+        no linked user.
+        """
+        pass
+
+    def getUsers(self, linkids, *attributes: str) -> dict:
+        """
+        Looks up the target database users linked to each of the provided
+        linkids.  Returns a dictionary of { linkid: user info } (as
+        getLinkedUserInfo returns) for the users found.  A lookup that failed
+        maps to the exception raised.
+
+        Looks each user up in turn; implementations should override this to
+        look them up in bulk.
+        """
+        retval = {}
+        for linkid in linkids:
+            try:
+                usr = self.getLinkedUserInfo(linkid, *attributes)
+            except Exception as e:
+                usr = e
+            if usr is not None:
+                retval[linkid] = usr
+        return retval
+
+    def applyChanges(self, changesets) -> tuple:
+        """
+        Updates the attributes of linked users.
+
+        changesets: an iterable of (linkid, { attribute name: value }), with
+        values as setAttribute accepts them.
+
+        Returns a tuple of ([linkids of users updated],
+        [(linkid, exception) for users that could not be updated]).
+
+        Sets each attribute in turn; implementations should override this to
+        send the changes in bulk.
+        """
+        done = []
+        failed = []
+        for linkid, changes in changesets:
+            try:
+                for attributeName, attributeValue in changes.items():
+                    self.setAttribute(linkid, attributeName, attributeValue)
+                done.append(linkid)
+            except Exception as e:
+                failed.append((linkid, e))
+        return (done, failed)
+
+    def createUsers(self, records) -> tuple:
+        """
+        Creates new user accounts.
+
+        records: an iterable of dictionaries of the keyword arguments to
+        createUser for each user, including the user's "linkid".
+
+        Returns a tuple of ({ linkid: value returned by createUser },
+        [(linkid, exception) for users that could not be created]).
+
+        Creates each user in turn; implementations should override this to
+        create them in bulk.
+        """
+        created = {}
+        failed = []
+        for record in records:
+            try:
+                created[record["linkid"]] = self.createUser(**record)
+            except Exception as e:
+                failed.append((record["linkid"], e))
+        return (created, failed)
+
+    def linkUsers(self, pairs) -> tuple:
+        """
+        Links target database users to the datasource, as linkUser does.
+
+        pairs: an iterable of (secondary match value, linkid).
+
+        Returns a tuple of ([linkids linked],
+        [(linkid, exception) for users that could not be linked]).
+
+        Links each user in turn; implementations should override this to
+        link them in bulk.
+        """
+        done = []
+        failed = []
+        for secondaryMatchVal, linkid in pairs:
+            try:
+                self.linkUser(secondaryMatchVal, linkid)
+                done.append(linkid)
+            except Exception as e:
+                failed.append((linkid, e))
+        return (done, failed)
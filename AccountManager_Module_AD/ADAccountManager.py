@@ -10,11 +10,21 @@ from AccountManager_Module_AD.ADOrgUnitAssignments import ADOrgUnitAssignment
 from AssignmentRules import AssignmentRule
 from AttributeMapping import AttributeMapping
 from AccountManager_Module_AD.ADGroupAssignments import ADGroupAssignment
+from AccountManager_Module_AD.ADDistinguishedName import canonicalDN
+from AccountManager_Module_AD.ADLdifExport import ADLdifConnection, ADLdifWriter
+from AccountManager_Module_AD.ADRateLimiter import ADRateLimiter
+from AccountManager_Module_AD.ADRetryPolicy import ADRetryPolicy
+from AccountManager_Module_AD.ADServerPool import ADServerPool
+import collections
+import queue
+import threading
+import time
 import ldap
-from ldap.controls import SimplePagedResultsControl
+from ldap.controls import LDAPControl, SimplePagedResultsControl
 from ldap.modlist import addModlist, modifyModlist
 from ldap.filter import escape_filter_chars
 from Exceptions import PasswordNotSetException
+from SortedMerge import externalSort
 
 
 """
@@ -25,6 +35,15 @@ UAC_OBJECT_DISABLED = 2
 UAC_OBJECT_HOMEDIR_REQUIRED = 8
 UAC_OBJECT_LOCKOUT = 16
 UAC_OBJECT_PASSWD_NOTREQD = 32
+UAC_OBJECT_NORMAL_ACCOUNT = 512
+
+# Server control that makes deleted objects (tombstones) visible to searches.
+LDAP_SERVER_SHOW_DELETED_OID = "1.2.840.113556.1.4.417"
+
+# Operations whose time the rate limiter adapts to.  Searches are left out, as
+# the time a page of results takes depends more on its size than on how
+# loaded the DC is.
+RATE_LIMIT_SAMPLED_OPERATIONS = ("modify_s", "add_s", "delete_s", "rename_s")
 
 
 class GetADAccountManager():
@@ -44,12 +63,19 @@ class GetADAccountManager():
                  attributesToMap: AttributeMapping = (),
                  securityGroupAssignments: ADGroupAssignment = (),
                  targetEncoding: str = "utf-8",
-                 maxSize: int = 500):
+                 maxSize: int = 500,
+                 userCache=None,
+                 lookupChunkSize: int = 100,
+                 limiter: ADRateLimiter = None,
+                 retryPolicy: ADRetryPolicy = None,
+                 readOnly: bool = False,
+                 ldifWriter: ADLdifWriter = None):
         """
         Create an AD Account Manager with the provided information.
         Parameters:
 
-        ldap_server: dns name or ip address of ldap server.
+        ldap_server: dns name or ip address of ldap server, or an
+        ADServerPool to choose the server from.
 
         username: username of service account to bind with.
 
@@ -96,6 +122,27 @@ class GetADAccountManager():
 
         maxSize: The maximum number of records this AccountManager will
         accept to operate on.
+
+        userCache: an optional ADUserCache that linked user lookups are
+        served from instead of querying AD.
+
+        lookupChunkSize: the maximum number of values combined into one
+        search by the bulk user lookups.
+
+        limiter: an optional ADRateLimiter that every LDAP operation is
+        passed through.  Share one limiter between AccountManagers to limit
+        the load they put on the DC together.
+
+        retryPolicy: an optional ADRetryPolicy deciding which failed LDAP
+        operations are retried.  Without one, no operation is retried.
+
+        readOnly: true if the AccountManager will only be used to read from
+        the directory.  When ldap_server is an ADServerPool, a read-only
+        AccountManager may connect to any DC in the pool; otherwise it
+        connects to the DC that writes are kept on.
+
+        ldifWriter: an optional ADLdifWriter.  If provided, changes are
+        written to it as LDIF instead of being made in AD.
         """
         self._ldap_server = ldap_server
         self._username = username
@@ -111,6 +158,12 @@ class GetADAccountManager():
         self._securityGroupAssignments = securityGroupAssignments
         self._targetEncoding = targetEncoding
         self._maxSize = maxSize
+        self._userCache = userCache
+        self._lookupChunkSize = lookupChunkSize
+        self._limiter = limiter
+        self._retryPolicy = retryPolicy
+        self._readOnly = readOnly
+        self._ldifWriter = ldifWriter
 
     def __enter__(self):
 
@@ -129,12 +182,19 @@ class GetADAccountManager():
                          attributesToMap: AttributeMapping = (),
                          securityGroupAssignments: ADGroupAssignment = (),
                          targetEncoding: str = "utf-8",
-                         maxSize: int = 1000):
+                         maxSize: int = 1000,
+                         userCache=None,
+                         lookupChunkSize: int = 100,
+                         limiter: ADRateLimiter = None,
+                         retryPolicy: ADRetryPolicy = None,
+                         readOnly: bool = False,
+                         ldifWriter: ADLdifWriter = None):
                 """
                 Create an AD Account Manager with the provided information.
                 Parameters:
 
-                ldap_server: dns name or ip address of ldap server.
+                ldap_server: dns name or ip address of ldap server, or an
+                ADServerPool to choose the server from.
 
                 username: username of service account to bind with.
 
@@ -177,6 +237,26 @@ class GetADAccountManager():
 
                 maxSize: The maximum number of records this AccountManager will
                 accept to operate on.
+
+                userCache: an optional ADUserCache that linked user lookups
+                are served from instead of querying AD.  Changes made through
+                this AccountManager are written through to the cache.
+
+                lookupChunkSize: the maximum number of values combined into
+                one search by the bulk user lookups.
+
+                limiter: an optional ADRateLimiter that every LDAP operation
+                is passed through.
+
+                retryPolicy: an optional ADRetryPolicy deciding which failed
+                LDAP operations are retried.
+
+                readOnly: true if the AccountManager will only be used to read
+                from the directory, so that it may connect to any DC in an
+                ADServerPool.
+
+                ldifWriter: an optional ADLdifWriter that changes are
+                written to instead of being made in AD.
                 """
                 super().__init__(dataToImport, dataColumnHeaders,
                                  dataLinkColumnName, targetLinkAttribute,
@@ -186,15 +266,141 @@ class GetADAccountManager():
                 self._orgUnitAssignments: ADOrgUnitAssignment = tuple(orgUnitAssignments)
                 self._groupAssignments: ADGroupAssignment = tuple(securityGroupAssignments)
                 self._baseUserDN = baseUserDN
+                self._userCache = userCache
+                self._lookupChunkSize = lookupChunkSize
+                self._limiter = limiter
+                self._retryPolicy = retryPolicy
+                self._readOnly = readOnly
+                self._ldifWriter = ldifWriter
 
                 # TODO: Make SSL optional / specify require cert
                 ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
-                self._ld = ldap.initialize("ldaps://" + ldap_server)
-                self._ld.set_option(ldap.OPT_REFERRALS, 0)
-                self._ld.simple_bind_s(username, password)
+                self._ldapServer = ldap_server
+                self._bindUsername = username
+                self._bindPassword = password
+                self._ld = None
+                self._server = None
+                # The number of connections opened so far, which tells
+                # whether a paged search cookie is from the current one.
+                self._connections = 0
+                self._ldcall(self._connect)
+
+            @property
+            def server(self) -> str:
+                """
+                Returns the LDAP server this AccountManager is connected to.
+                """
+                return self._server
+
+            def _connect(self):
+                """
+                Opens and binds the connection to the LDAP server, unless it
+                is already open.  If the server is chosen from an
+                ADServerPool and cannot be reached, it is marked as
+                unavailable so that reconnecting tries another.
+                """
+                if self._ld is not None:
+                    return
+                if isinstance(self._ldapServer, ADServerPool):
+                    if self._readOnly:
+                        server = self._ldapServer.readServer()
+                    else:
+                        server = self._ldapServer.writeServer()
+                else:
+                    server = self._ldapServer
+                try:
+                    ld = ldap.initialize("ldaps://" + server)
+                    ld.set_option(ldap.OPT_REFERRALS, 0)
+                    ld.simple_bind_s(self._bindUsername, self._bindPassword)
+                except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT):
+                    if isinstance(self._ldapServer, ADServerPool):
+                        self._ldapServer.markDown(server)
+                    raise
+                if self._ldifWriter is not None:
+                    ld = ADLdifConnection(ld, self._ldifWriter)
+                self._ld = ld
+                self._server = server
+                self._connections += 1
+
+            def _disconnect(self, failed: bool = False):
+                """
+                Closes the connection to the LDAP server, ignoring any error
+                (the connection may already be broken).
+
+                failed: true if the connection was lost, in which case the
+                server is marked as unavailable in the ADServerPool (if one
+                is in use).
+                """
+                if self._ld is not None:
+                    try:
+                        self._ld.unbind()
+                    except Exception:
+                        pass
+                    self._ld = None
+                    if failed and isinstance(self._ldapServer, ADServerPool):
+                        self._ldapServer.markDown(self._server)
+
+            def _ldcall(self, operation, *args, **kwargs):
+                """
+                Calls an LDAP operation with the provided arguments and
+                returns its result, waiting first for the limiter (if one is
+                in use) to allow it (only writes are timed for it).  If the
+                operation fails with an error the retry policy (if one is in
+                use) considers transient, it is tried again after a backoff,
+                reconnecting first if needed.
+
+                operation: the name of the LDAPObject method to call, or a
+                function that makes the calls to self._ld itself.
+                """
+                attempt = 0
+                while True:
+                    try:
+                        if self._limiter is None:
+                            return self._ldattempt(operation, args, kwargs)
+                        with self._limiter.operation(
+                                operation in RATE_LIMIT_SAMPLED_OPERATIONS):
+                            return self._ldattempt(operation, args, kwargs)
+                    except Exception as e:
+                        if attempt and self._alreadyApplied(operation, args, e):
+                            return None
+                        if (self._retryPolicy is None
+                                or not self._retryPolicy.shouldRetry(e, attempt)):
+                            raise
+                        if self._retryPolicy.needsReconnect(e):
+                            self._disconnect(failed=True)
+                        time.sleep(self._retryPolicy.delay(attempt))
+                        attempt += 1
+
+            def _ldattempt(self, operation, args, kwargs):
+                """
+                Makes a single attempt at an operation for _ldcall,
+                re-opening the connection first if it was closed.
+                """
+                self._connect()
+                if isinstance(operation, str):
+                    operation = getattr(self._ld, operation)
+                return operation(*args, **kwargs)
+
+            def _alreadyApplied(self, operation, args, error: Exception) -> bool:
+                """
+                Returns true if the error raised by a retried operation shows
+                that an earlier attempt at it was made after all, with its
+                result lost along with the connection: an add_s of an object
+                that now exists, or a modify_s that only adds values and
+                finds them there.
+                """
+                if operation == "add_s":
+                    return isinstance(error, ldap.ALREADY_EXISTS)
+                if operation == "modify_s":
+                    return (isinstance(error, ldap.TYPE_OR_VALUE_EXISTS)
+                            and all(mod[0] == ldap.MOD_ADD for mod in args[1]))
+                return False
 
             def _pagedSearch(self, attributes: str, searchString: str = None,
-                             pageSize: int = 1000, bookmark: str = ''):
+                             pageSize: int = 1000, bookmark: str = '',
+                             searchBase: str = None, serverControls: list = (),
+                             scope: int = ldap.SCOPE_SUBTREE,
+                             connection: int = None):
                 """
                 searchString: The LDAP query
 
@@ -205,24 +411,47 @@ class GetADAccountManager():
                 bookmark: if previous pages already returned, this is the
                 bookmark for the next page.
 
+                searchBase: the DN to search under.  Defaults to the base user
+                DN of this AccountManager.
+
+                serverControls: any additional server controls to send along
+                with the paged results control.
+
+                scope: the scope of the search below searchBase.
+
+                connection: the connection number returned with bookmark.  A
+                bookmark is only valid on the connection it was returned on,
+                so if the connection has been re-opened since (including
+                while this page is being retried), the search starts again
+                from the first page.  If None, bookmark is sent as it is.
+
                 returns: a tuple containing a tuple attributes per user returned
-                by the query and the bookmark for the next page.
+                by the query, the bookmark for the next page and the number of
+                the connection the page was read on.
                 """
+                if searchBase is None:
+                    searchBase = self._baseUserDN
                 pagecontrol = SimplePagedResultsControl(True,
                                                         size=self._maxSize,
                                                         cookie=bookmark)
-                response = self._ld.search_ext(self._baseUserDN,
-                                               ldap.SCOPE_SUBTREE,
-                                               searchString,
-                                               attributes,
-                                               serverctrls=[pagecontrol])
 
-                rtype, rdata, rmsgid, serverctrls = self._ld.result3(response)
+                def search():
+                    if connection is not None and self._connections != connection:
+                        pagecontrol.cookie = self.FIRST_AD_USERS_PAGE
+                    response = self._ld.search_ext(searchBase,
+                                                   scope,
+                                                   searchString,
+                                                   attributes,
+                                                   serverctrls=[pagecontrol]
+                                                   + list(serverControls))
+                    return self._ld.result3(response)
+
+                rtype, rdata, rmsgid, serverctrls = self._ldcall(search)
                 controls = [control for control in serverctrls
                             if control.controlType
                             == SimplePagedResultsControl.controlType]
 
-                return (rdata, controls[0].cookie)
+                return (rdata, controls[0].cookie, self._connections)
 
             def getADUsersPage(self, attributes, bookmark: bytes = ''):
                 """
@@ -254,6 +483,196 @@ class GetADAccountManager():
                     retbookmark = r[1]
                 return (r[0], retbookmark)
 
+            def searchUsers(self, searchString: str, attributes,
+                            searchBase: str = None,
+                            showDeleted: bool = False,
+                            scope: int = ldap.SCOPE_SUBTREE):
+                """
+                Runs a paged search and yields each returned object as a tuple
+                of (dn, { attribute name: [raw values] }), fetching the next
+                page as needed.
+
+                searchBase: the DN to search under.  Defaults to the base user
+                DN of this AccountManager.
+
+                showDeleted: if true, deleted objects (tombstones) are included
+                in the results.
+
+                scope: the scope of the search below searchBase.
+                """
+                controls = []
+                if showDeleted:
+                    controls.append(LDAPControl(LDAP_SERVER_SHOW_DELETED_OID, True))
+                bookmark = self.FIRST_AD_USERS_PAGE
+                connection = None
+                # The lower-case DNs returned so far, and those to skip if
+                # the search had to start again after the connection was lost.
+                returned = set()
+                skip = ()
+                while True:
+                    rdata, nextbookmark, pageconnection = self._pagedSearch(list(attributes),
+                                                                            searchString,
+                                                                            self._maxSize,
+                                                                            bookmark,
+                                                                            searchBase,
+                                                                            controls,
+                                                                            scope,
+                                                                            connection)
+                    if bookmark and pageconnection != connection:
+                        skip = set(returned)
+                    bookmark, connection = nextbookmark, pageconnection
+                    for dn, entry in rdata:
+                        # Skip search continuation references
+                        if dn is None or dn.lower() in skip:
+                            continue
+                        returned.add(dn.lower())
+                        yield (dn, entry)
+                    if not bookmark:
+                        break
+
+            def getSearchPartitions(self, filters=None) -> list:
+                """
+                Splits the users under the base user DN into partitions that
+                can be searched independently of each other, returned as a
+                list of (searchBase, scope, filter) tuples for
+                searchUsersPartitioned.
+
+                filters: LDAP filters that each select part of the users,
+                such as ranges of link attribute values.  A partition is
+                added for the users none of the filters select, so every
+                user is still found.  If not provided, there is one
+                partition per OU or container directly under the base user
+                DN, plus one for the users directly under the base user DN
+                itself.
+                """
+                if filters:
+                    partitions = [(self._baseUserDN, ldap.SCOPE_SUBTREE, f)
+                                  for f in filters]
+                    partitions.append((self._baseUserDN, ldap.SCOPE_SUBTREE,
+                                       "(!(|" + "".join(filters) + "))"))
+                    return partitions
+
+                partitions = [(self._baseUserDN, ldap.SCOPE_ONELEVEL, None)]
+                for dn, entry in self.searchUsers("(|(objectClass=organizationalUnit)"
+                                                  "(objectClass=container))",
+                                                  ["distinguishedName"],
+                                                  scope=ldap.SCOPE_ONELEVEL):
+                    partitions.append((dn, ldap.SCOPE_SUBTREE, None))
+                return partitions
+
+            def searchUsersPartitioned(self, searchString: str, attributes,
+                                       partitions: list, workers: int = 4):
+                """
+                Runs searchUsers over each of the provided partitions at the
+                same time and yields the objects found by all of them, in no
+                particular order.  Each worker searches with its own
+                connection to the same LDAP server as this AccountManager, so
+                the results are consistent with anything else read from it
+                (such as the directory state).
+
+                partitions: a list of (searchBase, scope, filter) tuples as
+                returned by getSearchPartitions.  The filter, if not None, is
+                combined with searchString.
+
+                workers: the most partitions searched at the same time.
+                """
+                pending = queue.Queue()
+                for partition in partitions:
+                    pending.put(partition)
+                results = queue.Queue(max(1, workers) * self._maxSize)
+                stopped = threading.Event()
+                finished = object()
+
+                def put(item):
+                    # Give up if the caller stops reading the results.
+                    while not stopped.is_set():
+                        try:
+                            results.put(item, timeout=0.5)
+                            return
+                        except queue.Full:
+                            pass
+
+                def work():
+                    try:
+                        adam = self._openSibling()
+                        try:
+                            while not stopped.is_set():
+                                try:
+                                    searchBase, scope, extra = pending.get_nowait()
+                                except queue.Empty:
+                                    break
+                                search = searchString
+                                if extra is not None:
+                                    search = "(&" + searchString + extra + ")"
+                                for entry in adam.searchUsers(search, attributes,
+                                                              searchBase,
+                                                              scope=scope):
+                                    put(entry)
+                        finally:
+                            adam.finalize()
+                    except Exception as e:
+                        put(e)
+                    finally:
+                        put(finished)
+
+                threads = [threading.Thread(target=work, daemon=True)
+                           for i in range(max(1, min(workers, len(partitions))))]
+                for thread in threads:
+                    thread.start()
+                running = len(threads)
+                try:
+                    while running:
+                        item = results.get()
+                        if item is finished:
+                            running -= 1
+                        elif isinstance(item, Exception):
+                            raise item
+                        else:
+                            yield item
+                finally:
+                    stopped.set()
+
+            def _openSibling(self):
+                """
+                Returns a new ADAccountManager, for searching only, with its
+                own connection to the same LDAP server as this one.  The
+                caller must finalize it.
+                """
+                return type(self)(self._server, self._bindUsername,
+                                  self._bindPassword, self._baseUserDN, {},
+                                  self._dataColumns, self._dataLinkColumnName,
+                                  self._targetLinkAttribute,
+                                  self._secondaryMatchAttribute, None,
+                                  targetEncoding=self._targetEncoding,
+                                  maxSize=self._maxSize,
+                                  limiter=self._limiter,
+                                  retryPolicy=self._retryPolicy,
+                                  readOnly=True)
+
+            def getDirectoryState(self) -> tuple:
+                """
+                Reads the state of the domain controller this AccountManager
+                is connected to from the rootDSE.
+
+                Returns a tuple of (invocationId, highestCommittedUSN,
+                defaultNamingContext).  The invocationId is returned as a hex
+                string and identifies the DC's copy of the directory database,
+                which the USN is only meaningful against.
+                """
+                rootdse = self._ldcall("search_s", "", ldap.SCOPE_BASE,
+                                       "(objectClass=*)",
+                                       ["highestCommittedUSN",
+                                        "dsServiceName",
+                                        "defaultNamingContext"])[0][1]
+                usn = int(rootdse["highestCommittedUSN"][0])
+                dsservice = rootdse["dsServiceName"][0].decode(self._targetEncoding)
+                namingcontext = rootdse["defaultNamingContext"][0].decode(self._targetEncoding)
+                ntds = self._ldcall("search_s", dsservice, ldap.SCOPE_BASE,
+                                    "(objectClass=*)",
+                                    ["invocationId"])[0][1]
+                invocationid = ntds["invocationId"][0].hex()
+                return (invocationid, usn, namingcontext)
+
             def getLinkedUserInfo(self, linkID: str,
                                   *attributes: str) -> dict:
                 """
@@ -267,8 +686,16 @@ class GetADAccountManager():
                 user was found.  If attributes is None, just the DN of the discovered
                 user will be returned.
                 """
-                # TODO: Make an abstractmethod for this in AccountManager
                 # TODO: Error Handling
+                # A user missing from the cache may have been linked since it
+                # was read (or be linked under a linkid of different case),
+                # so AD is asked before deciding that there is no such user.
+                if (self._userCache is not None
+                        and self._userCache.covers(attributes)
+                        and not self._userCache.isDirty(linkID)):
+                    adusr = self._userCache.getLinkedUser(linkID, *attributes)
+                    if adusr is not None:
+                        return adusr
                 return self.getUserInfo(self._targetLinkAttribute, linkID, *attributes)
 
             def _getObjAttributes(self, dn: str, attributes: str) -> dict:
@@ -278,11 +705,11 @@ class GetADAccountManager():
                 """
                 search = "(distinguishedName=" + dn + ")"
 
-                r = self._ld.search(self._baseUserDN,
-                                    ldap.SCOPE_SUBTREE,
-                                    search,
-                                    tuple(["distinguishedName"] + list(attributes)))
-                result_type, result_data = self._ld.result(r, 1)
+                result_data = self._ldcall("search_s",
+                                           self._baseUserDN,
+                                           ldap.SCOPE_SUBTREE,
+                                           search,
+                                           tuple(["distinguishedName"] + list(attributes)))
                 if len(result_data) == 0:
                     return None
                 elif len(result_data) > 1:
@@ -315,11 +742,11 @@ class GetADAccountManager():
                 searchAttributeValue = escape_filter_chars(searchAttributeValue)
                 search = "(" + searchAttributeName + "=" + searchAttributeValue + ")"
                 # TODO: Error Handling
-                r = self._ld.search(self._baseUserDN,
-                                    ldap.SCOPE_SUBTREE,
-                                    search,
-                                    tuple(["distinguishedName"] + list(attributes)))
-                result_type, result_data = self._ld.result(r, 1)
+                result_data = self._ldcall("search_s",
+                                           self._baseUserDN,
+                                           ldap.SCOPE_SUBTREE,
+                                           search,
+                                           tuple(["distinguishedName"] + list(attributes)))
 
                 if len(result_data) == 0:
                     return None
@@ -327,24 +754,168 @@ class GetADAccountManager():
                     raise Exception("Unexpected: More than one user was "
                                     + "returned from this unique ID search!")
                 else:
-                    adusr: dict = result_data[0][1]
-                    retval = {}
-                    # Convert result data from bytes to friendly strings
-                    for attribute in adusr.keys():
-                        retval[attribute] = [val.decode(self._targetEncoding)
-                                             for val in adusr[attribute]]
-                    # The ldap interface does not return an empty/null attribute
-                    # in its result data.  We should find any non-returned
-                    # attributes and return them as null here so key Errors
-                    # do not get raised unexpectedly.
-                    nullatrs = [atr for atr in attributes
-                                if atr not in adusr.keys()]
-                    for atr in nullatrs:
-                        retval[atr] = None
-                    return retval
+                    return self._decodeUserInfo(result_data[0][1], attributes)
+
+            def _decodeUserInfo(self, adusr: dict, attributes) -> dict:
+                """
+                Converts a user returned by an LDAP search into the dictionary
+                form returned by getUserInfo.
+                """
+                retval = {}
+                # Convert result data from bytes to friendly strings
+                for attribute in adusr.keys():
+                    retval[attribute] = [val.decode(self._targetEncoding)
+                                         for val in adusr[attribute]]
+                # The ldap interface does not return an empty/null attribute
+                # in its result data.  We should find any non-returned
+                # attributes and return them as null here so key Errors
+                # do not get raised unexpectedly.
+                nullatrs = [atr for atr in attributes
+                            if atr not in adusr.keys()]
+                for atr in nullatrs:
+                    retval[atr] = None
+                return retval
+
+            def getUsersInfo(self, searchAttributeName: str,
+                             searchAttributeValues, *attributes: str) -> dict:
+                """
+                Bulk version of getUserInfo.  Looks up the users matching any of
+                the provided values, combining up to lookupChunkSize values
+                into each search with an (|(attr=v1)(attr=v2)...) filter.
+
+                searchAttributeName: The name of the AD attribute to search on
+                searchAttributeValues: The values to look for in the search
+                attribute.
+                attributes: the attributes that should be returned for each
+                user found.
+
+                Returns a dictionary of { search value: user info } where user
+                info is of the same form getUserInfo returns.  Values with no
+                matching user are left out.  Values matched by more than one
+                user map to an Exception describing the problem (as
+                getUserInfo would have raised) instead.
+                """
+                # AD matches the values case-insensitively, so map the values
+                # returned back to every spelling of them that was asked for.
+                wanted = {}
+                for val in searchAttributeValues:
+                    if val is not None and len(val) > 0:
+                        spellings = wanted.setdefault(val.lower(), [])
+                        if val not in spellings:
+                            spellings.append(val)
+                values = [spellings[0] for spellings in wanted.values()]
+
+                attrname = escape_filter_chars(searchAttributeName)
+                searchattrs = ["distinguishedName", searchAttributeName] \
+                    + list(attributes)
+                matches = {}
+                for i in range(0, len(values), self._lookupChunkSize):
+                    chunk = values[i:i + self._lookupChunkSize]
+                    search = "".join(["(" + attrname + "="
+                                      + escape_filter_chars(val) + ")"
+                                      for val in chunk])
+                    if len(chunk) > 1:
+                        search = "(|" + search + ")"
+                    for dn, adusr in self.searchUsers(search, searchattrs):
+                        for atrname in adusr.keys():
+                            if atrname.lower() == searchAttributeName.lower():
+                                for found in adusr[atrname]:
+                                    key = found.decode(self._targetEncoding).lower()
+                                    for val in wanted.get(key, ()):
+                                        matches.setdefault(val, []).append(adusr)
+
+                retval = {}
+                for val, adusrs in matches.items():
+                    if len(adusrs) > 1:
+                        retval[val] = Exception("Unexpected: More than one user was "
+                                                + "returned from this unique ID search!")
+                    else:
+                        retval[val] = self._decodeUserInfo(adusrs[0], attributes)
+                return retval
+
+            def getLinkedUsersInfo(self, linkids, *attributes: str) -> dict:
+                """
+                Bulk version of getLinkedUserInfo.  Returns a dictionary of
+                { linkid: user info } for the linked users found, as described
+                in getUsersInfo.  Linked users held in the user cache are not
+                searched for.  Those missing from it are, as getLinkedUserInfo
+                does.
+                """
+                retval = {}
+                if (self._userCache is not None
+                        and self._userCache.covers(attributes)):
+                    remaining = []
+                    for linkid in linkids:
+                        adusr = None
+                        if not self._userCache.isDirty(linkid):
+                            adusr = self._userCache.getLinkedUser(linkid, *attributes)
+                        if adusr is None:
+                            remaining.append(linkid)
+                        else:
+                            retval[linkid] = adusr
+                    linkids = remaining
+                retval.update(self.getUsersInfo(self._targetLinkAttribute,
+                                                linkids, *attributes))
+                return retval
+
+            def getUsers(self, linkids, *attributes: str) -> dict:
+                """
+                Bulk lookup of linked users (see AccountManager.getUsers),
+                combining many linkids into each search as
+                getLinkedUsersInfo does.
+                """
+                return self.getLinkedUsersInfo(linkids, *attributes)
+
+            def getLinkedUsers(self, *attributes: str):
+                """
+                Yields a tuple of (linkid, user info) for every user under the
+                base user DN that has a linkid, reading them with a single
+                paged search.  User info is of the form getUserInfo returns.
+                """
+                linkattr = self._targetLinkAttribute
+                search = ("(&(objectCategory=person)(objectClass=user)("
+                          + escape_filter_chars(linkattr) + "=*))")
+                searchattrs = ["distinguishedName", linkattr] + list(attributes)
+                for dn, adusr in self.searchUsers(search, searchattrs):
+                    info = self._decodeUserInfo(adusr, attributes)
+                    for atrname, values in info.items():
+                        if atrname.lower() == linkattr.lower() and values:
+                            yield (values[0], info)
+                            break
+
+            def getLinkedUsersSorted(self, *attributes: str,
+                                     sortChunkSize: int = 100000,
+                                     tempDir: str = None):
+                """
+                Yields the users getLinkedUsers does, in order of linkid
+                (compared case-insensitively, as returned by str.lower()).
+                The users are read unsorted and sorted locally with
+                externalSort, since the DC's server side sort neither orders
+                values as str.lower() does nor sorts more users than its
+                MaxTempTableSize policy allows.
+
+                sortChunkSize: the most users held in memory at once.  Beyond
+                that, sorted chunks are written to temporary files in tempDir
+                (or the system default if None).
+                """
+                return externalSort(self.getLinkedUsers(*attributes),
+                                    key=lambda user: user[0].lower(),
+                                    chunkSize=sortChunkSize,
+                                    tempDir=tempDir)
+
+            def getSecondaryMatchUsersInfo(self, secondaryMatchVals,
+                                           *attributes: str) -> dict:
+                """
+                Looks up the users whose secondary match attribute holds any of
+                the provided values.  Returns a dictionary of
+                { secondary match value: user info } as described in
+                getUsersInfo.
+                """
+                return self.getUsersInfo(self._secondaryMatchAttribute,
+                                         secondaryMatchVals, *attributes)
 
             def setAttribute(self, linkid: str, attributeName: str,
-                             attributeValue: str):
+                             attributeValue):
                 """
                 By distinguishedName, Updates an existing AD user's attribute
                 with the value provided. NOTE: this will *replace* whatever is
@@ -354,23 +925,79 @@ class GetADAccountManager():
 
                 attributeName: Name of the AD attribute to update.
 
-                attributeValue: The new value for the AD attribute.
+                attributeValue: The new value for the AD attribute, or a list
+                of values for a multi-valued attribute.  None or an empty
+                value clears the attribute.
                 """
                 dn = self.getLinkedUserInfo(linkid)["distinguishedName"][0]
+                if isinstance(attributeValue, str):
+                    attributeValue = [attributeValue]
                 modlist = []
                 if attributeValue is None or len(attributeValue) == 0:
                     modlist = [(ldap.MOD_DELETE, attributeName, None)]
                     try:
-                        self._ld.modify_s(dn, modlist)
+                        self._ldcall("modify_s", dn, modlist)
                     except Exception as e:
                         # If the attribute doesn't exist anyway, ignore the
                         # exception.
                         if type(e) != ldap.NO_SUCH_ATTRIBUTE:
                             raise e
+                    self._cacheUpdate(linkid, attributeName, None)
                 else:
                     modlist = [(ldap.MOD_REPLACE, attributeName,
-                                [attributeValue.encode(self._targetEncoding)])]
-                    self._ld.modify_s(dn, modlist)
+                                [val.encode(self._targetEncoding)
+                                 for val in attributeValue])]
+                    self._ldcall("modify_s", dn, modlist)
+                    self._cacheUpdate(linkid, attributeName, list(attributeValue))
+
+            def applyChanges(self, changesets) -> tuple:
+                """
+                Bulk version of setAttribute (see
+                AccountManager.applyChanges).  The users' DNs are looked up
+                together, every change to a user is made with a single
+                modify, and the modifies are sent without waiting on each
+                result, as in addUserToGroups.
+
+                changesets: an iterable of (linkid, { attribute name: value }),
+                with values as setAttribute accepts them.  None or an empty
+                value clears the attribute.
+
+                Returns a tuple of ([linkids of users updated],
+                [(linkid, exception) for users that could not be updated]).
+                """
+                changesets = [(linkid, changes) for linkid, changes in changesets
+                              if changes]
+                users = self.getLinkedUsersInfo([linkid for linkid, changes
+                                                 in changesets])
+                requests = []
+                failed = []
+                for linkid, changes in changesets:
+                    usr = users.get(linkid)
+                    if usr is None:
+                        usr = Exception("No linked AD user was found.")
+                    if isinstance(usr, Exception):
+                        failed.append((linkid, usr))
+                        continue
+                    modlist = []
+                    for attributeName, attributeValue in changes.items():
+                        if isinstance(attributeValue, str):
+                            attributeValue = [attributeValue]
+                        # Replacing an attribute with no values clears it,
+                        # whether or not it is set.
+                        modlist.append((ldap.MOD_REPLACE, attributeName,
+                                        [val.encode(self._targetEncoding)
+                                         for val in attributeValue or []] or None))
+                    requests.append((linkid, "modify",
+                                     (usr["distinguishedName"][0], modlist)))
+                done, modfailed = self._pipelined(requests)
+                changes = dict(changesets)
+                for linkid in done:
+                    for attributeName, attributeValue in changes[linkid].items():
+                        if isinstance(attributeValue, str):
+                            attributeValue = [attributeValue]
+                        self._cacheUpdate(linkid, attributeName,
+                                          list(attributeValue) if attributeValue else None)
+                return (done, failed + modfailed)
 
             def linkUser(self, secondaryMatchVal: str, linkid: str):
                 """
@@ -391,12 +1018,48 @@ class GetADAccountManager():
                 modlist = [(ldap.MOD_REPLACE, linkattr,
                             [linkid.encode(self._targetEncoding)])]
                 # TODO: Error Handling
-                self._ld.modify_s(dn, modlist)
+                self._ldcall("modify_s", dn, modlist)
+                self._cacheInvalidate(linkid)
+
+            def linkUsers(self, pairs) -> tuple:
+                """
+                Bulk version of linkUser (see AccountManager.linkUsers).  The
+                users are found with combined secondary match searches, and
+                the modifies are sent without waiting on each result.
+
+                pairs: an iterable of (secondary match value, linkid).
+
+                Returns a tuple of ([linkids linked],
+                [(linkid, exception) for users that could not be linked]).
+                """
+                pairs = list(pairs)
+                users = self.getSecondaryMatchUsersInfo([val for val, linkid in pairs])
+                linkattr = self._targetLinkAttribute
+                requests = []
+                failed = []
+                for secondaryMatchVal, linkid in pairs:
+                    usr = users.get(secondaryMatchVal)
+                    if usr is None:
+                        usr = Exception("No AD user was found with "
+                                        + self._secondaryMatchAttribute + " "
+                                        + secondaryMatchVal + ".")
+                    if isinstance(usr, Exception):
+                        failed.append((linkid, usr))
+                        continue
+                    modlist = [(ldap.MOD_REPLACE, linkattr,
+                                [linkid.encode(self._targetEncoding)])]
+                    requests.append((linkid, "modify",
+                                     (usr["distinguishedName"][0], modlist)))
+                done, modfailed = self._pipelined(requests)
+                for linkid in done:
+                    self._cacheInvalidate(linkid)
+                return (done, failed + modfailed)
 
             def createUser(self, linkid: str, cn: str, ou: str, sAMAccountName: str,
-                           upn: str, attributes: dict = {}):
+                           upn: str, attributes: dict = {},
+                           password: str = None) -> str:
                 """
-                Create a new AD user account and enable it.
+                Create a new AD user account.
 
                 linkid: The unique ID that maps the datasource user to the target db.
 
@@ -409,9 +1072,58 @@ class GetADAccountManager():
                 upn: the userPrincipalName (username + @domainsuffix)
 
                 attributes: an optional dictionary of additional attribute
-                names and values to be set.
+                names and values to be set, each a single value or a list of
+                values.  Values provided here take the
+                place of the defaults set above (for example, mail).  Setting
+                userAccountControl (along with a password) allows the account
+                to be created already enabled.
+
+                password: an optional initial password for the account.  It is
+                set as part of the same add operation, so the user is never
+                left without one.
 
-                groups: tuple of DNs of groups this account should be made a member of.
+                Returns the DN of the new user.
+                """
+                dn, modlist = self._newUserModlist(linkid, cn, ou, sAMAccountName,
+                                                   upn, attributes, password)
+                # Create the user.
+                try:
+                    self._ldcall("add_s", dn, modlist)
+                except Exception as e:
+                    raise e
+                self._cacheInvalidate(linkid)
+                return dn
+
+            def createUsers(self, records) -> tuple:
+                """
+                Bulk version of createUser (see AccountManager.createUsers).
+                The adds are sent without waiting on each result, as in
+                addUserToGroups.
+
+                records: an iterable of dictionaries of the keyword arguments
+                to createUser for each user.
+
+                Returns a tuple of ({ linkid: DN of the new user },
+                [(linkid, exception) for users that could not be created]).
+                """
+                requests = []
+                dns = {}
+                for record in records:
+                    dn, modlist = self._newUserModlist(**record)
+                    dns[record["linkid"]] = dn
+                    requests.append((record["linkid"], "add", (dn, modlist)))
+                done, failed = self._pipelined(requests)
+                for linkid in done:
+                    self._cacheInvalidate(linkid)
+                return ({linkid: dns[linkid] for linkid in done}, failed)
+
+            def _newUserModlist(self, linkid: str, cn: str, ou: str,
+                                sAMAccountName: str, upn: str,
+                                attributes: dict = {},
+                                password: str = None) -> tuple:
+                """
+                Returns a tuple of (DN, add modlist) for a new AD user
+                account, as described in createUser.
                 """
                 # Build new dn from cn and ou
                 dn = "cn=" + cn + "," + ou
@@ -428,15 +1140,182 @@ class GetADAccountManager():
 
                 # Append attributes to the mod list.
                 for key in attributes.keys():
+                    values = attributes[key]
+                    if isinstance(values, str):
+                        values = [values]
                     # Only add the attribute as a modification if it has a value
-                    if attributes[key] is not None and len(attributes[key]) > 0:
-                        moditm = (key, [attributes[key].encode(self._targetEncoding)])
+                    if values is not None and len(values) > 0:
+                        modlist = [itm for itm in modlist
+                                   if itm[0].lower() != key.lower()]
+                        moditm = (key, [val.encode(self._targetEncoding) for val in values])
                         modlist.append(moditm)
-                # Create the user.
-                try:
-                    self._ld.add_s(dn, modlist)
-                except Exception as e:
-                    raise e
+                if password is not None:
+                    passwd = "\"" + password + "\""
+                    modlist.append(("unicodePwd", [passwd.encode("utf-16-le")]))
+                return (dn, modlist)
+
+            def addUserToGroups(self, dn: str, *groups: str) -> tuple:
+                """
+                Adds the user with the provided DN to AD groups without first
+                checking the user's current membership, as for a newly created
+                user.  All of the group modifications are sent before waiting
+                on any of the results.
+
+                dn: the distinguishedName of the user.
+                groups: one or more Group DNs to add this user to.
+
+                Returns a tuple of DNs for groups the user was added to.  If
+                any could not be updated, an exception listing them is raised
+                after every group has been attempted.
+                """
+                modlist = [(ldap.MOD_ADD, "member",
+                            [dn.encode(self._targetEncoding)])]
+                # An error that the user is already a member is ignored.
+                added, failed = self._pipelined([(grp, "modify", (grp, modlist))
+                                                 for grp in groups],
+                                                (ldap.TYPE_OR_VALUE_EXISTS,))
+                if failed:
+                    raise Exception("Could not add the user to the following "
+                                    "group(s): " + "; ".join(grp + ": " + str(e)
+                                                             for grp, e in failed))
+                return tuple(added)
+
+            def _pipelined(self, requests, ignoreErrors: tuple = ()) -> tuple:
+                """
+                Sends a list of LDAP operations without waiting for the
+                result of each before sending the next, then retries any
+                that failed with a transient error one at a time, with
+                backoff.  With a limiter, only as many operations as it
+                allows are left outstanding; the oldest are collected first.
+
+                requests: a list of (key, operation name, args) tuples.  The
+                operation name is that of an asynchronous LDAPObject method
+                such as "modify"; its synchronous form (such as "modify_s")
+                is used for retries.
+
+                ignoreErrors: errors which mean that the operation had
+                nothing to do.  Operations raising them are counted as
+                neither done nor failed.
+
+                Returns a tuple of ([keys of the operations done],
+                [(key, exception) for the operations that failed]).
+                """
+                done = []
+                failed = []
+                pending = collections.deque()
+                self._ldcall(self._connect)
+
+                def collect():
+                    key, msgid, started = pending.popleft()
+                    error = None
+                    try:
+                        self._ld.result(msgid)
+                        done.append(key)
+                    except ignoreErrors:
+                        pass
+                    except Exception as e:
+                        error = e
+                        failed.append((key, e))
+                    if self._limiter is not None:
+                        self._limiter.release(started, error)
+
+                operations = {}
+                for key, operation, args in requests:
+                    operations[key] = (operation, args)
+                    if self._limiter is not None:
+                        while not self._limiter.acquire(blocking=not pending):
+                            collect()
+                    started = time.monotonic()
+                    try:
+                        msgid = getattr(self._ld, operation)(*args)
+                    except Exception as e:
+                        # The operation was never sent, so free its slot and
+                        # leave it to be retried with the failures.
+                        if self._limiter is not None:
+                            self._limiter.release(started, e)
+                        failed.append((key, e))
+                        continue
+                    pending.append((key, msgid, started))
+                while pending:
+                    collect()
+
+                errors = []
+                for key, e in failed:
+                    if (self._retryPolicy is not None
+                            and self._retryPolicy.shouldRetry(e, 0)):
+                        operation, args = operations[key]
+                        try:
+                            self._ldcall(operation + "_s", *args)
+                            done.append(key)
+                            continue
+                        except ignoreErrors:
+                            continue
+                        except Exception as retryerror:
+                            if self._alreadyApplied(operation + "_s", args, retryerror):
+                                done.append(key)
+                                continue
+                            e = retryerror
+                    errors.append((key, e))
+                return (done, errors)
+
+            def deprovisionUsers(self, users: dict, disable: bool = True,
+                                 ou: str = None) -> tuple:
+                """
+                Disables users and/or moves them to another OU, working from
+                user info that has already been read (such as by
+                getLinkedUsers) rather than looking each user up again.  The
+                changes are sent without waiting on each result, as in
+                addUserToGroups.  Users already disabled or already in the
+                OU are left alone.
+
+                users: a dictionary of { linkid: user info } where user info
+                is of the form getUserInfo returns and includes
+                userAccountControl.
+
+                disable: true if the users should be disabled.
+
+                ou: the DN of the OU to move the users to, or None to leave
+                them where they are.
+
+                Returns a tuple of ([linkids of users changed],
+                [(linkid, exception) for users that could not be changed]).
+                """
+                requests = []
+                newuac = {}
+                for linkid, usr in users.items():
+                    uac = int((usr.get("userAccountControl") or ["0"])[0])
+                    if disable and not uac & UAC_OBJECT_DISABLED:
+                        dn = usr["distinguishedName"][0]
+                        newuac[linkid] = str(uac | UAC_OBJECT_DISABLED)
+                        modlist = [(ldap.MOD_REPLACE, "userAccountControl",
+                                    [newuac[linkid].encode(self._targetEncoding)])]
+                        requests.append((linkid, "modify", (dn, modlist)))
+                disabled, failed = self._pipelined(requests)
+                for linkid in disabled:
+                    self._cacheUpdate(linkid, "userAccountControl",
+                                      [newuac[linkid]])
+
+                moved = []
+                if ou is not None:
+                    target = canonicalDN(ou)
+                    failedids = set(linkid for linkid, e in failed)
+                    requests = []
+                    for linkid, usr in users.items():
+                        dn = usr["distinguishedName"][0]
+                        parsed = canonicalDN(dn)
+                        if linkid not in failedids and parsed.parent is not target:
+                            requests.append((linkid, "rename",
+                                             (dn, parsed.rdn, ou)))
+                    moved, movefailed = self._pipelined(requests)
+                    movedids = set(moved)
+                    for linkid, operation, (dn, rdn, newou) in requests:
+                        if linkid in movedids:
+                            self._cacheUpdate(linkid, "distinguishedName",
+                                              [rdn + "," + newou])
+                    failed += movefailed
+
+                changed = list(dict.fromkeys(disabled + moved))
+                return (changed, failed)
 
             def setUserOU(self, linkid: str, ou: str) -> bool:
                 """
@@ -451,15 +1330,15 @@ class GetADAccountManager():
                 """
                 dn = self.getLinkedUserInfo(linkid)["distinguishedName"][0]
                 # If the user's current ou matches the target ou, don't bother
-                splitdn = dn.split(",", 1)
-                cn = splitdn[0]
-                currentou = splitdn[1]
-                if (currentou == ou):
+                parsed = canonicalDN(dn)
+                cn = parsed.rdn
+                if parsed.parent is canonicalDN(ou):
                     return False
                 try:
-                    self._ld.rename_s(dn, cn, ou)
+                    self._ldcall("rename_s", dn, cn, ou)
                 except Exception as e:
                     raise e
+                self._cacheUpdate(linkid, "distinguishedName", [cn + "," + ou])
                 return True
 
             def assignUserGroups(self, linkid: str, *groups: str) -> tuple:
@@ -478,17 +1357,20 @@ class GetADAccountManager():
 
                 # don't bother trying to add user to group they are already
                 # a member of.
-                if adgrps is not None:
-                    grps_to_assign = [grp for grp in groups
-                                      if grp.lower() not in
-                                      map(lambda x:x.lower(), adgrps)]
-                else:
-                    grps_to_assign = [grp for grp in groups]
+                current = set(map(canonicalDN, adgrps or ()))
+                grps_to_assign = []
+                for grp in groups:
+                    if canonicalDN(grp) not in current:
+                        current.add(canonicalDN(grp))
+                        grps_to_assign.append(grp)
 
                 modlist = [(ldap.MOD_ADD, "member",
                             [dn.encode(self._targetEncoding)])]
                 for grp in grps_to_assign:
-                    self._ld.modify_s(grp, modlist)
+                    self._ldcall("modify_s", grp, modlist)
+                if grps_to_assign:
+                    self._cacheUpdate(linkid, "memberOf",
+                                      list(adgrps or ()) + grps_to_assign)
                 return tuple(grps_to_assign)
 
             def deassignUserGroups(self, linkid: str, *groups: str) -> tuple:
@@ -509,13 +1391,21 @@ class GetADAccountManager():
                     adgrps = ()
                 dn = adusr["distinguishedName"][0]
 
-                grps_to_remove = [grp for grp in groups
-                                  if grp.lower() in
-                                  map(lambda x:x.lower(), adgrps)]
+                current = set(map(canonicalDN, adgrps))
+                grps_to_remove = []
+                for grp in groups:
+                    if canonicalDN(grp) in current:
+                        current.discard(canonicalDN(grp))
+                        grps_to_remove.append(grp)
                 modlist = [(ldap.MOD_DELETE, "member",
                             [dn.encode(self._targetEncoding)])]
                 for grp in grps_to_remove:
-                    self._ld.modify_s(grp, modlist)
+                    self._ldcall("modify_s", grp, modlist)
+                if grps_to_remove:
+                    removed = set(map(canonicalDN, grps_to_remove))
+                    remaining = [grp for grp in adgrps
+                                 if canonicalDN(grp) not in removed]
+                    self._cacheUpdate(linkid, "memberOf", remaining or None)
                 return tuple(grps_to_remove)
 
             def setUserEnabled(self, linkid: str, enabled: bool):
@@ -536,15 +1426,15 @@ class GetADAccountManager():
                     uacval = int(usr["userAccountControl"][0])
                     dn = usr["distinguishedName"][0]
                     if enabled:
-                        modlist = [(ldap.MOD_REPLACE, "userAccountControl",
-                                    [str(uacval - UAC_OBJECT_DISABLED)
-                                    .encode(self._targetEncoding)])]
+                        uacval = uacval - UAC_OBJECT_DISABLED
                     else:
-                        modlist = [(ldap.MOD_REPLACE, "userAccountControl",
-                                    [str(uacval + UAC_OBJECT_DISABLED)
-                                    .encode(self._targetEncoding)])]
+                        uacval = uacval + UAC_OBJECT_DISABLED
+                    modlist = [(ldap.MOD_REPLACE, "userAccountControl",
+                                [str(uacval).encode(self._targetEncoding)])]
                     try:
-                        self._ld.modify_s(dn, modlist)
+                        self._ldcall("modify_s", dn, modlist)
+                        self._cacheUpdate(linkid, "userAccountControl",
+                                          [str(uacval)])
                         return True
                     except Exception as e:
                         raise e
@@ -561,7 +1451,7 @@ class GetADAccountManager():
                             "unicodePwd",
                             passwd.encode("utf-16-le"))]
                 try:
-                    self._ld.modify_s(dn, modlist)
+                    self._ldcall("modify_s", dn, modlist)
                 except Exception as e:
                     raise PasswordNotSetException(str(e))
 
@@ -584,7 +1474,8 @@ class GetADAccountManager():
                 Attempts deletion of a linked user from AD.
                 """
                 dn = self.getLinkedUserInfo(linkid)["distinguishedName"][0]
-                self._ld.delete_s(dn)
+                self._ldcall("delete_s", dn)
+                self._cacheInvalidate(linkid)
 
             def forcePasswordChange(self, linkid):
                 """
@@ -594,11 +1485,30 @@ class GetADAccountManager():
                 dn = self.getLinkedUserInfo(linkid)["distinguishedName"][0]
                 modlist = [(ldap.MOD_REPLACE,"pwdLastSet",
                             "0".encode(self._targetEncoding))]
-                self._ld.modify_s(dn, modlist)
+                self._ldcall("modify_s", dn, modlist)
+                self._cacheUpdate(linkid, "pwdLastSet", ["0"])
+
+            def _cacheUpdate(self, linkid: str, attributeName: str,
+                             values: list):
+                """
+                Records a change made to a linked user's attribute in the user
+                cache (if one is in use) so later lookups see the change.
+                """
+                if self._userCache is not None:
+                    self._userCache.update(linkid, attributeName, values)
+
+            def _cacheInvalidate(self, linkid: str):
+                """
+                Stops the user cache (if one is in use) from answering lookups
+                for the provided linkid, for changes the cache cannot follow
+                such as new or newly linked accounts.
+                """
+                if self._userCache is not None:
+                    self._userCache.invalidate(linkid)
 
             def finalize(self):
                 # Close LDAP Connection
-                self._ld.unbind()
+                self._disconnect()
 
         self.adam = ADAccountManager(self._ldap_server, self._username,
                                      self._password, self._baseUserDN,
@@ -611,7 +1521,13 @@ class GetADAccountManager():
                                      self._attributesToMap,
                                      securityGroupAssignments=self._securityGroupAssignments,
                                      targetEncoding=self._targetEncoding,
-                                     maxSize=self._maxSize)
+                                     maxSize=self._maxSize,
+                                     userCache=self._userCache,
+                                     lookupChunkSize=self._lookupChunkSize,
+                                     limiter=self._limiter,
+                                     retryPolicy=self._retryPolicy,
+                                     readOnly=self._readOnly,
+                                     ldifWriter=self._ldifWriter)
         return self.adam
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -0,0 +1,161 @@
+"""
+Description: Describes how values of an AD attribute are compared, so that
+datasource values and AD values which AD would consider equal (differing only
+in case, surrounding whitespace, number formatting or value order) are not
+treated as mismatches and rewritten on every sync.
+"""
+
+import re
+
+from AccountManager_Module_AD.ADDistinguishedName import canonicalDN
+
+# The matching syntaxes, by the names used for them in AD_ATTRIBUTE_SYNTAXES.
+SYNTAX_CASE_IGNORE_STRING = "caseIgnoreString"
+SYNTAX_CASE_EXACT_STRING = "caseExactString"
+SYNTAX_INTEGER = "integer"
+SYNTAX_DN = "dn"
+SYNTAXES = (SYNTAX_CASE_IGNORE_STRING, SYNTAX_CASE_EXACT_STRING, SYNTAX_INTEGER,
+            SYNTAX_DN)
+
+
+class ADAttributeSyntax():
+
+    def __init__(self, syntax: str = SYNTAX_CASE_IGNORE_STRING,
+                 multiValued: bool = False, delimiter: str = ";"):
+        """
+        syntax: how values of the attribute are matched.  One of
+        SYNTAX_CASE_IGNORE_STRING (the default for AD string attributes),
+        SYNTAX_CASE_EXACT_STRING, SYNTAX_INTEGER or SYNTAX_DN.
+
+        multiValued: true if the attribute holds a set of values.  The order
+        of the values is ignored when comparing.
+
+        delimiter: for multi-valued attributes, the character separating the
+        individual values in the datasource column.
+        """
+        if syntax not in SYNTAXES:
+            raise ValueError("Unknown attribute syntax " + repr(syntax) + ".  Expected one of "
+                             + ", ".join(SYNTAXES) + ".")
+        self._syntax = syntax
+        self._multiValued = multiValued
+        self._delimiter = delimiter
+
+    @property
+    def syntax(self) -> str:
+        """
+        Returns the matching syntax of the attribute.
+        """
+        return self._syntax
+
+    @property
+    def multiValued(self) -> bool:
+        """
+        Returns true if the attribute holds a set of values.
+        """
+        return self._multiValued
+
+    def datasourceValues(self, value: str) -> list:
+        """
+        Converts a datasource column value into the list of values that should
+        be written to the AD attribute.  Surrounding whitespace is removed and
+        an empty value gives an empty list (the attribute should be cleared).
+        """
+        if value is None:
+            return []
+        if self._multiValued:
+            values = value.split(self._delimiter)
+        else:
+            values = [value]
+        return [val.strip() for val in values if len(val.strip()) > 0]
+
+    def normalize(self, values) -> frozenset:
+        """
+        Returns the normalized form of the provided list of attribute values
+        (or None), suitable for comparison.
+        """
+        if not values:
+            return frozenset()
+        if not self._multiValued:
+            values = values[:1]
+        return frozenset(self._normalizeValue(val) for val in values)
+
+    def equal(self, dsValues: list, adValues: list) -> bool:
+        """
+        Returns true if the values from the datasource and the values in AD
+        are equivalent for this attribute.
+        """
+        return self.normalize(dsValues) == self.normalize(adValues)
+
+    def _normalizeValue(self, value: str):
+        """
+        Returns the normalized form of a single value.
+        """
+        # AD keeps whitespace inside a value as it was written, so only the
+        # ends are trimmed.
+        value = value.strip()
+        if self._syntax == SYNTAX_INTEGER:
+            try:
+                return int(value)
+            except ValueError:
+                return value
+        elif self._syntax == SYNTAX_DN:
+            try:
+                return canonicalDN(value)
+            except ValueError:
+                return re.sub(r"\s*([,=+])\s*", r"\1", value).casefold()
+        elif self._syntax == SYNTAX_CASE_EXACT_STRING:
+            return value
+        else:
+            return value.casefold()
+
+
+# Syntaxes of commonly mapped AD attributes that are not case-ignore,
+# single-valued strings.  Keys are lowercase attribute names.
+DEFAULT_ATTRIBUTE_SYNTAXES = {
+    "useraccountcontrol": ADAttributeSyntax(SYNTAX_INTEGER),
+    "pwdlastset": ADAttributeSyntax(SYNTAX_INTEGER),
+    "accountexpires": ADAttributeSyntax(SYNTAX_INTEGER),
+    "manager": ADAttributeSyntax(SYNTAX_DN),
+    "memberof": ADAttributeSyntax(SYNTAX_DN, multiValued=True),
+    "proxyaddresses": ADAttributeSyntax(SYNTAX_CASE_IGNORE_STRING,
+                                        multiValued=True),
+    "othertelephone": ADAttributeSyntax(SYNTAX_CASE_IGNORE_STRING,
+                                        multiValued=True),
+    "othermobile": ADAttributeSyntax(SYNTAX_CASE_IGNORE_STRING,
+                                     multiValued=True),
+    "url": ADAttributeSyntax(SYNTAX_CASE_IGNORE_STRING, multiValued=True),
+}
+
+
+def parseAttributeSyntaxes(settings: dict) -> dict:
+    """
+    Converts the syntaxes given in the AD_ATTRIBUTE_SYNTAXES setting, of the
+    form { attribute name: syntax }, into a dictionary of
+    { attribute name: ADAttributeSyntax } for getAttributeSyntax.  Each
+    syntax is given as the name of a single-valued syntax (such as
+    "caseExactString"), as a tuple of the syntax name and the delimiter of a
+    multi-valued attribute, or as an ADAttributeSyntax.  Raises ValueError
+    for an unknown syntax name.
+    """
+    syntaxes = {}
+    for name, syntax in settings.items():
+        if isinstance(syntax, str):
+            syntax = ADAttributeSyntax(syntax)
+        elif isinstance(syntax, tuple):
+            syntax = ADAttributeSyntax(syntax[0], multiValued=True, delimiter=syntax[1])
+        syntaxes[name] = syntax
+    return syntaxes
+
+
+def getAttributeSyntax(attributeName: str, overrides: dict = {}) -> ADAttributeSyntax:
+    """
+    Returns the ADAttributeSyntax for the named attribute.  Syntaxes given in
+    overrides (as returned by parseAttributeSyntaxes) take precedence over the
+    defaults.
+    Attributes not otherwise described are case-ignore, single-valued strings.
+    """
+    for name, syntax in overrides.items():
+        if name.lower() == attributeName.lower():
+            return syntax
+    return DEFAULT_ATTRIBUTE_SYNTAXES.get(attributeName.lower(),
+                                          ADAttributeSyntax())
@@ -0,0 +1,148 @@
+"""
+Description: Parsed, canonical form of LDAP distinguished names, so that DNs
+AD considers the same (differing only in case, in whitespace around values
+and separators, or in how special characters are escaped) compare equal.
+Canonical DNs are interned: every spelling of the same DN gives the same
+object, so sets of DNs such as a user's group memberships can be built and
+checked cheaply, and comparing two DNs is an identity check.
+"""
+
+import threading
+import weakref
+from functools import lru_cache
+
+import ldap
+import ldap.dn
+
+
+# The number of DN strings whose parsed form is remembered, so DNs that
+# repeat (such as group DNs in memberOf) are only parsed once.
+PARSED_DN_CACHE_SIZE = 65536
+
+_internLock = threading.Lock()
+# { canonical key: ADDistinguishedName }
+_interned = weakref.WeakValueDictionary()
+
+
+def canonicalDN(dn) -> "ADDistinguishedName":
+    """
+    Returns the interned ADDistinguishedName for the provided DN string.  An
+    ADDistinguishedName is returned as is.
+
+    Raises ValueError if the provided string is not a valid DN.
+    """
+    if isinstance(dn, ADDistinguishedName):
+        return dn
+    return _parse(dn)
+
+
+def sameDN(dn1, dn2) -> bool:
+    """
+    Returns true if the two provided DNs (as strings or
+    ADDistinguishedNames) name the same object.
+    """
+    return canonicalDN(dn1) is canonicalDN(dn2)
+
+
+@lru_cache(maxsize=PARSED_DN_CACHE_SIZE)
+def _parse(dn: str) -> "ADDistinguishedName":
+    """
+    Parses a DN string into its interned ADDistinguishedName.
+    """
+    try:
+        parsed = ldap.dn.str2dn(dn)
+    except ldap.DECODING_ERROR:
+        raise ValueError("Not a valid distinguished name: " + repr(dn))
+    if not parsed:
+        raise ValueError("Not a valid distinguished name: " + repr(dn))
+    # Attribute types are upper-cased as AD writes them, surrounding
+    # whitespace (which AD ignores) is removed from values, and the parts
+    # of a multi-valued RDN are put in a fixed order.
+    rdns = tuple(tuple(sorted((atype.strip().upper(), (avalue or "").strip())
+                              for atype, avalue, flags in rdn))
+                 for rdn in parsed)
+    return _intern(rdns)
+
+
+def _intern(rdns: tuple) -> "ADDistinguishedName":
+    """
+    Returns the interned ADDistinguishedName with the provided RDNs.
+    """
+    dn = ADDistinguishedName(rdns)
+    with _internLock:
+        existing = _interned.get(dn.key)
+        if existing is not None:
+            return existing
+        _interned[dn.key] = dn
+        return dn
+
+
+class ADDistinguishedName():
+    __slots__ = ("_rdns", "_str", "_key", "_parent", "__weakref__")
+
+    def __init__(self, rdns: tuple):
+        """
+        Use canonicalDN to get the ADDistinguishedName for a DN string.
+
+        rdns: a tuple of the RDNs of the DN, starting with the object's own
+        RDN.  Each RDN is a tuple of (attribute type, value) tuples.
+        """
+        self._rdns = rdns
+        self._str = ldap.dn.dn2str([[(atype, avalue, 1) for atype, avalue in rdn]
+                                    for rdn in rdns])
+        self._key = self._str.casefold()
+        self._parent = None
+
+    @property
+    def key(self) -> str:
+        """
+        Returns the canonical, case-folded string form of the DN.  Two DNs
+        name the same object if and only if their keys are equal.
+        """
+        return self._key
+
+    @property
+    def rdn(self) -> str:
+        """
+        Returns the object's own RDN (such as "CN=Smith\\, John") as a
+        string.
+        """
+        return ldap.dn.dn2str([[(atype, avalue, 1)
+                                for atype, avalue in self._rdns[0]]])
+
+    @property
+    def parent(self) -> "ADDistinguishedName":
+        """
+        Returns the DN of the container of the object, or None if the DN has
+        a single RDN.
+        """
+        if self._parent is None and len(self._rdns) > 1:
+            self._parent = _intern(self._rdns[1:])
+        return self._parent
+
+    def isWithin(self, container) -> bool:
+        """
+        Returns true if the DN is the same as, or below, the provided
+        container DN (a string or ADDistinguishedName).
+        """
+        container = canonicalDN(container)
+        dn = self
+        while dn is not None:
+            if dn is container:
+                return True
+            dn = dn.parent
+        return False
+
+    def __str__(self) -> str:
+        return self._str
+
+    def __repr__(self) -> str:
+        return "ADDistinguishedName(" + repr(self._str) + ")"
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ADDistinguishedName):
+            return self._key == other._key
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._key)
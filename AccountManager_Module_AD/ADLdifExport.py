@@ -0,0 +1,298 @@
+"""
+Description: Writes the changes a sync would make in AD to an LDIF change
+file instead of making them, so that a large batch of changes (such as the
+annual rollover) can be imported in one go with ldifde or ldapmodify.
+
+ADLdifConnection stands in for the LDAP connection of an ADAccountManager:
+searches are passed through to AD, while adds, modifies, renames (as modrdn
+records) and deletes are written to an ADLdifWriter.  Each change record is
+preceded by a comment naming the user it is for, and a manifest of a SHA-256
+checksum of each user's records is written next to the LDIF file, so that a
+file damaged or edited before it was imported can be detected.
+"""
+
+import base64
+import hashlib
+import itertools
+import os
+import re
+import threading
+
+import ldap
+
+
+# Values that must be base64 encoded in LDIF (RFC 2849): those starting with
+# a space, colon or less-than sign, ending with a space, or containing
+# anything other than printable 7-bit characters.
+_UNSAFE_VALUE = re.compile(b'(^[ :<])|[\x00\n\r\x80-\xff]|( $)')
+# The attributes that must be unique among the objects an export adds, as
+# AD requires them to be, compared without regard to case.
+UNIQUE_ADD_ATTRIBUTES = ("distinguishedName", "sAMAccountName", "userPrincipalName")
+# The longest line written before folding onto continuation lines.
+LDIF_LINE_LENGTH = 76
+USER_COMMENT = "# user:"
+
+_MOD_OPS = {ldap.MOD_ADD: "add", ldap.MOD_DELETE: "delete",
+            ldap.MOD_REPLACE: "replace"}
+
+
+def manifestPath(path: str) -> str:
+    """
+    Returns the path of the checksum manifest for the LDIF file at path.
+    """
+    return path + ".sha256"
+
+
+class ADLdifWriter():
+
+    def __init__(self, path: str, targetEncoding: str = "utf-8"):
+        """
+        Creates (or replaces) the LDIF change file at path.  The file may
+        hold initial passwords, so it is only readable by its owner.
+
+        targetEncoding: the character set encoding in use by the directory.
+        """
+        self._path = path
+        self._targetEncoding = targetEncoding
+        self._lock = threading.Lock()
+        # { user DN: (running checksum, record count) }
+        self._users = {}
+        # The lower-case (attribute, value) of each UNIQUE_ADD_ATTRIBUTES
+        # value of the objects added so far.
+        self._added = set()
+        self.records = 0
+        self._file = open(path, "w", encoding="ascii", newline="\n",
+                          opener=_privateOpen)
+        self._file.write("version: 1\n\n")
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def add(self, dn: str, modlist: list):
+        """
+        Writes an add record for a new object, with modlist of the form
+        [ (attribute name, [raw values]) ].  Raises ldap.ALREADY_EXISTS,
+        writing nothing, if an object already added to the file has the same
+        DN, sAMAccountName or userPrincipalName, since the import would fail
+        on it.
+        """
+        lines = [self._line("dn", dn), "changetype: add"]
+        unique = {("distinguishedname", dn.lower())}
+        for atr, values in modlist:
+            lines += [self._line(atr, val) for val in values or ()]
+            if atr.lower() in (name.lower() for name in UNIQUE_ADD_ATTRIBUTES):
+                unique.update((atr.lower(), (val.decode(self._targetEncoding)
+                                             if isinstance(val, bytes) else val).lower())
+                              for val in values or ())
+        with self._lock:
+            taken = unique & self._added
+            if taken:
+                raise ldap.ALREADY_EXISTS({"desc": "Already exists in the LDIF export",
+                                           "info": ", ".join(atr + "=" + val
+                                                             for atr, val in sorted(taken))})
+            self._added |= unique
+        self._write(dn, lines)
+
+    def modify(self, dn: str, modlist: list):
+        """
+        Writes a modify record, with modlist of the form
+        [ (ldap.MOD_ADD/MOD_DELETE/MOD_REPLACE, attribute name,
+           [raw values] or None) ].
+        """
+        lines = [self._line("dn", dn), "changetype: modify"]
+        for op, atr, values in modlist:
+            if isinstance(values, bytes):
+                values = [values]
+            lines.append(_MOD_OPS[op] + ": " + atr)
+            lines += [self._line(atr, val) for val in values or ()]
+            lines.append("-")
+        user = dn
+        if (len(modlist) == 1 and modlist[0][1].lower() == "member"
+                and modlist[0][2]):
+            # A group membership change is recorded against the member.
+            member = modlist[0][2]
+            member = member if isinstance(member, bytes) else member[0]
+            user = member.decode(self._targetEncoding)
+        self._write(user, lines)
+
+    def rename(self, dn: str, newrdn: str, newsuperior: str = None):
+        """
+        Writes a modrdn record, moving the object to newsuperior if
+        provided.
+        """
+        lines = [self._line("dn", dn), "changetype: modrdn",
+                 self._line("newrdn", newrdn), "deleteoldrdn: 1"]
+        if newsuperior is not None:
+            lines.append(self._line("newsuperior", newsuperior))
+        self._write(dn, lines)
+
+    def delete(self, dn: str):
+        """
+        Writes a delete record.
+        """
+        self._write(dn, [self._line("dn", dn), "changetype: delete"])
+
+    def close(self):
+        """
+        Closes the LDIF file and writes the checksum manifest, one line per
+        user of the form "<sha256>  <record count>  <user DN>".
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            with open(manifestPath(self._path), "w", encoding="utf-8") as f:
+                for user, (digest, count) in self._users.items():
+                    f.write(digest.hexdigest() + "  " + str(count) + "  " + user + "\n")
+
+    def _line(self, atr: str, value) -> str:
+        """
+        Returns the (folded) LDIF line for an attribute value, base64
+        encoding the value if needed.
+        """
+        if isinstance(value, str):
+            value = value.encode(self._targetEncoding)
+        if _UNSAFE_VALUE.search(value):
+            line = atr + ":: " + base64.b64encode(value).decode("ascii")
+        else:
+            line = atr + ": " + value.decode("ascii")
+        return _fold(line)
+
+    def _write(self, user: str, lines: list):
+        """
+        Writes a change record, preceded by a comment naming the user it is
+        for, and adds it to the user's checksum.
+        """
+        record = "\n".join(lines) + "\n"
+        with self._lock:
+            self._file.write("# " + self._line("user", user) + "\n")
+            self._file.write(record + "\n")
+            self._file.flush()
+            digest, count = self._users.get(user, (None, 0))
+            if digest is None:
+                digest = hashlib.sha256()
+            digest.update(record.encode("ascii"))
+            self._users[user] = (digest, count + 1)
+            self.records += 1
+
+
+def _privateOpen(path: str, flags: int) -> int:
+    """
+    Opens a file with the provided os.open flags, creating it so that it is
+    only accessible by its owner.
+    """
+    return os.open(path, flags, 0o600)
+
+
+def _fold(line: str) -> str:
+    """
+    Folds a line longer than LDIF_LINE_LENGTH onto continuation lines.
+    """
+    if len(line) <= LDIF_LINE_LENGTH:
+        return line
+    parts = [line[:LDIF_LINE_LENGTH]]
+    for i in range(LDIF_LINE_LENGTH, len(line), LDIF_LINE_LENGTH - 1):
+        parts.append(" " + line[i:i + LDIF_LINE_LENGTH - 1])
+    return "\n".join(parts)
+
+
+def verifyExport(path: str) -> list:
+    """
+    Checks the LDIF change file at path against its checksum manifest.
+    Returns a list of the DNs of the users whose records are missing,
+    damaged or were changed after the file was written, including users
+    with records that are not in the manifest.
+    """
+    users = {}
+    with open(path, "r", encoding="ascii", newline="\n") as f:
+        text = f.read()
+    for block in text.split("\n\n"):
+        if not block.startswith(USER_COMMENT):
+            continue
+        comment, sep, record = block.partition("\n" + "dn")
+        user = comment[len(USER_COMMENT):].replace("\n ", "")
+        if user.startswith(":"):
+            user = base64.b64decode(user[1:].strip()).decode("utf-8")
+        else:
+            user = user.strip()
+        digest, count = users.get(user, (None, 0))
+        if digest is None:
+            digest = hashlib.sha256()
+        digest.update(("dn" + record + "\n").encode("ascii"))
+        users[user] = (digest, count + 1)
+
+    mismatched = []
+    with open(manifestPath(path), "r", encoding="utf-8") as f:
+        for line in f:
+            checksum, count, user = line.rstrip("\n").split("  ", 2)
+            digest, found = users.pop(user, (None, 0))
+            if (digest is None or digest.hexdigest() != checksum
+                    or found != int(count)):
+                mismatched.append(user)
+    return mismatched + list(users)
+
+
+class ADLdifConnection():
+    """
+    Wraps an LDAPObject so that its write operations (synchronous and
+    asynchronous) are written to an ADLdifWriter instead of being sent to
+    the directory.  Every other operation is passed through.
+    """
+
+    def __init__(self, ld, writer: ADLdifWriter):
+        self._ld = ld
+        self._writer = writer
+        # Message ids for the asynchronous writes, kept apart from those of
+        # the real connection (which are positive) and from RES_ANY (-1).
+        self._msgids = itertools.count(-2, -1)
+        self._written = set()
+
+    def __getattr__(self, name: str):
+        return getattr(self._ld, name)
+
+    def add_s(self, dn: str, modlist: list):
+        self._writer.add(dn, modlist)
+
+    def modify_s(self, dn: str, modlist: list):
+        self._writer.modify(dn, modlist)
+
+    def rename_s(self, dn: str, newrdn: str, newsuperior: str = None,
+                 delold: int = 1):
+        self._writer.rename(dn, newrdn, newsuperior)
+
+    def delete_s(self, dn: str):
+        self._writer.delete(dn)
+
+    def add(self, dn: str, modlist: list) -> int:
+        self.add_s(dn, modlist)
+        return self._msgid()
+
+    def modify(self, dn: str, modlist: list) -> int:
+        self.modify_s(dn, modlist)
+        return self._msgid()
+
+    def rename(self, dn: str, newrdn: str, newsuperior: str = None,
+               delold: int = 1) -> int:
+        self.rename_s(dn, newrdn, newsuperior)
+        return self._msgid()
+
+    def delete(self, dn: str) -> int:
+        self.delete_s(dn)
+        return self._msgid()
+
+    def result(self, msgid: int = ldap.RES_ANY, *args, **kwargs):
+        """
+        Returns at once for a write written to the LDIF file; otherwise
+        waits for the result from the directory.
+        """
+        if msgid in self._written:
+            self._written.discard(msgid)
+            return (None, [])
+        return self._ld.result(msgid, *args, **kwargs)
+
+    def _msgid(self) -> int:
+        msgid = next(self._msgids)
+        self._written.add(msgid)
+        return msgid
@@ -0,0 +1,197 @@
+"""
+Description: Adaptive limiter for the LDAP operations sent to a domain
+controller, so the sync can run as fast as the DC comfortably allows without
+slowing down the logons it also serves.
+
+Operations are limited in two ways:
+- A token bucket caps the number of operations started per second.
+- The number of operations outstanding at once (across every connection that
+  shares the limiter) is adjusted AIMD style from the time the sampled
+  operations take (the callers sample only writes): it grows by one for each
+  round of operations that complete within the target latency, and is cut by a
+  fixed factor when they slow down or the DC reports it is busy.  A busy DC
+  (BUSY, UNAVAILABLE or TIMELIMIT_EXCEEDED) also pauses every operation for
+  a backoff period that doubles while the DC keeps refusing work.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+import ldap
+
+
+# Errors with which a DC signals that it is overloaded.
+BUSY_ERRORS = (ldap.BUSY, ldap.UNAVAILABLE, ldap.TIMELIMIT_EXCEEDED)
+
+
+class ADRateLimiter():
+    # Factor the outstanding operation limit is multiplied by when the DC
+    # slows down.
+    DECREASE_FACTOR = 0.5
+    # Weight given to each new latency sample in the moving average.
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self, maxOpsPerSecond: float = None,
+                 maxConcurrency: int = 8, minConcurrency: int = 1,
+                 targetLatency: float = 0.25, maxBackoff: float = 60):
+        """
+        maxOpsPerSecond: the most operations that may be started per second,
+        or None for no limit.
+
+        maxConcurrency: the most operations that may be outstanding at once.
+
+        minConcurrency: the outstanding operation limit is never cut below
+        this.
+
+        targetLatency: the average operation time, in seconds, above which
+        the DC is considered to be under strain.
+
+        maxBackoff: the longest time, in seconds, operations are paused for
+        after the DC reports it is busy.
+        """
+        self._rate = maxOpsPerSecond
+        self._maxConcurrency = max(1, maxConcurrency)
+        self._minConcurrency = max(1, min(minConcurrency, self._maxConcurrency))
+        self._targetLatency = targetLatency
+        self._maxBackoff = maxBackoff
+
+        self._condition = threading.Condition()
+        self._limit = float(self._maxConcurrency)
+        self._outstanding = 0
+        self._tokens = maxOpsPerSecond or 0.0
+        self._tokenTime = time.monotonic()
+        self._latency = None
+        self._lastDecrease = 0.0
+        self._backoff = 0.0
+        self._pausedUntil = 0.0
+        self._busyErrors = 0
+
+    @property
+    def concurrency(self) -> int:
+        """
+        Returns the current limit on outstanding operations.
+        """
+        return int(self._limit)
+
+    @property
+    def latency(self) -> float:
+        """
+        Returns the moving average operation time in seconds, or None if no
+        operation has completed yet.
+        """
+        return self._latency
+
+    @property
+    def busyErrors(self) -> int:
+        """
+        Returns the number of operations the DC has refused as busy.
+        """
+        return self._busyErrors
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Waits until another operation may be started and reserves it.  Each
+        successful acquire must be matched by a call to release.
+
+        blocking: if false, returns false straight away instead of waiting
+        when the operation cannot be started yet.  A caller that already has
+        operations outstanding should not block, since the slot it is
+        waiting on may be one of its own.
+
+        Returns true once the operation is reserved.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                # None waits for an outstanding operation to be released.
+                wait = None
+                if self._pausedUntil > now:
+                    wait = self._pausedUntil - now
+                elif self._outstanding < int(self._limit):
+                    if self._rate:
+                        self._tokens = min(self._rate,
+                                           self._tokens
+                                           + (now - self._tokenTime) * self._rate)
+                        self._tokenTime = now
+                    if not self._rate or self._tokens >= 1:
+                        if self._rate:
+                            self._tokens -= 1
+                        self._outstanding += 1
+                        return True
+                    wait = (1 - self._tokens) / self._rate
+                if not blocking:
+                    return False
+                self._condition.wait(wait)
+
+    def release(self, started: float, error: Exception = None,
+                sample: bool = True):
+        """
+        Records the completion of an operation reserved by acquire.
+
+        started: the time.monotonic() value when the operation was sent.
+
+        error: the exception the operation raised, if any.
+
+        sample: if false, the operation's time is not taken as a sign of how
+        loaded the DC is (a page of search results, say, whose time depends
+        mostly on its size), so the outstanding operation limit is left
+        alone.  Busy errors are acted on either way.
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._condition:
+            self._outstanding -= 1
+            if isinstance(error, BUSY_ERRORS):
+                self._busyErrors += 1
+                self._backoff = min(self._maxBackoff,
+                                    max(1.0, self._backoff * 2))
+                self._pausedUntil = now + self._backoff
+                self._decrease(now, force=True)
+            elif not sample:
+                if error is None:
+                    self._backoff = 0.0
+            else:
+                if self._latency is None:
+                    self._latency = latency
+                else:
+                    self._latency += (latency - self._latency) \
+                        * self.LATENCY_SMOOTHING
+                if self._latency > self._targetLatency:
+                    self._decrease(now)
+                elif error is None:
+                    self._backoff = 0.0
+                    # Grow by one for each full window of operations.
+                    self._limit = min(float(self._maxConcurrency),
+                                      self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    @contextmanager
+    def operation(self, sample: bool = True):
+        """
+        Context manager that reserves an operation for the duration of the
+        'with' block and records its latency and outcome.
+
+        sample: as for release.
+        """
+        self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.release(started, e, sample)
+            raise
+        self.release(started, sample=sample)
+
+    def _decrease(self, now: float, force: bool = False):
+        """
+        Cuts the outstanding operation limit.  Apart from busy errors, the
+        limit is cut at most once per average operation time, so the
+        operations already in flight when the DC slowed down do not each cut
+        it again.
+        """
+        if not force and now - self._lastDecrease < (self._latency or 0):
+            return
+        self._limit = max(float(self._minConcurrency),
+                          self._limit * self.DECREASE_FACTOR)
+        self._lastDecrease = now
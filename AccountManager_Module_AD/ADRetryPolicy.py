@@ -0,0 +1,95 @@
+"""
+Description: Decides which failed LDAP operations are worth retrying and how
+long to wait before each retry.  Errors that signal a transient problem with
+the DC or the connection to it (the DC being down, busy or slow to answer)
+are retried with jittered exponential backoff, reconnecting first where the
+connection itself may be gone.  Any other error, such as a constraint
+violation, is raised straight away.
+"""
+
+import random
+import threading
+
+import ldap
+
+
+# Errors retried by default.
+DEFAULT_RETRY_ERRORS = ("SERVER_DOWN", "BUSY", "UNAVAILABLE", "TIMEOUT",
+                        "TIMELIMIT_EXCEEDED")
+
+# Errors after which the connection is re-established before retrying.
+DEFAULT_RECONNECT_ERRORS = ("SERVER_DOWN", "TIMEOUT", "CONNECT_ERROR")
+
+
+class ADRetryPolicy():
+
+    def __init__(self, retryErrors=DEFAULT_RETRY_ERRORS,
+                 reconnectErrors=DEFAULT_RECONNECT_ERRORS,
+                 maxAttempts: int = 4, baseDelay: float = 0.5,
+                 maxDelay: float = 30):
+        """
+        retryErrors: the LDAP errors that should be retried, as exception
+        classes or the names of ldap module exceptions (such as "BUSY").
+
+        reconnectErrors: the errors, of those retried, after which the
+        connection to the DC should be re-opened before retrying.
+
+        maxAttempts: the most times an operation is tried in total.
+
+        baseDelay: the longest wait, in seconds, before the first retry.  The
+        longest wait doubles with each further retry.  The actual wait is a
+        random time up to the longest, so that many operations failing
+        together do not all retry at the same moment.
+
+        maxDelay: the longest wait, in seconds, before any retry.
+        """
+        self._retryErrors = self._errorTypes(retryErrors)
+        self._reconnectErrors = self._errorTypes(reconnectErrors)
+        self._maxAttempts = max(1, maxAttempts)
+        self._baseDelay = baseDelay
+        self._maxDelay = maxDelay
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    @property
+    def retries(self) -> int:
+        """
+        Returns the number of retries made under this policy.
+        """
+        return self._retries
+
+    def shouldRetry(self, error: Exception, attempt: int) -> bool:
+        """
+        Returns true if an operation that raised the provided error on the
+        provided attempt (the first being attempt 0) should be tried again.
+        """
+        if attempt + 1 >= self._maxAttempts:
+            return False
+        if not isinstance(error, self._retryErrors):
+            return False
+        with self._lock:
+            self._retries += 1
+        return True
+
+    def needsReconnect(self, error: Exception) -> bool:
+        """
+        Returns true if the connection should be re-opened before retrying an
+        operation that raised the provided error.
+        """
+        return isinstance(error, self._reconnectErrors)
+
+    def delay(self, attempt: int) -> float:
+        """
+        Returns the number of seconds to wait before retrying an operation
+        that failed on the provided attempt.
+        """
+        return random.uniform(0, min(self._maxDelay,
+                                     self._baseDelay * 2 ** attempt))
+
+    def _errorTypes(self, errors) -> tuple:
+        """
+        Converts a list of exception classes or ldap module exception names
+        into a tuple of exception classes.
+        """
+        return tuple(getattr(ldap, err) if isinstance(err, str) else err
+                     for err in errors)
@@ -0,0 +1,92 @@
+"""
+Description: Chooses which of a set of domain controllers an ADAccountManager
+connects to.  Read-only work is spread across every available DC in turn.
+All writes go to a single DC, so that a write and anything that later reads
+it back (including checking a new username is free) never straddle two DCs
+that have not yet replicated with each other.  A DC that cannot be reached is
+passed over until a retry interval has gone by, and writes move to the next
+DC in the list while it is unavailable.
+"""
+
+import threading
+import time
+
+
+class ADServerPool():
+
+    def __init__(self, servers, retryInterval: float = 60):
+        """
+        servers: the DNS names or IP addresses of the DCs, in order of
+        preference for writes.
+
+        retryInterval: the number of seconds a DC that could not be reached
+        is passed over for before it is tried again.
+        """
+        if isinstance(servers, str):
+            servers = [servers]
+        self._servers = tuple(servers)
+        if len(self._servers) == 0:
+            raise ValueError("At least one domain controller must be provided.")
+        self._retryInterval = retryInterval
+        self._downUntil = {}
+        self._failures = {server: 0 for server in self._servers}
+        self._nextRead = 0
+        self._lock = threading.Lock()
+
+    @property
+    def servers(self) -> tuple:
+        """
+        Returns the DCs in the pool.
+        """
+        return self._servers
+
+    @property
+    def failures(self) -> dict:
+        """
+        Returns a dictionary of { DC: number of times it was found to be
+        unavailable }.
+        """
+        return dict(self._failures)
+
+    def writeServer(self) -> str:
+        """
+        Returns the DC that writes (and reads that must see them) should go
+        to: the first DC in the list that is not marked unavailable.
+        """
+        with self._lock:
+            available = self._available()
+            return available[0]
+
+    def readServer(self) -> str:
+        """
+        Returns a DC for read-only work, taking each available DC in turn.
+        """
+        with self._lock:
+            available = self._available()
+            server = available[self._nextRead % len(available)]
+            self._nextRead += 1
+            return server
+
+    def markDown(self, server: str):
+        """
+        Records that the provided DC could not be reached, so it is passed
+        over for the retry interval.
+        """
+        with self._lock:
+            if server in self._failures:
+                self._failures[server] += 1
+                self._downUntil[server] = time.monotonic() + self._retryInterval
+
+    def _available(self) -> list:
+        """
+        Returns the DCs not currently marked unavailable, in preference
+        order.  If every DC is marked unavailable, returns the one due to be
+        retried soonest rather than none at all.
+        """
+        now = time.monotonic()
+        available = [server for server in self._servers
+                     if self._downUntil.get(server, 0) <= now]
+        if not available:
+            available = [min(self._servers,
+                             key=lambda server: self._downUntil[server])]
+        return available
@@ -1,12 +1,16 @@
+import itertools
+import json
 import logging
 import logging.handlers
+import os
 import re
+import threading
 from BufferingSMTPHandler import BufferingSMTPHandler
+import Settings
 from Settings import \
-    IMPORT_CHUNK_SIZE, DS_COLUMN_DEFINITION, \
-    DS_ACCOUNT_IDENTIFIER, DS_STATUS_ACTIVE_VALUES, \
-    DS_STATUS_INACTIVE_VALUES, DS_STATUS_COLUMN_NAME, DS_SECONDARY_MATCH_COLUMN, \
-    DS_USERNAME_COLUMN_NAME, DS_PASSWORD_COLUMN_NAME, \
+    IMPORT_CHUNK_SIZE, DS_COLUMN_DEFINITION, DS_ACCOUNT_IDENTIFIER, \
+    DS_STATUS_ACTIVE_VALUES, DS_STATUS_INACTIVE_VALUES, DS_STATUS_COLUMN_NAME, \
+    DS_SECONDARY_MATCH_COLUMN, DS_USERNAME_COLUMN_NAME, DS_PASSWORD_COLUMN_NAME, \
     AD_DC, AD_USERNAME, AD_PASSWORD, AD_BASE_USER_DN, AD_OU_ASSIGNMENTS, \
     AD_ATTRIBUTE_MAP, AD_GROUP_ASSIGNMENTS, AD_TARGET_ACCOUNT_IDENTIFIER, \
     AD_DEFAULT_USER_OU, AD_SECONDARY_MATCH_ATTRIBUTE, AD_SHOULD_GENERATE_USERNAME, \
@@ -14,387 +18,1187 @@ from Settings import \
     STUDENT_USERNAME_FORMATS, STAFF_USERNAME_FIELDS, STAFF_USERNAME_FORMATS, \
     PASSWORD_ASSIGNMENTS, NEW_USER_NOTIFICATIONS, SMTP_SERVER_IP, SMTP_SERVER_PORT, \
     SMTP_FROM_ADDRESS, SMTP_SERVER_PASSWORD, SMTP_SERVER_USERNAME, \
-    AD_USER_NOTIFICATION_MSG, AD_USER_NOTIFICATION_SUBJECT, \
-    RESET_PASS_COLUMN_NAME, AD_PASS_RESET_NOTIFICATION_SUBJECT, \
-    AD_PASS_RESET_NOTIFICATION_MSG, ACCOUNT_NOTIFICATION_FIELDS
+    AD_USER_NOTIFICATION_MSG, AD_USER_NOTIFICATION_SUBJECT, RESET_PASS_COLUMN_NAME, \
+    AD_PASS_RESET_NOTIFICATION_SUBJECT, AD_PASS_RESET_NOTIFICATION_MSG, \
+    ACCOUNT_NOTIFICATION_FIELDS
 
 
 from AccountManager import AccountManager  # for atom code completion
+from AccountSyncer import AccountSyncer, shardFilter, parseRecord
 from AccountManager_Module_AD.ADAccountManager import \
-    GetADAccountManager
+    GetADAccountManager, UAC_OBJECT_NORMAL_ACCOUNT, UAC_OBJECT_DISABLED
 from AccountManager_Module_AD.ADOrgUnitAssignments import ADOrgUnitAssignment
+from AccountManager_Module_AD.ADAttributeSyntax import getAttributeSyntax, \
+    parseAttributeSyntaxes
+from AccountManager_Module_AD.ADDistinguishedName import canonicalDN
+from AccountManager_Module_AD.ADLdifExport import ADLdifWriter, verifyExport
+from AccountManager_Module_AD.ADRateLimiter import ADRateLimiter
+from AccountManager_Module_AD.ADRetryPolicy import ADRetryPolicy
+from AccountManager_Module_AD.ADServerPool import ADServerPool
+from AccountManager_Module_AD.ADUserCache import ADUserCache
 from CSVPager import CSVPager
 from Exceptions import NoFreeUserNamesException, \
                        UserNameInvalidFieldDataException, \
                        PasswordNotSetException
 from PasswordAssignments import PasswordAssignment
+from SyncCheckpoint import SyncCheckpoint
+from SyncLedger import SyncLedger
+from SyncPipeline import SyncPipeline
+from SortedMerge import externalSort, mergeJoin
+from SQLPager import SQLPager
 from NewUserNotifications import NewUserNotification
 from smtplib import SMTP, SMTPException
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 
+# Settings added after the first release are read with a default, so that a
+# Settings.py written for an earlier version still works.
+AD_DC_RETRY_INTERVAL = getattr(Settings, "AD_DC_RETRY_INTERVAL", 60)
+SYNC_CHECKPOINT_PATH = getattr(Settings, "SYNC_CHECKPOINT_PATH", None)
+AD_USER_CACHE_PATH = getattr(Settings, "AD_USER_CACHE_PATH", None)
+AD_USER_CACHE_FULL_REFRESH_DAYS = getattr(Settings, "AD_USER_CACHE_FULL_REFRESH_DAYS", 7)
+AD_LOOKUP_CHUNK_SIZE = getattr(Settings, "AD_LOOKUP_CHUNK_SIZE", 100)
+AD_ATTRIBUTE_SYNTAXES = parseAttributeSyntaxes(getattr(Settings, "AD_ATTRIBUTE_SYNTAXES", {}))
+SYNC_PIPELINE_QUEUE_SIZE = getattr(Settings, "SYNC_PIPELINE_QUEUE_SIZE", 2)
+SYNC_PIPELINE_RESOLVE_WORKERS = getattr(Settings, "SYNC_PIPELINE_RESOLVE_WORKERS", 1)
+SYNC_PIPELINE_WRITE_WORKERS = getattr(Settings, "SYNC_PIPELINE_WRITE_WORKERS", 1)
+SYNC_LEDGER_PATH = getattr(Settings, "SYNC_LEDGER_PATH", None)
+AD_RATE_LIMIT_OPS_PER_SECOND = getattr(Settings, "AD_RATE_LIMIT_OPS_PER_SECOND", None)
+AD_RATE_LIMIT_MAX_CONCURRENCY = getattr(Settings, "AD_RATE_LIMIT_MAX_CONCURRENCY", None)
+AD_RATE_LIMIT_TARGET_LATENCY = getattr(Settings, "AD_RATE_LIMIT_TARGET_LATENCY", 0.25)
+AD_RATE_LIMIT_MAX_BACKOFF = getattr(Settings, "AD_RATE_LIMIT_MAX_BACKOFF", 60)
+AD_RETRY_ERRORS = getattr(Settings, "AD_RETRY_ERRORS",
+                          ("SERVER_DOWN", "BUSY", "UNAVAILABLE", "TIMEOUT",
+                           "TIMELIMIT_EXCEEDED"))
+AD_RETRY_MAX_ATTEMPTS = getattr(Settings, "AD_RETRY_MAX_ATTEMPTS", 4)
+AD_RETRY_BASE_DELAY = getattr(Settings, "AD_RETRY_BASE_DELAY", 0.5)
+AD_RETRY_MAX_DELAY = getattr(Settings, "AD_RETRY_MAX_DELAY", 30)
+AD_USER_PREFETCH_WORKERS = getattr(Settings, "AD_USER_PREFETCH_WORKERS", 1)
+AD_USER_PREFETCH_PARTITIONS = getattr(Settings, "AD_USER_PREFETCH_PARTITIONS", None)
+SYNC_MERGE_JOIN = getattr(Settings, "SYNC_MERGE_JOIN", False)
+SYNC_MERGE_JOIN_SORT_CHUNK_SIZE = getattr(Settings, "SYNC_MERGE_JOIN_SORT_CHUNK_SIZE", 100000)
+SYNC_MERGE_JOIN_TEMP_DIR = getattr(Settings, "SYNC_MERGE_JOIN_TEMP_DIR", None)
+AD_ORPHAN_ACTION = getattr(Settings, "AD_ORPHAN_ACTION", None)
+AD_ORPHAN_OU = getattr(Settings, "AD_ORPHAN_OU", None)
+AD_ORPHAN_MAX_COUNT = getattr(Settings, "AD_ORPHAN_MAX_COUNT", 100)
+AD_ORPHAN_MAX_PERCENT = getattr(Settings, "AD_ORPHAN_MAX_PERCENT", 5)
+AD_LDIF_EXPORT_PATH = getattr(Settings, "AD_LDIF_EXPORT_PATH", None)
+
 # Define any characters that should be excluded from newly generated usernames
 # for AD.
 AD_USERNAME_INVALID_CHARS = "/\\[]:;|=+*?<>\"@. "
 
 
-class ADSyncer():
-    # TODO: Make this an implementation of abstract class, AccountSyncer
+class ADSyncer(AccountSyncer):
+    # What needs to be done in AD for a datasource user.
+    ACTION_SYNC = "sync"
+    ACTION_LINK = "link"
+    ACTION_CREATE = "create"
+
     def __init__(self, logger: logging.Logger, args):
-        self._logger = logger
-        self._args = args
+        super().__init__(logger, args)
+        self._userCache = None
+        self._ledger = None
+        self._servers = ADServerPool(AD_DC, AD_DC_RETRY_INTERVAL)
+        # One limiter is shared by every connection the sync makes to the DC.
+        self._limiter = None
+        if AD_RATE_LIMIT_MAX_CONCURRENCY:
+            self._limiter = ADRateLimiter(AD_RATE_LIMIT_OPS_PER_SECOND,
+                                          AD_RATE_LIMIT_MAX_CONCURRENCY,
+                                          targetLatency=AD_RATE_LIMIT_TARGET_LATENCY,
+                                          maxBackoff=AD_RATE_LIMIT_MAX_BACKOFF)
+        self._retryPolicy = ADRetryPolicy(AD_RETRY_ERRORS,
+                                          maxAttempts=AD_RETRY_MAX_ATTEMPTS,
+                                          baseDelay=AD_RETRY_BASE_DELAY,
+                                          maxDelay=AD_RETRY_MAX_DELAY)
+        self._local = threading.local()
+        self._countersLock = threading.Lock()
+        # Counts of attribute values written and of values left alone because
+        # they already matched.
+        self._attributeWrites = 0
+        self._attributeNoops = 0
+        # Count of inactive users found to need no changes at all.
+        self._deprovisionedSkips = 0
+        # Count of datasource users who could not be fully synced, or were
+        # left to be synced on the next run.
+        self._failedUsers = 0
+        # Linked AD users seen while looking for orphans (linked AD users
+        # whose linkid is not in the datasource), the number of orphans and
+        # the number of orphans the orphan sweep would change.
+        self._linkedUsers = 0
+        self._orphanedUsers = 0
+        self._orphansAffected = 0
+        # { linkid: user info } of the orphans the sweep would change, up to
+        # one more than AD_ORPHAN_MAX_COUNT.
+        self._orphans = {}
+        self._orphansChanged = 0
+        # { lower-case username: linkid } of the usernames handed out to new
+        # users during the run.  Write workers running at the same time (and
+        # the users of an LDIF export, whose accounts are not yet in AD)
+        # would otherwise all find the same username free in AD.
+        self._userNames = {}
+        self._userNamesLock = threading.Lock()
+        # The linkids of the datasource, lower-cased, collected as it is
+        # synced so orphans can be found without reading it again.
+        self._seenLinkIds = set()
+        # For an LDIF export: the writer, and what the reconcile run after
+        # the import needs to check: { linkid: DN } of the accounts created,
+        # the linkids linked and [linkid, notification name, contacts,
+        # account info row] for each notification held back.
+        self._ldifWriter = None
+        self._exportCreated = {}
+        self._exportLinked = []
+        self._exportNotifications = []
+        # The checkpoint journal of the run, and the record the run resumes
+        # from with the notifications held over from the interrupted run,
+        # set up by resumeIndex.
+        self._checkpoint = None
+        self._resumeFrom = 0
+        self._notifyEmails = {}
+        self._passResetNotifyEmails = {}
 
-    def runSyncProcess(self):
+    def resumeIndex(self, pager: CSVPager) -> int:
         """
-        Initiates the sync process.
+        Opens the checkpoint journal for the run and, if --Resume was given,
+        loads the progress of the interrupted run from it (see
+        AccountSyncer.resumeIndex).
+        """
+        # Pick up where an interrupted run left off if requested.  A merge
+        # join run works through the datasource in linkid order, so its
+        # progress cannot be recorded by datasource position.  An LDIF export
+        # is written from the start each time.  The fingerprint of a SQL
+        # datasource is only its query, so a checkpoint cannot tell whether
+        # the rows before it are still the same ones.
+        self._checkpoint = None
+        self._resumeFrom = 0
+        if SYNC_MERGE_JOIN or AD_LDIF_EXPORT_PATH:
+            if self._args.Resume:
+                self._logger.warning("--Resume is not supported when SYNC_MERGE_JOIN or "
+                                     "AD_LDIF_EXPORT_PATH is set. "
+                                     "Starting the sync from the beginning.")
+        elif isinstance(pager, SQLPager):
+            if self._args.Resume:
+                self._logger.warning("--Resume is not supported for a SQL datasource. "
+                                     "Starting the sync from the beginning.")
+        elif SYNC_CHECKPOINT_PATH:
+            checkpoint = SyncCheckpoint(SYNC_CHECKPOINT_PATH + self._pathSuffix(),
+                                        pager.fingerprint)
+            if self._args.Resume:
+                if checkpoint.load():
+                    self._resumeFrom = checkpoint.pageIndex
+                    self._notifyEmails = checkpoint.notifications("new_user")
+                    self._passResetNotifyEmails = checkpoint.notifications("pass_reset")
+                    self._failedUsers = checkpoint.failedUsers
+                    self._logger.info("Resuming sync from checkpoint at datasource "
+                                      "record " + str(self._resumeFrom) + ".")
+                else:
+                    self._logger.warning("No checkpoint was found for this datasource. "
+                                         "Starting the sync from the beginning.")
+            self._checkpoint = checkpoint
+        elif self._args.Resume:
+            self._logger.warning("--Resume was requested, but SYNC_CHECKPOINT_PATH is not "
+                                 "set. Starting the sync from the beginning.")
+        return self._resumeFrom
+
+    def syncDatasource(self, pager: CSVPager, pages) -> bool:
+        """
+        Syncs AD with the datasource (see AccountSyncer.syncDatasource).
         References the common and AD-related settings in Settings.py
+
+        Returns false if any user could not be fully synced, and for an LDIF
+        export, which does not change AD until it is imported.
+        """
+        # For a sharded run, only the users whose linkid falls in this
+        # host's shard are synced.  Files local to the run are kept apart for
+        # each shard in case the hosts share storage.
+        shard = self._args.Shard
+        keyfilter = shardFilter(shard)
+        pathsuffix = self._pathSuffix()
+        if shard is not None:
+            shardnum, shardcount = shard
+            self._logger.info("Syncing shard " + str(shardnum) + " of "
+                              + str(shardcount) + ".")
+
+        if SYNC_LEDGER_PATH:
+            self._ledger = SyncLedger(SYNC_LEDGER_PATH)
+        elif shard is not None:
+            self._logger.error("A sharded sync requires SYNC_LEDGER_PATH to be set so "
+                               "that shards do not assign the same usernames. "
+                               "The sync will not run.")
+            return False
+
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("pager total record count: " + str(pager.csvRecordCount))
+
+        if AD_LDIF_EXPORT_PATH:
+            self._ldifWriter = ADLdifWriter(AD_LDIF_EXPORT_PATH + pathsuffix)
+            self._logger.info("Changes will be written to " + self._ldifWriter.path
+                              + " instead of being made in AD.")
+
+        if AD_USER_CACHE_PATH and not SYNC_MERGE_JOIN and not AD_LDIF_EXPORT_PATH:
+            try:
+                self._refreshUserCache(AD_USER_CACHE_PATH + pathsuffix)
+            except Exception as e:
+                self._logger.error("An error occurred while refreshing the AD user cache. "
+                                   "Linked users will be looked up in AD directly.  "
+                                   "Error details: " + str(e))
+                self._userCache = None
+
+        # Run the pages of the datasource through the sync pipeline.  Each
+        # stage works on a different page at the same time.
+        if SYNC_MERGE_JOIN:
+            source = self._joinPages(pages, keyfilter)
+        else:
+            source = self._resumePages(pager, pages, self._resumeFrom)
+        pipeline = SyncPipeline(source, "parse", SYNC_PIPELINE_QUEUE_SIZE)
+        pipeline.addStage("resolve", self._resolvePage,
+                          SYNC_PIPELINE_RESOLVE_WORKERS)
+        pipeline.addStage("diff", self._planPage)
+        pipeline.addStage("write", self._writePage,
+                          SYNC_PIPELINE_WRITE_WORKERS)
+        pipeline.addStage("notify", self._notifyPage, ordered=True)
+        pipeline.run()
+
+        # Deal with linked AD users that are no longer in the datasource.  A
+        # merge join run has already found them.  An incremental read only
+        # holds the users changed since the last sync, so every other linked
+        # user would look orphaned.
+        incremental = isinstance(pager, SQLPager) and pager.incremental
+        if AD_ORPHAN_ACTION and incremental:
+            self._logger.info("Only the datasource records changed since the last sync "
+                              "were read, so the orphan sweep was skipped.")
+        elif AD_ORPHAN_ACTION:
+            if not SYNC_MERGE_JOIN:
+                self._findOrphans(keyfilter)
+            self._sweepOrphans()
+
+        # End of CSV file reached
+        # Send out new user account notifications.  Shards hand their
+        # notifications to the ledger, and the last shard to finish sends
+        # them all, once every shard of this run (as named by --RunId) has
+        # finished.  The notifications for an LDIF export wait for the
+        # reconcile run after the import.
+        notifications = {"new_user": self._notifyEmails,
+                         "pass_reset": self._passResetNotifyEmails}
+        if self._ldifWriter is not None:
+            self._finishExport()
+            notifications = None
+        elif shard is not None:
+            notifications = self._ledger.spoolNotifications(self._args.RunId,
+                                                            shardnum, shardcount,
+                                                            notifications)
+            if notifications is None:
+                self._logger.info("Notifications have been left for the last shard "
+                                  "to finish to send.")
+        if notifications is not None:
+            self._sendNewUserNotifications(notifications.get("new_user", {}))
+            self._sendPasswordResetNotifications(notifications.get("pass_reset", {}))
+        if self._checkpoint is not None:
+            self._checkpoint.clear()
+        if self._userCache is not None:
+            self._userCache.save()
+        self._logger.info("AD attributes written: " + str(self._attributeWrites)
+                          + ", already up to date: " + str(self._attributeNoops))
+        self._logger.info("Inactive users already deprovisioned: "
+                          + str(self._deprovisionedSkips))
+        if self._failedUsers:
+            self._logger.warning(str(self._failedUsers) + " datasource user(s) could not be "
+                                 "fully synced. They will be synced again on the next run.")
+        if (SYNC_MERGE_JOIN or AD_ORPHAN_ACTION) and not incremental:
+            self._logger.info("Linked AD users not in the datasource: "
+                              + str(self._orphanedUsers)
+                              + ", changed by the orphan sweep: "
+                              + str(self._orphansChanged))
+        self._logger.info("AD operations retried: " + str(self._retryPolicy.retries))
+        if self._limiter is not None:
+            self._logger.info("AD operations refused as busy: "
+                              + str(self._limiter.busyErrors)
+                              + ", outstanding operation limit: "
+                              + str(self._limiter.concurrency))
+        for server, failures in self._servers.failures.items():
+            if failures:
+                self._logger.warning("Domain controller " + server + " could not be reached "
+                                     + str(failures) + " time(s) during the sync.")
+        for stats in pipeline.stats:
+            self._logger.info("Sync stage " + str(stats))
+        self._logger.info("AD Sync Process complete.")
+        return self._failedUsers == 0 and self._ldifWriter is None
+
+    def _userFailed(self, count: int = 1):
+        """
+        Counts datasource users who could not be fully synced, so the run is
+        not reported as having synced every user.
+        """
+        with self._countersLock:
+            self._failedUsers += count
+
+    def _pathSuffix(self) -> str:
+        """
+        Returns the suffix added to the paths of files local to the run.
+        For a sharded run they are kept apart for each shard in case the
+        hosts share storage.
+        """
+        if self._args.Shard is None:
+            return ""
+        shardnum, shardcount = self._args.Shard
+        return ".shard" + str(shardnum) + "of" + str(shardcount)
+
+    def _finishExport(self):
+        """
+        Closes the LDIF export and saves what the reconcile run needs next
+        to it, in <path>.pending.
+        """
+        self._ldifWriter.close()
+        pending = {"created": self._exportCreated,
+                   "linked": self._exportLinked,
+                   "notifications": [[linkid, name, list(contacts), row]
+                                     for linkid, name, contacts, row
+                                     in self._exportNotifications]}
+        # The notifications hold initial passwords, so only the owner may
+        # read the file.
+        tmppath = self._ldifWriter.path + ".pending.tmp"
+        fd = os.open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w') as f:
+            json.dump(pending, f)
+        os.replace(tmppath, self._ldifWriter.path + ".pending")
+        self._logger.info(str(self._ldifWriter.records) + " changes were written to "
+                          + self._ldifWriter.path + ", including "
+                          + str(len(self._exportCreated)) + " new accounts. "
+                          "Import them, then run the sync with --ReconcileLdif.")
+
+    def reconcileExport(self):
+        """
+        Run after an LDIF export has been imported: checks the export against
+        its checksums, checks that the accounts it created or linked are now
+        linked in AD, and sends the notifications held back for them.  The
+        accounts found missing will be created or linked again by the next
+        sync.
+        """
+        if not AD_LDIF_EXPORT_PATH:
+            self._logger.error("--ReconcileLdif requires AD_LDIF_EXPORT_PATH to be set.")
+            return
+        path = AD_LDIF_EXPORT_PATH + self._pathSuffix()
+        try:
+            with open(path + ".pending", 'r') as f:
+                pending = json.load(f)
+            damaged = verifyExport(path)
+        except (OSError, ValueError) as e:
+            self._logger.error("The LDIF export " + path + " could not be reconciled. "
+                               "Error details: " + str(e))
+            return
+        for user in damaged:
+            self._logger.warning("The changes in " + path + " for " + user
+                                 + " do not match the checksums written with them. "
+                                 "The file may have been damaged or edited before "
+                                 "it was imported.")
+
+        linkids = list(pending["created"]) + pending["linked"] \
+            + [note[0] for note in pending["notifications"]]
+        with self._getAccountManager({}) as adam:
+            found = adam.getUsers(list(dict.fromkeys(linkids)), "userPrincipalName")
+        found = {linkid: usr for linkid, usr in found.items()
+                 if not isinstance(usr, Exception)}
+        for linkid, dn in pending["created"].items():
+            if linkid not in found:
+                self._logger.error(linkid + ": The new account " + dn + " was not found "
+                                   "in AD after the LDIF import. It will be created "
+                                   "again on the next sync.")
+        for linkid in pending["linked"]:
+            if linkid not in found:
+                self._logger.error(linkid + ": The AD account was not linked by the LDIF "
+                                   "import. It will be linked again on the next sync.")
+
+        notifications = {"new_user": {}, "pass_reset": {}}
+        for linkid, name, contacts, row in pending["notifications"]:
+            if linkid in found:
+                notifications[name].setdefault(tuple(contacts), []).append(row)
+        self._sendNewUserNotifications(notifications["new_user"])
+        self._sendPasswordResetNotifications(notifications["pass_reset"])
+        os.remove(path + ".pending")
+        self._logger.info("LDIF export reconciled: " + str(len(found)) + " of "
+                          + str(len(set(linkids))) + " accounts found in AD.")
+
+    @property
+    def _adam(self) -> AccountManager:
+        """
+        The AccountManager in use by the current thread.  Each pipeline
+        worker that writes to AD has its own connection.
+        """
+        return self._local.adam
+
+    @_adam.setter
+    def _adam(self, adam: AccountManager):
+        self._local.adam = adam
+
+    def _getAccountManager(self, page: dict,
+                           readOnly: bool = False) -> GetADAccountManager:
+        """
+        Returns a GetADAccountManager for the provided page of datasource
+        records, for use in a 'with' clause.  A readOnly AccountManager may
+        be connected to any of the DCs; otherwise it is connected to the DC
+        that writes are kept on.
+        """
+        return GetADAccountManager(self._servers, AD_USERNAME, AD_PASSWORD,
+                                   AD_BASE_USER_DN,
+                                   page,
+                                   DS_COLUMN_DEFINITION,
+                                   DS_ACCOUNT_IDENTIFIER,
+                                   AD_TARGET_ACCOUNT_IDENTIFIER,
+                                   AD_SECONDARY_MATCH_ATTRIBUTE,
+                                   AD_OU_ASSIGNMENTS,
+                                   AD_ATTRIBUTE_MAP,
+                                   securityGroupAssignments=AD_GROUP_ASSIGNMENTS,
+                                   maxSize=IMPORT_CHUNK_SIZE,
+                                   userCache=self._userCache,
+                                   lookupChunkSize=AD_LOOKUP_CHUNK_SIZE,
+                                   limiter=self._limiter,
+                                   retryPolicy=self._retryPolicy,
+                                   readOnly=readOnly,
+                                   ldifWriter=None if readOnly else self._ldifWriter)
+
+    def _resumePages(self, pager: CSVPager, pages, startIndex: int):
+        """
+        Sync pipeline source: yields the work items for the pages of the
+        datasource from the record at startIndex on, skipping those a resumed
+        run has already synced.  If orphans are to be found, the linkids of
+        every page are collected on the way, including those the datasource
+        validator left out, whose linked AD users are not orphans.  The
+        linkids of the records before the first page read (which a resumed
+        run starts after) are collected from the raw records of the pager.
+        """
+        keyindex = DS_COLUMN_DEFINITION.get(DS_ACCOUNT_IDENTIFIER)
+        first = True
+        for item in pages:
+            if AD_ORPHAN_ACTION:
+                if first and item["index"] > 0:
+                    self._seenLinkIds.update(
+                        row[keyindex].lower()
+                        for row in itertools.islice(pager.records(), item["index"])
+                        if len(row) > keyindex)
+                self._seenLinkIds.update(row[keyindex].lower()
+                                         for row in item["page"].values())
+                self._seenLinkIds.update(linkid.lower() for linkid in item["withheld"])
+            first = False
+            if item["next"] == -1 or item["next"] > startIndex:
+                yield item
+
+    def _joinPages(self, pages, keyFilter=None):
+        """
+        Sync pipeline source for a merge join run: reads the datasource and
+        the linked AD users, each sorted by linkid, and matches them up in a
+        single pass.  Yields a work item for each page of datasource users
+        with their linked AD users already found ("linked"), so only
+        secondary matches are left to look up.  Linked AD users whose linkid
+        is not in the datasource are counted as orphaned, but not those the
+        datasource validator left out.
+
+        keyFilter: for a sharded run, the function the pager uses to select
+        this shard's linkids.  It is applied to the AD users as well.
+        """
+        keyindex = DS_COLUMN_DEFINITION.get(DS_ACCOUNT_IDENTIFIER)
+        # The linkids the datasource validator left out, collected as the
+        # datasource is sorted (before any rows are joined).
+        withheld = set()
+
+        def dsrows():
+            for item in pages:
+                withheld.update(linkid.lower() for linkid in item["withheld"])
+                yield from item["page"].values()
+
+        dsusers = externalSort(dsrows(),
+                               key=lambda row: row[keyindex].lower(),
+                               chunkSize=SYNC_MERGE_JOIN_SORT_CHUNK_SIZE,
+                               tempDir=SYNC_MERGE_JOIN_TEMP_DIR)
+        with self._getAccountManager({}, readOnly=True) as adam:
+            adusers = adam.getLinkedUsersSorted(*self._linkedUserAttributes(),
+                                                sortChunkSize=SYNC_MERGE_JOIN_SORT_CHUNK_SIZE,
+                                                tempDir=SYNC_MERGE_JOIN_TEMP_DIR)
+            if keyFilter is not None:
+                adusers = (user for user in adusers if keyFilter(user[0]))
+
+            page = {}
+            linked = {}
+            for key, rows, linkedusers in mergeJoin(dsusers, adusers,
+                                                    lambda row: row[keyindex].lower(),
+                                                    lambda user: user[0].lower()):
+                self._linkedUsers += len(linkedusers)
+                if not rows:
+                    if key not in withheld:
+                        for linkid, adusr in linkedusers:
+                            self._addOrphan(linkid, adusr)
+                    continue
+                # As on a datasource page, the last of any duplicate rows
+                # is the one synced.
+                linkid = rows[-1][keyindex]
+                page[linkid] = rows[-1]
+                if len(linkedusers) > 1:
+                    linked[linkid] = Exception("Unexpected: More than one user was "
+                                               "returned from this unique ID search!")
+                elif linkedusers:
+                    linked[linkid] = linkedusers[0][1]
+                if len(page) == IMPORT_CHUNK_SIZE:
+                    yield self._joinedPage(page, linked)
+                    page = {}
+                    linked = {}
+            if page:
+                yield self._joinedPage(page, linked)
+
+    def _joinedPage(self, page: dict, linked: dict) -> dict:
+        """
+        Returns the work item for a page of datasource rows put together by
+        a merge join, with the linked users found for them.
+        """
+        return {"index": None, "page": page,
+                "users": [parseRecord(row) for row in page.values()],
+                "linked": linked, "next": None}
+
+    def _findOrphans(self, keyFilter=None):
+        """
+        Finds the linked AD users whose linkid is not in the datasource, by
+        comparing the linkids collected as the datasource was synced with the
+        linkids in the AD user cache or, without a cache, read from AD with a
+        single paged search.
+
+        keyFilter: for a sharded run, the function the pager uses to select
+        this shard's linkids.  Only AD users in the shard are considered.
         """
-        if self._args.DatasourceFileType == 'TSV':
-            dsfiletype = CSVPager.FILE_TYPE_TSV
+        seen = self._seenLinkIds
+        attributes = ["userAccountControl"]
+
+        def check(linkid: str, adusr: dict):
+            if adusr is None or (keyFilter is not None and not keyFilter(linkid)):
+                return
+            self._linkedUsers += 1
+            if linkid.lower() not in seen:
+                self._addOrphan(linkid, adusr)
+
+        if self._userCache is not None:
+            for linkid in list(self._userCache.linkids()):
+                check(linkid, self._userCache.getLinkedUser(linkid, *attributes))
         else:
-            dsfiletype = CSVPager.FILE_TYPE_CSV
-
-        # Sync accounts on paged data.
-        pager = CSVPager(self._args.DatasourcePath,
-                         dsfiletype,
-                         IMPORT_CHUNK_SIZE,
-                         DS_COLUMN_DEFINITION.get(DS_ACCOUNT_IDENTIFIER))
-        self._logger.debug("pager total record count: " + str(pager.csvRecordCount))
-        i = 0
-        notify_emails = {}
-        pass_reset_notify_emails = {}
-        while True:
-            # With each page of records from the CSV file, run the sync process
-            i = pager.getPage(i)
-            currentPage = pager.page
-
-            # With the current page, use ADAccountManager to sync data to AD
-            self._logger.debug("begin accountmanager init")
-            with GetADAccountManager(AD_DC, AD_USERNAME, AD_PASSWORD,
-                                     AD_BASE_USER_DN,
-                                     currentPage,
-                                     DS_COLUMN_DEFINITION,
-                                     DS_ACCOUNT_IDENTIFIER,
-                                     AD_TARGET_ACCOUNT_IDENTIFIER,
-                                     AD_SECONDARY_MATCH_ATTRIBUTE,
-                                     AD_OU_ASSIGNMENTS,
-                                     AD_ATTRIBUTE_MAP,
-                                     securityGroupAssignments=AD_GROUP_ASSIGNMENTS,
-                                     maxSize=IMPORT_CHUNK_SIZE) as self._adam:
-                self._logger.debug("end accountmanager init")
-
-                # Begin sync process for current page of users.
-
-                # For each user in adam.data...
-                for rowid in self._adam.data:
-                    dsusr = self._adam.dataRow(rowid)
-                    linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+            with self._getAccountManager({}, readOnly=True) as adam:
+                for linkid, adusr in adam.getLinkedUsers(*attributes):
+                    check(linkid, adusr)
+
+    def _addOrphan(self, linkid: str, adusr: dict):
+        """
+        Records a linked AD user whose linkid is not in the datasource.
+        Orphans are reported as they are found, or kept for the orphan sweep
+        if it would change them.  No more orphans are kept than needed to
+        tell that the sweep's safety limit has been passed.
+        """
+        self._orphanedUsers += 1
+        if AD_ORPHAN_ACTION == "report":
+            self._logger.warning(linkid + ": Linked AD account "
+                                 + adusr["distinguishedName"][0]
+                                 + " is not in the datasource.")
+        elif AD_ORPHAN_ACTION and self._orphanNeedsAction(adusr):
+            self._orphansAffected += 1
+            if len(self._orphans) <= AD_ORPHAN_MAX_COUNT:
+                self._orphans[linkid] = adusr
+
+    def _orphanNeedsAction(self, adusr: dict) -> bool:
+        """
+        Returns true if the orphan sweep would change the provided linked
+        AD user: it is not yet disabled, or (for the "move" action) is not
+        yet in AD_ORPHAN_OU.
+        """
+        uac = adusr.get("userAccountControl")
+        if not uac or not (int(uac[0]) & UAC_OBJECT_DISABLED):
+            return True
+        if AD_ORPHAN_ACTION == "move" and AD_ORPHAN_OU:
+            currentou = canonicalDN(adusr["distinguishedName"][0]).parent
+            return currentou is not canonicalDN(AD_ORPHAN_OU)
+        return False
+
+    def _sweepOrphans(self):
+        """
+        Disables (and for the "move" action, moves to AD_ORPHAN_OU) the
+        orphans found, unless more of them would be changed than the
+        AD_ORPHAN_MAX_COUNT and AD_ORPHAN_MAX_PERCENT safety limits allow.
+        The orphans are changed in batches, in parallel.
+        """
+        if AD_ORPHAN_ACTION == "report":
+            return
+        if AD_ORPHAN_ACTION not in ("disable", "move"):
+            self._logger.error("Unknown AD_ORPHAN_ACTION " + repr(AD_ORPHAN_ACTION)
+                               + ". Orphaned AD accounts have not been changed.")
+            return
+        if AD_ORPHAN_ACTION == "move" and not AD_ORPHAN_OU:
+            self._logger.error("AD_ORPHAN_ACTION is \"move\" but AD_ORPHAN_OU is not set. "
+                               "Orphaned AD accounts have not been changed.")
+            return
+        percent = self._orphansAffected * 100.0 / max(1, self._linkedUsers)
+        if (self._orphansAffected > AD_ORPHAN_MAX_COUNT
+                or percent > AD_ORPHAN_MAX_PERCENT):
+            self._logger.error("The orphan sweep would change " + str(self._orphansAffected)
+                               + " of " + str(self._linkedUsers) + " linked AD accounts ("
+                               + "%.1f" % percent + "%), which is more than AD_ORPHAN_MAX_COUNT "
+                               "or AD_ORPHAN_MAX_PERCENT allow. The datasource may be incomplete. "
+                               "Orphaned AD accounts have not been changed.")
+            return
+        if not self._orphans:
+            return
+
+        linkids = list(self._orphans)
+        batches = ({linkid: self._orphans[linkid]
+                    for linkid in linkids[i:i + IMPORT_CHUNK_SIZE]}
+                   for i in range(0, len(linkids), IMPORT_CHUNK_SIZE))
+        pipeline = SyncPipeline(batches, "orphans", SYNC_PIPELINE_QUEUE_SIZE)
+        pipeline.addStage("sweep", self._sweepBatch, SYNC_PIPELINE_WRITE_WORKERS)
+        pipeline.run()
+
+    def _sweepBatch(self, batch: dict) -> dict:
+        """
+        Orphan sweep pipeline stage: disables (and, for the "move" action,
+        moves) a batch of orphans, of the form { linkid: user info }.
+        """
+        ou = AD_ORPHAN_OU if AD_ORPHAN_ACTION == "move" else None
+        try:
+            with self._getAccountManager({}) as adam:
+                changed, failed = adam.deprovisionUsers(batch, True, ou)
+        except Exception as e:
+            changed, failed = [], [(linkid, e) for linkid in batch]
+        for linkid in changed:
+            self._logger.info(linkid + ": Linked AD account "
+                              + batch[linkid]["distinguishedName"][0]
+                              + " is not in the datasource and has been "
+                              + ("disabled and moved to " + ou if ou else "disabled") + ".")
+        for linkid, e in failed:
+            self._logger.error(linkid + ": An error occurred while attempting to disable "
+                               "the linked AD account that is not in the datasource. "
+                               "Error details: " + str(e))
+        with self._countersLock:
+            self._orphansChanged += len(changed)
+        return batch
+
+    def _resolvePage(self, item: dict) -> dict:
+        """
+        Sync pipeline stage: looks up the linked AD user for each user on the
+        page, then the secondary match for each active user not yet linked.
+        Users are looked up for the whole page at once; if a bulk lookup
+        fails, they are looked up one at a time.  Linked users already found
+        by a merge join are not looked up again.
+
+        Adds to the work item the linked users ("linked",
+        { linkid: user info }) and the secondary matches ("secondary",
+        { secondary match value: user info }).  A lookup that failed maps to
+        the exception raised.  If the page cannot be looked up at all (for
+        example, no DC can be reached), its users are logged and counted as
+        not synced and left out of the rest of the pipeline.
+        """
+        try:
+            return self._resolveUsers(item)
+        except Exception as e:
+            linkids = [dsusr[DS_ACCOUNT_IDENTIFIER] for dsusr in item["users"]]
+            self._logger.error("An error occurred while attempting to look up the users "
+                               + ", ".join(linkids) + " in AD.  Error details: " + str(e))
+            self._userFailed(len(linkids))
+            item["users"] = []
+            item["linked"] = {}
+            item["secondary"] = {}
+            return item
+
+    def _resolveUsers(self, item: dict) -> dict:
+        """
+        Does the work of _resolvePage.
+        """
+        self._logger.debug("begin accountmanager init")
+        with self._getAccountManager(item["page"], readOnly=True) as adam:
+            self._logger.debug("end accountmanager init (" + adam.server + ")")
+            users = item["users"]
+            attributes = self._linkedUserAttributes()
+
+            if "linked" in item:
+                linkedusers = item["linked"]
+            else:
+                try:
+                    linkedusers = adam.getLinkedUsersInfo(list(adam.data), *attributes)
+                except Exception as e:
+                    self._logger.warning("An error occurred while looking up the linked users "
+                                         "for this page. They will be looked up individually. "
+                                         "Error details: " + str(e))
+                    linkedusers = {}
+                    for rowid in adam.data:
+                        try:
+                            linkedusers[rowid] = adam.getLinkedUserInfo(rowid, *attributes)
+                        except Exception as e:
+                            linkedusers[rowid] = e
+
+            attributes = [AD_TARGET_ACCOUNT_IDENTIFIER] \
+                + [atr.mappedAttribute for atr in AD_ATTRIBUTE_MAP]
+            secondaryvals = [dsusr[DS_SECONDARY_MATCH_COLUMN] for dsusr in users
+                             if linkedusers.get(dsusr[DS_ACCOUNT_IDENTIFIER]) is None
+                             and dsusr[DS_STATUS_COLUMN_NAME] in DS_STATUS_ACTIVE_VALUES
+                             and dsusr[DS_SECONDARY_MATCH_COLUMN]]
+            try:
+                secondaryusers = adam.getSecondaryMatchUsersInfo(secondaryvals,
+                                                                 *attributes)
+            except Exception as e:
+                self._logger.warning("An error occurred while looking up secondary "
+                                     "matches for this page. They will be looked up "
+                                     "individually. Error details: " + str(e))
+                secondaryusers = {}
+                for val in secondaryvals:
                     try:
-                        adusr = self._adam.getLinkedUserInfo(linkid,
-                                                             *[atr.mappedAttribute
-                                                              for atr in AD_ATTRIBUTE_MAP], "userPrincipalName")
+                        secondaryusers[val] = adam.getUserInfo(AD_SECONDARY_MATCH_ATTRIBUTE,
+                                                               val, *attributes)
                     except Exception as e:
-                        self._logger.error(linkid + " An error occurred while attempting to query AD for "
-                                           "linked user information.  Error details: " + str(e))
+                        secondaryusers[val] = e
+
+        item["linked"] = linkedusers
+        item["secondary"] = secondaryusers
+        return item
+
+    def _planPage(self, item: dict) -> dict:
+        """
+        Sync pipeline stage: works out what needs to be done for each user on
+        the page from the datasource rules and the AD users looked up, and
+        adds the list of plans (see _planUser) to the work item as "plans".
+        Users that need nothing done, or whose plan could not be worked out,
+        are left out.
+        """
+        plans = []
+        for dsusr in item["users"]:
+            try:
+                plan = self._planUser(dsusr, item["linked"], item["secondary"])
+            except Exception as e:
+                self._logger.error(dsusr[DS_ACCOUNT_IDENTIFIER] + ": An error occurred while "
+                                   "working out the changes needed for this user.  Error "
+                                   "details: " + str(e))
+                self._userFailed()
+                continue
+            if plan is not None:
+                plans.append(plan)
+        item["plans"] = plans
+        return item
+
+    def _planUser(self, dsusr: dict, linkedusers: dict,
+                  secondaryusers: dict) -> dict:
+        """
+        Works out what needs to be done in AD for the provided datasource
+        user.  Returns None if nothing is to be done, otherwise a dictionary
+        of the form { "action": ACTION_SYNC, ACTION_LINK or ACTION_CREATE,
+        "dsusr": datasource user, "adusr": AD user info } along with, for
+        ACTION_SYNC, the attribute changes ("changes"), groups to add and
+        remove ("assign", "deassign"), the destination OU ("ou") and, for
+        both ACTION_SYNC and ACTION_CREATE, the (password, forcepwdchg) to
+        set ("password") or None.
+        """
+        linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+        adusr = linkedusers.get(linkid)
+        if isinstance(adusr, Exception):
+            self._logger.error(linkid + " An error occurred while attempting to query AD for "
+                               "linked user information.  Error details: " + str(adusr))
+            self._userFailed()
+            return None
+        # Are they linked to a user in AD (by their provided ID)?
+        if adusr is not None:  # If so,
+            changes = self._attributeChanges(dsusr, adusr)
+            synced = sum(1 for itm in AD_ATTRIBUTE_MAP if itm.synchronized)
+            with self._countersLock:
+                self._attributeNoops += synced - len(changes)
+            # Inactive users that have already been fully
+            # deprovisioned don't need anything done.
+            if self._isDeprovisioned(dsusr, adusr, changes):
+                self._logger.debug(linkid + ": Inactive user is already disabled, "
+                                   "removed from all groups and in the correct OU.")
+                with self._countersLock:
+                    self._deprovisionedSkips += 1
+                return None
+            # Sync any updated information
+            self._logger.debug("Linked user found for id: " + linkid
+                               + ".  Syncing information.")
+            # Verify that the user account has a valid UPN before continuing..
+            if adusr['userPrincipalName'] is None:
+                self._logger.error(
+                    linkid + ": Found a user in AD with no userPrincipalName"
+                    " (upn) set. Cannot continue to sync information for this user until this"
+                    " is addressed.  Will attempt again on the next scheduled sync."
+                )
+                self._userFailed()
+                return None
+
+            plan = {"action": self.ACTION_SYNC, "dsusr": dsusr, "adusr": adusr,
+                    "changes": changes,
+                    "ou": self._destinationOU(dsusr), "password": None}
+            plan["assign"], plan["deassign"] = self._groupChanges(dsusr, adusr)
+
+            # Check to see if a password reset is required.
+            if dsusr[RESET_PASS_COLUMN_NAME] == "1":
+                if AD_SHOULD_GENERATE_PASSWORD:
+                    try:
+                        plan["password"] = self._genPassword(dsusr)
+                    except Exception as e:
+                        self._logger.error(linkid + ": There was a problem generating the password for this user. "
+                                           "The password cannot be reset for this user until the problem is resolved.  "
+                                           "Error details: " + str(e))
+                        self._userFailed()
+                else:
+                    try:
+                        plan["password"] = (dsusr[DS_PASSWORD_COLUMN_NAME], True)
+                    except Exception:
+                        self._logger.error(linkid + ": The datasource does not appear to have a password column, but "
+                                           + "AD_SHOULD_GENERATE_PASSWORD is not set.  Cannot reset user password until "
+                                           + "this is resolved.")
+                        self._userFailed()
+            return plan
+
+        # Linked user not found...
+        # Is the user active?
+        if dsusr[DS_STATUS_COLUMN_NAME] not in set(DS_STATUS_ACTIVE_VALUES):
+            # Don't bother looking for a secondary match,
+            # or creating a new account,
+            # the user is not active to begin with...
+            # (for example, this could be a duplicate/old account)
+            self._logger.debug(
+                linkid + ": Unlinked user is not active, will not bother "
+                "looking for secondary match or creating a new account for this user."
+            )
+            return None
+
+        # See if a user exists with a match in the secondary field.
+        # Don't match on an empty secondary field.
+        if (dsusr[DS_SECONDARY_MATCH_COLUMN] is not None
+                and len(dsusr[DS_SECONDARY_MATCH_COLUMN]) > 0):
+            adusr = secondaryusers.get(dsusr[DS_SECONDARY_MATCH_COLUMN])
+            if isinstance(adusr, Exception):
+                self._logger.error(linkid + ": An error occurred while attempting to query AD for "
+                                   "information on this linked user. "
+                                   "Error details: " + str(adusr))
+                self._userFailed()
+                return None
+        if adusr is not None:
+            # Secondary match found,
+            # link the user by updating their ID in AD
+
+            # First verify that the found user is not already
+            # linked to someone else in pschool..
+            if adusr['powerschoolID'] is not None:
+                self._logger.warn(
+                    linkid + ": An AD account with a secondary "
+                    "field match was found for this unlinked user, but "
+                    "it appears to already be linked to another user.  "
+                    "Since secondary match attributes must be unique, "
+                    "this user cannot be linked until this issue is resolved. "
+                    "The datasource may be providing a duplicate user. "
+                    "The conflicting account in AD is: "
+                    + adusr['distinguishedName'][0]
+                )
+                self._userFailed()
+                return None
+            return {"action": self.ACTION_LINK, "dsusr": dsusr, "adusr": adusr}
+
+        # No secondary match found,
+        # Create the user
+        # Grab password for new user and set the
+        # forcepwdchg flag accordingly
+        if AD_SHOULD_GENERATE_PASSWORD:
+            try:
+                password = self._genPassword(dsusr)
+            except Exception as e:
+                self._logger.error(linkid + ": There was a problem generating the password for this user. "
+                                   "The user will not be created until the problem is resolved.  "
+                                   "Error details: " + str(e))
+                self._userFailed()
+                return None
+        else:
+            try:
+                password = (dsusr[DS_PASSWORD_COLUMN_NAME], True)
+            except Exception:
+                self._logger.error(linkid + ": The datasource does not appear to have a password column, but "
+                                   + "AD_SHOULD_GENERATE_PASSWORD is not set.  Cannot create user until "
+                                   + "this is resolved.")
+                self._userFailed()
+                return None
+        return {"action": self.ACTION_CREATE, "dsusr": dsusr, "adusr": None,
+                "password": password}
+
+    def _writePage(self, item: dict) -> dict:
+        """
+        Sync pipeline stage: carries out the plans for the page in AD and adds
+        the resulting notifications to the work item as "notifications", a
+        list of (notification name, contacts, account info row).  For an
+        LDIF export, the notifications are kept for the reconcile run
+        instead.  If no connection to AD can be made for the page, its users
+        are logged and counted as not synced.
+        """
+        notifications = []
+        try:
+            self._writePlans(item, notifications)
+        except Exception as e:
+            self._pageFailed(item["plans"], "write the changes for", e)
+        self._adam = None
+        item["notifications"] = notifications
+        return item
+
+    def _writePlans(self, item: dict, notifications: list):
+        """
+        Does the work of _writePage, adding the notifications for the plans
+        of the work item to the notifications list.
+        """
+        with self._getAccountManager(item["page"]) as self._adam:
+            # Attribute changes and links are sent for the whole page at
+            # once, before the rest of each user's changes.
+            syncplans = [plan for plan in item["plans"]
+                         if plan["action"] == self.ACTION_SYNC]
+            try:
+                self._syncAttributes(syncplans)
+            except Exception as e:
+                self._pageFailed(syncplans, "sync attributes for", e)
+            linkplans = [plan for plan in item["plans"]
+                         if plan["action"] == self.ACTION_LINK]
+            try:
+                self._linkUsers(linkplans)
+            except Exception as e:
+                self._pageFailed(linkplans, "link", e)
+            for plan in item["plans"]:
+                linkid = plan["dsusr"][DS_ACCOUNT_IDENTIFIER]
+                try:
+                    if plan["action"] == self.ACTION_SYNC:
+                        usernotifications = self._syncUser(plan)
+                    elif plan["action"] == self.ACTION_CREATE:
+                        usernotifications = self._newUser(plan)
+                    else:
                         continue
-                    # Are they linked to a user in AD (by their provided ID)?
-                    if adusr is not None:  # If so,
-                        # Sync any updated information
-                        self._logger.debug("Linked user found for id: " + linkid
-                                           + ".  Syncing information.")
-                        # Verify that the user account has a valid UPN before continuing..
-                        if not adusr['userPrincipalName'] is None:
-                            upn = adusr['userPrincipalName'][0]
-                        else:
-                            self._logger.error(
-                                linkid + ": Found a user in AD with no userPrincipalName"
-                                " (upn) set. Cannot continue to sync information for this user until this"
-                                " is addressed.  Will attempt again on the next scheduled sync."
-                            )
-                            continue
-
-                        self._logger.debug(linkid + " syncing attributes"
-                                           + " and group membership.")
-                        try:
-                            self._syncAttributes(dsusr, adusr)
-                        except Exception as e:
-                            self._logger.error(linkid + "An error occurred while attempting to "
-                                               "sync attributes for this user.  Error details: "
-                                               + str(e))
-                        try:
-                            # If the AD user is inactive,
-                            # force eval of all group membership rules...
-                            # If the user is to be reactivated, this will
-                            # ensure they are re-added to the appropriate groups
-
-                            if self._adam.userEnabled(linkid):
-                                self._syncGroupMembership(dsusr, adusr)
-                            else:
-                                self._syncGroupMembership(dsusr=dsusr,
-                                                          adusr=adusr,
-                                                          syncall=True)
-                        except Exception as e:
-                            self._logger.error(linkid + "An error occurred while attempting to "
-                                               "sync group membership for this user.  Error details: "
-                                               + str(e))
-                        # Check to see if a password reset is required and do so if necessary.
-                        r = None
-                        passwd = None
-                        forcepwdchg = None
-                        if dsusr[RESET_PASS_COLUMN_NAME] == "1":
-                            if AD_SHOULD_GENERATE_PASSWORD:
-                                try:
-                                    r = self._genPassword(dsusr)
-                                    passwd = r[0]
-                                    forcepwdchg = r[1]
-                                except Exception as e:
-                                    self._logger.error(linkid + ": There was a problem generating the password for this user. "
-                                                       "The password cannot be reset for this user until the problem is resolved.  "
-                                                       "Error details: " + str(e))
-                            else:
-                                try:
-                                    passwd = dsusr[DS_PASSWORD_COLUMN_NAME]
-                                    forcepwdchg = True
-                                except Exception:
-                                    self._logger.error(linkid + ": The datasource does not appear to have a password column, but "
-                                                       + "AD_SHOULD_GENERATE_PASSWORD is not set.  Cannot reset user password until "
-                                                       + "this is resolved.")
-                            if passwd:
-                                try:
-                                    self._adam.setUserPassword(linkid, passwd)
-                                    # If this user has a notification assignment, add the notification to the password update notifications list.
-                                    for notification in NEW_USER_NOTIFICATIONS:
-                                        if notification.match(dsusr):
-                                            updated_account_info = ["AD",upn,passwd] + \
-                                                [self._adam.dataRow(linkid)[col]
-                                                for col in ACCOUNT_NOTIFICATION_FIELDS]
-                                            if notification.contacts in pass_reset_notify_emails:
-                                                pass_reset_notify_emails[notification.contacts].append(updated_account_info)
-                                            else:
-                                                pass_reset_notify_emails[notification.contacts] = [updated_account_info]
-                                    self._logger.info(linkid + ": The user's password has been reset.  upn: " + upn + ", Initial Password: " + passwd)
-                                except Exception as e:
-                                    # A problem occurred setting the password.
-                                    self._logger.error(linkid + ": Attempting to reset password for existing user failed. "
-                                                       "Error details: " + str(e))
-
-                        # Sync active status *after* password reset
-                        self._logger.debug(linkid + ": Syncing active status.")
-                        try:
-                            self._syncActiveStatus(dsusr, adusr)
-                        except Exception as e:
-                            self._logger.error(linkid + ": An error occurred while attempting to "
-                                               "sync active status for " + upn + ".  Error details: "
-                                               + str(e))
+                except Exception as e:
+                    self._logger.error(linkid + ": An error occurred while attempting to "
+                                       "sync this user.  Error details: " + str(e))
+                    self._userFailed()
+                    continue
+                if self._ldifWriter is None:
+                    notifications += usernotifications
+                else:
+                    with self._countersLock:
+                        self._exportNotifications += [(linkid,) + notification
+                                                      for notification in usernotifications]
 
-                        # Sync the OU last because if a user's OU changes,
-                        # the OU information in adusr will become invalid.
-                        self._logger.debug(linkid + ": Syncing OU.")
-                        try:
-                            self._syncOU(dsusr, adusr)
-                        except Exception as e:
-                            self._logger.error(linkid + ": An error occurred while attempting to "
-                                               "sync the OU for this user.  Error details: "
-                                               + str(e))
-                    else:  # Linked user not found...
-                        # Is the user active?
-                        if (dsusr[DS_STATUS_COLUMN_NAME] in set(DS_STATUS_ACTIVE_VALUES)):
-                            # See if a user exists with a match in the secondary field.
-                            if (dsusr[DS_SECONDARY_MATCH_COLUMN] is not None
-                                and len(dsusr[DS_SECONDARY_MATCH_COLUMN])) > 0:
-                                # Don't match on an empty secondary field.
-                                try:
-                                    adusr = self._adam.getUserInfo(AD_SECONDARY_MATCH_ATTRIBUTE,
-                                                                   dsusr[DS_SECONDARY_MATCH_COLUMN],
-                                                                   AD_TARGET_ACCOUNT_IDENTIFIER,
-                                                                   *[atr.mappedAttribute
-                                                                     for atr in AD_ATTRIBUTE_MAP])
-                                except Exception as e:
-                                    self._logger.error(linkid + ": An error occurred while attempting to query AD for "
-                                                       "information on this linked user. "
-                                                       "Error details: " + str(e))
-                                    continue
-                            else:
-                                adusr = None
-                            if adusr is not None:
-                                # Secondary match found,
-                                # link the user by updating their ID in AD
-                                # Sync any updated information
-
-                                # First verify that the found user is not already
-                                # linked to someone else in pschool..
-                                if adusr['powerschoolID'] is not None:
-                                    self._logger.warn(
-                                        linkid + ": An AD account with a secondary "
-                                        "field match was found for this unlinked user, but "
-                                        "it appears to already be linked to another user.  "
-                                        "Since secondary match attributes must be unique, "
-                                        "this user cannot be linked until this issue is resolved. "
-                                        "The datasource may be providing a duplicate user. "
-                                        "The conflicting account in AD is: "
-                                        + adusr['distinguishedName'][0]
-                                    )
-                                    continue
-
-                                self._logger.debug(linkid + ": Secondary match found for '"
-                                                   + AD_SECONDARY_MATCH_ATTRIBUTE
-                                                   + "'': " + dsusr[DS_SECONDARY_MATCH_COLUMN]
-                                                   + ".  Linking the user."
-                                                   + "  Their account information will be synchronized"
-                                                   + " on the next sync process run.")
-                                try:
-                                    self._adam.linkUser(dsusr[DS_SECONDARY_MATCH_COLUMN],
-                                                        linkid)
-                                except Exception as e:
-                                    self._logger.error(linkid + ": An error occurred while attempting to link an "
-                                                       "existing AD user to the datasource. "
-                                                       " Error details: " + str(e))
-                                    continue
-                                self._logger.info(linkid + ": An unlinked AD user has been found with"
-                                                  + " a matching secondary attribute and linked."
-                                                  + " the rest of their information will be synced"
-                                                  + " during the next sync process run.")
-                            else:
-                                # No secondary match found,
-                                # Create the user
-                                # Grab password for new user and set the
-                                # forcepwdchg flag accordingly
-                                if AD_SHOULD_GENERATE_PASSWORD:
-                                    try:
-                                        r = self._genPassword(dsusr)
-                                    except Exception as e:
-                                        self._logger.error(linkid + ": There was a problem generating the password for this user. "
-                                                           "The user will not be created until the problem is resolved.  "
-                                                           "Error details: " + str(e))
-                                        continue
-                                    passwd = r[0]
-                                    forcepwdchg = r[1]
-                                else:
-                                    try:
-                                        passwd = dsusr[DS_PASSWORD_COLUMN_NAME]
-                                        forcepwdchg = True
-                                    except Exception:
-                                        self._logger.error(linkid + ": The datasource does not appear to have a password column, but "
-                                                           + "AD_SHOULD_GENERATE_PASSWORD is not set.  Cannot create user until "
-                                                           + "this is resolved.")
-                                        continue
-
-                                self._logger.debug(linkid + ": Is active, but was not found in AD. "
-                                                   + "Will attempt to create a new AD account for this user.")
-                                try:
-                                    upn = self._createUser(dsusr)
-                                except Exception as e:
-                                    self._logger.error(linkid + ": An error occurred attempting to "
-                                                       + "create new AD user account. Will attempt creation "
-                                                       + "again on the next sync.  Message: " + str(e.args[0]))
-                                    continue
-
-                                # Now that the user is created, grab the adusr info
-                                try:
-                                    adusr = self._adam.getLinkedUserInfo(linkid,
-                                                                        *[atr.mappedAttribute
-                                                                        for atr in AD_ATTRIBUTE_MAP])
-                                except Exception as e:
-                                    self._logger.error(linkid + ": An error occurred while attempting to query AD for linked "
-                                                       "user information on this newly created user. Error details: " + str(e))
-                                    try:
-                                        self._adam.deleteUser(linkid)
-                                    except Exception as ex:
-                                        self._logger.error(linkid + ": An error occurred while attempting to delete user "
-                                                           "object after a failed creation attempt. This user may need to be "
-                                                           "manually deleted in AD so creation can be attempted again. "
-                                                           "Error details: " + str(ex))
-                                    continue
-
-                                # Set additional attributes for the user per
-                                # the attribute map...
-                                try:
-                                    self._syncAttributes(dsusr, adusr)
-                                except Exception as e:
-                                    self._logger.error(linkid + ": An error occurred while syncing attributes "
-                                                       "for this user.  Error details: " + str(e))
-                                    try:
-                                        self._adam.deleteUser(linkid)
-                                    except Exception as ex:
-                                        self._logger.error(linkid + ": An error occurred while attempting to delete user "
-                                                           "object after a failed creation attempt. This user may need to be "
-                                                           "manually deleted in AD so creation can be attempted again. "
-                                                           "Error details: " + str(ex))
-                                    continue
-
-                                # Join the user to any groups
-                                try:
-                                    self._syncGroupMembership(dsusr, adusr, syncall=True)
-                                except Exception as e:
-                                    self._logger.error(linkid + ": An error occurred while syncing group membership "
-                                                       "for this user.  Error details: " + str(e))
-                                    try:
-                                        self._adam.deleteUser(linkid)
-                                    except Exception as ex:
-                                        self._logger.error(linkid + ": An error occurred while attempting to delete user "
-                                                           "object after a failed creation attempt. This user may need to be "
-                                                           "manually deleted in AD so creation can be attempted again. "
-                                                           "Error details: " + str(ex))
-                                    continue
-                                try:
-                                    self._adam.setUserPassword(linkid, passwd)
-                                except Exception as e:
-                                    # A problem occurred setting the password.
-                                    self._logger.error(linkid + ": Attempting to set password for new user failed. "
-                                                       "Account will be deleted so password set can be attempted "
-                                                       "again next time.  Error details: " + str(e))
-                                    # Delete the user so creation will be re-attempted.
-                                    try:
-                                        self._adam.deleteUser(linkid)
-                                    except Exception as ex:
-                                        self._logger.error(linkid + ": Could not delete this user. Their account may need "
-                                                          "to be manually deleted so creation can be attempted again."
-                                                          "Error details: " + str(ex))
-                                    continue
-                                try:
-                                    self._syncActiveStatus(dsusr, adusr)
-                                except Exception as e:
-                                    self._logger.error(linkid + ": An error occurred while attempting to activate the "
-                                                       "new user account.  Error details: " + str(e))
-
-                                # Force a password change if the flag is set.
-                                if forcepwdchg:
-                                    self._logger.debug(linkid + ": Will be forced to change password on next login")
-                                    try:
-                                        self._adam.forcePasswordChange(linkid)
-                                    except Exception as e:
-                                        self._logger.error(linkid + ": An error occurred while attempting to set the "
-                                                           "\"User Must Change Password\" flag for this user. "
-                                                           "The error details were: " + str(e))
-
-                                self._logger.info(linkid + ": New account has been created.  upn: "
-                                                  + upn + ", Initial password: " + passwd)
-                                # If this new user has a notification assignment, add the notification to the new user notifications list.
-                                for notification in NEW_USER_NOTIFICATIONS:
-                                    if notification.match(dsusr):
-                                        new_account_info = ["AD",upn,passwd] + \
-                                                    	   [self._adam.dataRow(linkid)[col]
-                                                    		for col in ACCOUNT_NOTIFICATION_FIELDS]
-                                        if notification.contacts in notify_emails:
-                                            notify_emails[notification.contacts].append(new_account_info)
-                                        else:
-                                            notify_emails[notification.contacts] = [new_account_info]
-                        else:
-                            # Don't bother looking for a secondary match,
-                            # or creating a new account,
-                            # the user is not active to begin with...
-                            # (for example, this could be a duplicate/old account)
-                            self._logger.debug(
-                                linkid + ": Unlinked user is not active, will not bother "
-                                "looking for secondary match or creating a new account for this user."
-                            )
-            if i == -1:  # End of CSV file reached
-                # Send out new user account notifications
-                self._sendNewUserNotifications(notify_emails)
-                self._sendPasswordResetNotifications(pass_reset_notify_emails)
-                self._logger.info("AD Sync Process complete.")
-                break
+    def _pageFailed(self, plans: list, action: str, error: Exception):
+        """
+        Logs that an operation on the provided plans of a page failed as a
+        whole, naming each of their users, and carries on with the page.
+        """
+        linkids = [plan["dsusr"][DS_ACCOUNT_IDENTIFIER] for plan in plans]
+        self._logger.error("An error occurred while attempting to " + action + " the users "
+                           + ", ".join(linkids) + ".  Error details: " + str(error))
+        self._userFailed(len(linkids))
+
+    def _notifyPage(self, item: dict) -> dict:
+        """
+        Sync pipeline stage: collects the notifications for the page and,
+        once every page before it has also been written, records the page as
+        done in the checkpoint.  Runs on the pages in datasource order.
+        """
+        pending = {"new_user": self._notifyEmails,
+                   "pass_reset": self._passResetNotifyEmails}
+        for name, contacts, account_info in item["notifications"]:
+            if contacts in pending[name]:
+                pending[name][contacts].append(account_info)
+            else:
+                pending[name][contacts] = [account_info]
+        if item["next"] != -1 and self._checkpoint is not None:
+            # The page is done, record progress in case the run is
+            # interrupted before the next one completes.
+            self._checkpoint.save(item["next"], pending, self._failedUsers)
+        return item
+
+    def _syncUser(self, plan: dict) -> list:
+        """
+        Brings the linked AD user in the provided plan up to date with the
+        datasource, apart from the attributes already written by
+        _syncAttributes.  Returns a list of password reset notifications, as
+        described in _writePage.
+        """
+        dsusr = plan["dsusr"]
+        adusr = plan["adusr"]
+        linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+        upn = adusr['userPrincipalName'][0]
+        notifications = []
+
+        failed = False
+        self._logger.debug(linkid + " syncing group membership.")
+        try:
+            self._syncGroupMembership(dsusr, plan["assign"], plan["deassign"])
+        except Exception as e:
+            self._logger.error(linkid + "An error occurred while attempting to "
+                               "sync group membership for this user.  Error details: "
+                               + str(e))
+            failed = True
+        # Reset the password if required.
+        if plan["password"] is not None and plan["password"][0]:
+            passwd = plan["password"][0]
+            try:
+                self._adam.setUserPassword(linkid, passwd)
+                # If this user has a notification assignment, add the notification to the password update notifications list.
+                for notification in NEW_USER_NOTIFICATIONS:
+                    if notification.match(dsusr):
+                        updated_account_info = ["AD", upn, passwd] + \
+                            [dsusr[col] for col in ACCOUNT_NOTIFICATION_FIELDS]
+                        notifications.append(("pass_reset", notification.contacts,
+                                              updated_account_info))
+                self._logger.info(linkid + ": The user's password has been reset.  upn: " + upn + ", Initial Password: " + passwd)
+            except Exception as e:
+                # A problem occurred setting the password.
+                self._logger.error(linkid + ": Attempting to reset password for existing user failed. "
+                                   "Error details: " + str(e))
+                failed = True
+
+        # Sync active status *after* password reset
+        self._logger.debug(linkid + ": Syncing active status.")
+        try:
+            self._syncActiveStatus(dsusr, adusr)
+        except Exception as e:
+            self._logger.error(linkid + ": An error occurred while attempting to "
+                               "sync active status for " + upn + ".  Error details: "
+                               + str(e))
+            failed = True
+
+        # Sync the OU last because if a user's OU changes,
+        # the OU information in adusr will become invalid.
+        self._logger.debug(linkid + ": Syncing OU.")
+        try:
+            self._syncOU(dsusr, plan["ou"])
+        except Exception as e:
+            self._logger.error(linkid + ": An error occurred while attempting to "
+                               "sync the OU for this user.  Error details: "
+                               + str(e))
+            failed = True
+        if failed:
+            self._userFailed()
+        return notifications
+
+    def _linkUsers(self, plans: list):
+        """
+        Links the AD users found by secondary match in the provided plans to
+        their datasource users.  Their account information will be
+        synchronized on the next sync process run.
+        """
+        if not plans:
+            return
+        pairs = []
+        for plan in plans:
+            dsusr = plan["dsusr"]
+            linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+            self._logger.debug(linkid + ": Secondary match found for '"
+                               + AD_SECONDARY_MATCH_ATTRIBUTE
+                               + "'': " + dsusr[DS_SECONDARY_MATCH_COLUMN]
+                               + ".  Linking the user."
+                               + "  Their account information will be synchronized"
+                               + " on the next sync process run.")
+            pairs.append((dsusr[DS_SECONDARY_MATCH_COLUMN], linkid))
+        linked, failed = self._adam.linkUsers(pairs)
+        if self._ldifWriter is not None:
+            with self._countersLock:
+                self._exportLinked += linked
+        for linkid, e in failed:
+            self._logger.error(linkid + ": An error occurred while attempting to link an "
+                               "existing AD user to the datasource. "
+                               " Error details: " + str(e))
+        if failed:
+            self._userFailed(len(failed))
+        for linkid in linked:
+            self._logger.info(linkid + ": An unlinked AD user has been found with"
+                              + " a matching secondary attribute and linked."
+                              + " the rest of their information will be synced"
+                              + " during the next sync process run.")
+
+    def _newUser(self, plan: dict) -> list:
+        """
+        Creates an AD account for the datasource user in the provided plan and
+        joins it to any groups.  Returns a list of new user notifications, as
+        described in _writePage.
+        """
+        dsusr = plan["dsusr"]
+        linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+        passwd, forcepwdchg = plan["password"]
+        notifications = []
+
+        # The user may have been looked up on a DC that has not yet seen an
+        # account created for them elsewhere, so check again on the DC the
+        # account would be created on.  This asks AD itself, as the user
+        # cache holds what was seen before the run.
+        if self._adam.getUserInfo(AD_TARGET_ACCOUNT_IDENTIFIER, linkid) is not None:
+            self._logger.info(linkid + ": A linked AD account was found on " + self._adam.server
+                              + " that was not yet replicated to the DC the user was looked up on. "
+                              + "The user will be synced on the next sync.")
+            self._userFailed()
+            return notifications
+
+        self._logger.debug(linkid + ": Is active, but was not found in AD. "
+                           + "Will attempt to create a new AD account for this user.")
+        # The account is created with its attributes, password
+        # and enabled status in a single add, so a failure
+        # cannot leave a partially created user behind.
+        if forcepwdchg:
+            self._logger.debug(linkid + ": Will be forced to change password on next login")
+        try:
+            upn, dn = self._createUser(dsusr, passwd, forcepwdchg)
+        except Exception as e:
+            self._logger.error(linkid + ": An error occurred attempting to "
+                               + "create new AD user account. Will attempt creation "
+                               + "again on the next sync.  Message: " + str(e.args[0]))
+            self._userFailed()
+            return notifications
+        if self._ldifWriter is not None:
+            with self._countersLock:
+                self._exportCreated[linkid] = dn
+
+        # Join the user to any groups
+        try:
+            self._assignNewUserGroups(dsusr, dn)
+        except Exception as e:
+            self._logger.error(linkid + ": An error occurred while adding the new user to "
+                               "groups. Membership of synchronized groups will be corrected "
+                               "on the next sync.  Error details: " + str(e))
+            self._userFailed()
+
+        self._logger.info(linkid + ": New account has been created.  upn: "
+                          + upn + ", Initial password: " + passwd)
+        # If this new user has a notification assignment, add the notification to the new user notifications list.
+        for notification in NEW_USER_NOTIFICATIONS:
+            if notification.match(dsusr):
+                new_account_info = ["AD", upn, passwd] + \
+                    [dsusr[col] for col in ACCOUNT_NOTIFICATION_FIELDS]
+                notifications.append(("new_user", notification.contacts,
+                                      new_account_info))
+        return notifications
+
+    def _refreshUserCache(self, path: str):
+        """
+        Loads the AD user cache and brings it up to date with AD.  Only users
+        changed since the last run are read unless the cache is missing or a
+        full refresh is due.
+        """
+        self._userCache = ADUserCache(path, AD_BASE_USER_DN,
+                                      AD_TARGET_ACCOUNT_IDENTIFIER,
+                                      [AD_SECONDARY_MATCH_ATTRIBUTE,
+                                       "userPrincipalName", "sAMAccountName",
+                                       "userAccountControl", "memberOf"]
+                                      + [atr.mappedAttribute
+                                         for atr in AD_ATTRIBUTE_MAP],
+                                      fullRefreshDays=AD_USER_CACHE_FULL_REFRESH_DAYS,
+                                      prefetchWorkers=AD_USER_PREFETCH_WORKERS,
+                                      prefetchPartitions=AD_USER_PREFETCH_PARTITIONS)
+        if not self._userCache.load():
+            self._logger.info("No usable AD user cache was found. All AD users will be read.")
+        # The cache's watermark is only meaningful on the DC it was read
+        # from, so it is always read from the DC writes are kept on.
+        with GetADAccountManager(self._servers, AD_USERNAME, AD_PASSWORD,
+                                 AD_BASE_USER_DN,
+                                 {},
+                                 DS_COLUMN_DEFINITION,
+                                 DS_ACCOUNT_IDENTIFIER,
+                                 AD_TARGET_ACCOUNT_IDENTIFIER,
+                                 AD_SECONDARY_MATCH_ATTRIBUTE,
+                                 maxSize=IMPORT_CHUNK_SIZE,
+                                 limiter=self._limiter,
+                                 retryPolicy=self._retryPolicy) as adam:
+            if self._userCache.refresh(adam):
+                self._logger.info("AD user cache fully refreshed.")
+            else:
+                self._logger.info("AD user cache incrementally refreshed.")
+        self._userCache.save()
 
     def _sendNewUserNotifications(self, notifications: dict):
         """
@@ -468,66 +1272,127 @@ class ADSyncer():
                 self._logger.error("A problem occurred while attempting to send out a password reset notification email. "
                                    + "Error details as follows: " + str(e))
 
-    def _syncGroupMembership(self, dsusr: dict, adusr: dict, syncall: bool = False):
-        """
-        Ensure that the provided user is a member of all the correct
-        synchronized groups and not in any synchronized groups to which they
-        are not assigned.
+    def _groupChanges(self, dsusr: dict, adusr: dict) -> tuple:
         """
+        Works out the synchronized groups the provided user should be added
+        to and removed from.  If the AD user is disabled, all group membership
+        rules are evaluated, so that a user being reactivated is re-added to
+        the appropriate groups.  Users to be deactivated are removed from all
+        groups.
 
-        linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+        Returns a tuple of (groups to add, groups to remove).
+        """
         status = dsusr[DS_STATUS_COLUMN_NAME]
+        uac = adusr.get("userAccountControl")
+        syncall = bool(uac) and bool(int(uac[0]) & UAC_OBJECT_DISABLED)
+
+        # Check if the user is to be deactivated. If so, remove this user from
+        # all groups...
+        if status not in DS_STATUS_ACTIVE_VALUES:
+            return ((), tuple(adusr.get("memberOf") or ()))
 
         syncedgrps = [grp for grp in AD_GROUP_ASSIGNMENTS if
                       (grp.synchronized or syncall)]
         matchedgrps = [grp.groupDN for grp in syncedgrps if grp.match(dsusr)]
         nomatchedgrps = [grp.groupDN for grp in syncedgrps
                          if not grp.match(dsusr)]
-        # Check if the user is to be deactivated. If so, remove this user from
-        # all groups...
-        if status not in DS_STATUS_ACTIVE_VALUES:
-            # Get all groups user is member of, deassign
-            allgrps = self._adam.getLinkedUserInfo(linkid, "memberOf")["memberOf"]
-            if allgrps:
-                result = self._adam.deassignUserGroups(linkid, *allgrps)
+        return (tuple(matchedgrps), tuple(nomatchedgrps))
+
+    def _syncGroupMembership(self, dsusr: dict, assign: tuple, deassign: tuple):
+        """
+        Ensure that the provided user is a member of all the correct
+        synchronized groups and not in any synchronized groups to which they
+        are not assigned, as worked out by _groupChanges.
+        """
+
+        linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+        if dsusr[DS_STATUS_COLUMN_NAME] not in DS_STATUS_ACTIVE_VALUES:
+            if deassign:
+                self._adam.deassignUserGroups(linkid, *deassign)
         else:
             # First ensure that the user is assigned to any synced groups whose
             # rules they match.
-            result = self._adam.assignUserGroups(linkid, *matchedgrps)
+            result = self._adam.assignUserGroups(linkid, *assign)
             if len(result) > 0:
                 self._logger.info(linkid + ": was added to the following group(s): "
                                   + str(result))
 
             # Now verify that the user is not in any synchronized groups that
             # they do *not* match the rules for....
-            result = self._adam.deassignUserGroups(linkid, *nomatchedgrps)
+            result = self._adam.deassignUserGroups(linkid, *deassign)
             if len(result) > 0:
                 self._logger.info(linkid + ": was removed from the following "
                                   + "group(s): " + str(result))
 
-    def _syncOU(self, dsusr: dict, adusr: dict):
+    def _assignNewUserGroups(self, dsusr: dict, dn: str):
         """
-        Ensure that the provided user is placed into the correct OU based on
-        their membership rules. Note that if a user matches more than one OU
-        assignment, they will get placed into the first matching org unit found.
+        Adds a newly created user to every group (synchronized or not) whose
+        rules they match.
         """
         linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
-        destination_ou = None
+        matchedgrps = [grp.groupDN for grp in AD_GROUP_ASSIGNMENTS
+                       if grp.match(dsusr)]
+        result = self._adam.addUserToGroups(dn, *matchedgrps)
+        if len(result) > 0:
+            self._logger.info(linkid + ": was added to the following group(s): "
+                              + str(result))
 
+    def _syncOU(self, dsusr: dict, destination_ou: str):
+        """
+        Ensure that the provided user is placed into the OU given by their
+        membership rules (see _destinationOU).
+        """
+        linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+        if (self._adam.setUserOU(linkid, destination_ou)):
+            self._logger.info(linkid + ": Moved to " + destination_ou)
+
+    def _destinationOU(self, dsusr: dict) -> str:
+        """
+        Returns the DN of the OU the provided user should be placed in: the
+        first OU assignment they match, or the default OU if none match.
+        """
+        linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
         for ou in AD_OU_ASSIGNMENTS:
             if ou.match(dsusr):
                 self._logger.debug(linkid + ": Matching org unit found: "
                                    + ou.orgUnitDN)
-                destination_ou = ou.orgUnitDN
-                break
-        if destination_ou is None:
-            # It appears there were no OU matches for this user.  Set their OU to
-            # the default OU specified in settings.
-            destination_ou = AD_DEFAULT_USER_OU
-            self._logger.debug(linkid + ": No OU assignments found. Assigning "
-                               + "default OU.")
-        if (self._adam.setUserOU(linkid, destination_ou)):
-            self._logger.info(linkid + ": Moved to " + destination_ou)
+                return ou.orgUnitDN
+        # It appears there were no OU matches for this user.  Set their OU to
+        # the default OU specified in settings.
+        self._logger.debug(linkid + ": No OU assignments found. Assigning "
+                           + "default OU.")
+        return AD_DEFAULT_USER_OU
+
+    def _linkedUserAttributes(self) -> list:
+        """
+        Returns the AD attributes read for each linked user before syncing.
+        """
+        return [atr.mappedAttribute for atr in AD_ATTRIBUTE_MAP] \
+            + ["userPrincipalName", "userAccountControl", "memberOf"]
+
+    def _isDeprovisioned(self, dsusr: dict, adusr: dict, changes: list) -> bool:
+        """
+        Returns true if the provided user is inactive in the datasource and
+        their linked AD account (as already read into adusr) is disabled, in
+        no groups, in the correct OU and has up to date attributes, so that
+        syncing them would not change anything.
+
+        changes: the attribute changes the user needs, as returned by
+        _attributeChanges.
+        """
+        if dsusr[DS_STATUS_COLUMN_NAME] in DS_STATUS_ACTIVE_VALUES:
+            return False
+        if dsusr[RESET_PASS_COLUMN_NAME] == "1":
+            return False
+        if adusr.get("memberOf"):
+            return False
+        uac = adusr.get("userAccountControl")
+        if not uac or not (int(uac[0]) & UAC_OBJECT_DISABLED):
+            return False
+        currentou = canonicalDN(adusr["distinguishedName"][0]).parent
+        if currentou is not canonicalDN(self._destinationOU(dsusr)):
+            return False
+        return len(changes) == 0
 
     def _syncActiveStatus(self, dsusr: dict, adusr: dict):
         """
@@ -543,43 +1408,59 @@ class ADSyncer():
             if (self._adam.setUserEnabled(linkid, False)):
                 self._logger.info(linkid + ": Has been disabled.")
 
-    def _syncAttributes(self, dsusr: dict, adusr: dict, syncall: bool = False):
+    def _syncAttributes(self, plans: list):
         """
         Synchronizes the mapped attributes (marked to be synchronized)
-        from the datasource to target.
-
-        dsusr: dictionary of data for the user from the datasource in the form
-        { field: data }
-        adusr: dictionary of data for the linked AD user in the form
-        { field: data }
+        from the datasource to target for the linked users in the provided
+        plans, writing all of them together.
+        """
+        changesets = []
+        for plan in plans:
+            linkid = plan["dsusr"][DS_ACCOUNT_IDENTIFIER]
+            changes = {}
+            for attribute, ds_attr_vals, adusr_attr_vals in plan["changes"]:
+                self._logger.info(linkid + ": AD attribute mismatch for '"
+                                  + attribute + "', DS: " + str(ds_attr_vals)
+                                  + " AD: " + str(adusr_attr_vals) + ". "
+                                  + "Setting AD attribute to DS value.")
+                changes[attribute] = ds_attr_vals
+            if changes:
+                changesets.append((linkid, changes))
+        if not changesets:
+            return
+        done, failed = self._adam.applyChanges(changesets)
+        for linkid, e in failed:
+            self._logger.error(linkid + ": An error occurred while attempting to "
+                               "sync attributes for this user.  Error details: "
+                               + str(e))
+        if failed:
+            self._userFailed(len(failed))
+        changes = dict(changesets)
+        with self._countersLock:
+            self._attributeWrites += sum(len(changes[linkid]) for linkid in done)
 
-        syncall: setting this flag to true forces synchronization of all
-        attributes, even if they are not marked as SYNCHRONIZED.
+    def _attributeChanges(self, dsusr: dict, adusr: dict,
+                          syncall: bool = False) -> list:
+        """
+        Compares the mapped attributes (marked to be synchronized) of the
+        datasource user with the linked AD user, using each attribute's
+        syntax so that values AD considers equal are not reported.
 
-        Note: synced attributes are assumed to be single-valued
+        Returns a list of (attribute name, datasource values, AD values) for
+        each attribute that needs to be written.
         """
-        linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
+        changes = []
         for itm in AD_ATTRIBUTE_MAP:
             # If the item is intended to be kept synchronized,
             if itm.synchronized or syncall:
-                # get the current data source attribute value
-                ds_attr_val = dsusr[itm.sourceColumnName]
-                # get the current AD attribute value
-                if not adusr[itm.mappedAttribute] is None:
-                    adusr_attr_val = adusr[itm.mappedAttribute][0]
-                else:
-                    adusr_attr_val = None
-
-                if ds_attr_val == '':
-                    ds_attr_val = None
-
-                if ds_attr_val != adusr_attr_val:
-                    self._logger.info(linkid + ": AD attribute mismatch for '"
-                                       + itm.mappedAttribute + "', DS: " + str(ds_attr_val)
-                                       + " AD: " + str(adusr_attr_val) + ". "
-                                       + "Setting AD attribute to DS value.")
-                    self._adam.setAttribute(linkid, itm.mappedAttribute,
-                                            str(ds_attr_val))
+                syntax = getAttributeSyntax(itm.mappedAttribute,
+                                            AD_ATTRIBUTE_SYNTAXES)
+                ds_attr_vals = syntax.datasourceValues(dsusr[itm.sourceColumnName])
+                adusr_attr_vals = adusr[itm.mappedAttribute]
+                if not syntax.equal(ds_attr_vals, adusr_attr_vals):
+                    changes.append((itm.mappedAttribute, ds_attr_vals,
+                                    adusr_attr_vals))
+        return changes
 
     def _getUserName(self, dsusr: dict) -> str:
         """
@@ -605,7 +1486,8 @@ class ADSyncer():
                     un = method.getUserName(format, undata, AD_USERNAME_INVALID_CHARS)
                 except UserNameInvalidFieldDataException as e:
                     raise e
-                if not self._adam.getUserInfo("sAMAccountName", un):
+                if (not self._adam.getUserInfo("sAMAccountName", un)
+                        and self._reserveUserName(un, linkid)):
                     break
                 else:
                     un = None
@@ -617,6 +1499,26 @@ class ADSyncer():
             un = dsusr[DS_USERNAME_COLUMN_NAME]
         return un
 
+    def _reserveUserName(self, username: str, linkid: str) -> bool:
+        """
+        Reserves the provided username for the user with the provided linkid
+        for the rest of the run and, with a ledger, on every host.  Returns
+        true if it is now reserved for this user (including if it already
+        was), or false if it is reserved for someone else.  Usernames are
+        compared case-insensitively, as AD compares them.
+        """
+        key = username.lower()
+        with self._userNamesLock:
+            holder = self._userNames.setdefault(key, linkid)
+        if holder != linkid:
+            return False
+        if self._ledger is not None and not self._ledger.reserveUserName(username, linkid):
+            with self._userNamesLock:
+                if self._userNames.get(key) == linkid:
+                    del self._userNames[key]
+            return False
+        return True
+
     def _getPasswordAssignment(self, dsusr: dict) -> PasswordAssignment:
         """
         Looks for a password generation method that this user matches
@@ -629,11 +1531,14 @@ class ADSyncer():
                 passwd = itm
         return passwd
 
-    def _createUser(self, dsusr: dict) -> str:
+    def _createUser(self, dsusr: dict, passwd: str, forcepwdchg: bool) -> tuple:
         """
         Creates an AD user with the provided row of user information
-        (dict, form { column: data }) from the datasource.
-        Returns the UPN of the new user
+        (dict, form { column: data }) from the datasource.  The new user is
+        created enabled, with their synchronized mapped attributes and the
+        provided password.  If forcepwdchg is set, the user will be required
+        to change their password on first login.
+        Returns a tuple of the UPN and DN of the new user
         """
         linkid = dsusr[DS_ACCOUNT_IDENTIFIER]
 
@@ -650,22 +1555,23 @@ class ADSyncer():
         upn = un + "@" + upnsuffix
         self._logger.debug(linkid + ": UPN will be " + upn)
 
-        destination_ou = None
-        for ou in AD_OU_ASSIGNMENTS:
-            if ou.match(dsusr):
-                self._logger.debug(linkid + ": Matching org unit found: "
-                                   + ou.orgUnitDN)
-                destination_ou = ou.orgUnitDN
-                break
-        if destination_ou is None:
-            # It appears there were no OU matches for this user.  Set their OU to
-            # the default OU specified in settings.
-            destination_ou = AD_DEFAULT_USER_OU
-            self._logger.debug(linkid + ": No OU assignments found. Assigning "
-                               + "new user to " + "default OU.")
+        destination_ou = self._destinationOU(dsusr)
+        # Values are written in the same form as a sync writes them, so the
+        # next sync does not see a difference and write them again.
+        attributes = {}
+        for itm in AD_ATTRIBUTE_MAP:
+            if itm.synchronized:
+                syntax = getAttributeSyntax(itm.mappedAttribute, AD_ATTRIBUTE_SYNTAXES)
+                attributes[itm.mappedAttribute] = syntax.datasourceValues(
+                    dsusr[itm.sourceColumnName])
+        attributes["userAccountControl"] = str(UAC_OBJECT_NORMAL_ACCOUNT)
+        if forcepwdchg:
+            attributes["pwdLastSet"] = "0"
+
         # Create the user
-        self._adam.createUser(linkid, un, destination_ou, un, upn)
-        return upn
+        dn = self._adam.createUser(linkid, un, destination_ou, un, upn,
+                                   attributes, passwd)
+        return (upn, dn)
 
     def _genPassword(self, dsusr: dict) -> (str, bool):
         """
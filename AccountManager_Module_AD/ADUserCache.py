@@ -0,0 +1,321 @@
+"""
+Description: Persistent local cache of AD user state.  The cache is stored
+along with the highestCommittedUSN of the DC it was read from so that later
+runs only need to fetch the users that have changed since (uSNChanged above
+the stored watermark) rather than re-reading every user in the directory.
+The cache file is JSON, with the raw bytes values of each user stored
+base64-encoded.
+"""
+
+import base64
+import json
+import os
+import time
+
+from AccountManager_Module_AD.ADDistinguishedName import canonicalDN
+from AccountManager_Module_AD.ADUserRecord import ADRecordLayout
+
+
+# Bump when the layout of the cache file changes so old caches are discarded.
+CACHE_FORMAT_VERSION = 3
+
+AD_USER_SEARCH = "(&(objectCategory=person)(objectClass=user))"
+
+
+def _encodeValue(value: bytes) -> str:
+    """
+    Returns a raw bytes value in the form it is stored in the cache file.
+    """
+    return base64.b64encode(value).decode("ascii")
+
+
+def _encodeValues(values):
+    """
+    Returns the raw values of an attribute, as held in an ADUserRecord (None,
+    a bytes value or a tuple of them), in the form stored in the cache file.
+    """
+    if values is None:
+        return None
+    if isinstance(values, bytes):
+        return _encodeValue(values)
+    return [_encodeValue(val) for val in values]
+
+
+def _decodeValues(values):
+    """
+    Reverses _encodeValues.
+    """
+    if values is None:
+        return None
+    if isinstance(values, str):
+        return base64.b64decode(values, validate=True)
+    return tuple(base64.b64decode(val, validate=True) for val in values)
+
+
+class ADUserCache():
+
+    def __init__(self, path: str, baseUserDN: str, linkAttribute: str,
+                 attributes: tuple, targetEncoding: str = "utf-8",
+                 fullRefreshDays: int = 7, prefetchWorkers: int = 1,
+                 prefetchPartitions=None):
+        """
+        path: the location of the cache file.
+
+        baseUserDN: the search base in AD that cached users are read from.
+
+        linkAttribute: the name of the AD attribute that holds the link ID.
+        Cached users are looked up by the value of this attribute.
+
+        attributes: the AD attributes to cache for each user.  The
+        distinguishedName and the link attribute are always cached.
+
+        targetEncoding: the character set encoding in use by the directory.
+
+        fullRefreshDays: the maximum age, in days, of the last full read of
+        the directory before another one is forced.  Accounts that are
+        deleted or moved out of baseUserDN are only noticed by an
+        incremental refresh if the service account can read deleted objects,
+        so this bounds how long such accounts can linger in the cache.
+
+        prefetchWorkers: the number of partitions of the base DN read at the
+        same time, each on its own connection, during a full refresh.  With
+        1, the base DN is read with a single paged search.
+
+        prefetchPartitions: LDAP filters splitting the users into the
+        partitions read during a full refresh (see
+        ADAccountManager.getSearchPartitions).  If not provided, the users
+        are split by the OU directly under the base DN they are in.
+        """
+        self._path = path
+        self._baseUserDN = baseUserDN
+        self._linkAttribute = linkAttribute
+        self._targetEncoding = targetEncoding
+        self._fullRefreshDays = fullRefreshDays
+        self._prefetchWorkers = prefetchWorkers
+        self._prefetchPartitions = prefetchPartitions
+
+        attrs = ["distinguishedName", linkAttribute]
+        for atr in attributes:
+            if atr.lower() not in [a.lower() for a in attrs]:
+                attrs.append(atr)
+        self._attributes = tuple(attrs)
+        self._attributeKeys = frozenset(atr.lower() for atr in attrs)
+        self._layout = ADRecordLayout(self._attributes, targetEncoding)
+
+        self._invocationId = None
+        self._usn = None
+        self._fullRefreshTime = 0
+        # { objectGUID: ADUserRecord }
+        self._records = {}
+        # { linkid: objectGUID }
+        self._linkIndex = {}
+        # linkids that are on more than one AD user.
+        self._duplicateLinkIds = set()
+        # linkids whose AD user was changed in a way the cache did not follow.
+        self._dirty = set()
+
+    @property
+    def attributes(self) -> tuple:
+        """
+        Returns the names of the AD attributes held for each cached user.
+        """
+        return self._attributes
+
+    def load(self) -> bool:
+        """
+        Reads the cache file.  Returns true if a usable cache was loaded,
+        otherwise false (in which case the next refresh reads every user).
+        """
+        try:
+            with open(self._path, 'r', encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if (not isinstance(saved, dict)
+                or saved.get("version") != CACHE_FORMAT_VERSION
+                or saved.get("baseUserDN") != self._baseUserDN
+                or tuple(saved.get("attributes", ())) != self._attributes):
+            return False
+
+        try:
+            records = {base64.b64decode(guid):
+                       self._layout.restoreRecord(dn, [_decodeValues(vals)
+                                                       for vals in values])
+                       for guid, (dn, values) in saved["records"].items()}
+        except (KeyError, TypeError, ValueError):
+            return False
+        self._invocationId = saved["invocationId"]
+        self._usn = saved["usn"]
+        self._fullRefreshTime = saved["fullRefreshTime"]
+        self._records = records
+        self._rebuildIndex()
+        return True
+
+    def save(self):
+        """
+        Writes the cache file.  The file is written to a temporary location
+        and then moved into place so an interruption cannot corrupt it.
+        """
+        saved = {
+            "version": CACHE_FORMAT_VERSION,
+            "baseUserDN": self._baseUserDN,
+            "attributes": self._attributes,
+            "invocationId": self._invocationId,
+            "usn": self._usn,
+            "fullRefreshTime": self._fullRefreshTime,
+            "records": {_encodeValue(guid): (record.dn, [_encodeValues(vals)
+                                                         for vals in record.rawValues])
+                        for guid, record in self._records.items()},
+        }
+        tmppath = self._path + ".tmp"
+        with open(tmppath, 'w', encoding="utf-8") as f:
+            json.dump(saved, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmppath, self._path)
+
+    def refresh(self, adam) -> bool:
+        """
+        Brings the cache up to date using the provided ADAccountManager.
+
+        If the cache was last read from the same DC (its invocationId has not
+        changed), only users with a uSNChanged above the stored watermark are
+        fetched.  Otherwise every user under the base DN is read again.
+
+        Returns true if a full refresh was done, false if incremental.
+        """
+        # Read the watermark *before* searching so that anything changed
+        # while the search runs is fetched again next time.
+        invocationid, usn, namingcontext = adam.getDirectoryState()
+
+        full = (self._usn is None
+                or invocationid != self._invocationId
+                or (time.time() - self._fullRefreshTime
+                    > self._fullRefreshDays * 86400))
+
+        fetchattrs = list(self._attributes) + ["objectGUID"]
+        if full:
+            records = {}
+            if self._prefetchWorkers > 1:
+                partitions = adam.getSearchPartitions(self._prefetchPartitions)
+                entries = adam.searchUsersPartitioned(AD_USER_SEARCH, fetchattrs,
+                                                      partitions,
+                                                      self._prefetchWorkers)
+            else:
+                entries = adam.searchUsers(AD_USER_SEARCH, fetchattrs)
+            for dn, entry in entries:
+                records[entry["objectGUID"][0]] = self._decode(dn, entry)
+            self._records = records
+            self._fullRefreshTime = time.time()
+        else:
+            # Search the whole domain, including deleted objects, so that
+            # users moved out of the base DN or deleted are evicted.
+            search = ("(&(objectClass=user)(uSNChanged>="
+                      + str(self._usn + 1) + "))")
+            for dn, entry in adam.searchUsers(search,
+                                              fetchattrs + ["isDeleted",
+                                                            "objectCategory"],
+                                              searchBase=namingcontext,
+                                              showDeleted=True):
+                guid = entry["objectGUID"][0]
+                category = b"".join(entry.get("objectCategory", ())).lower()
+                if (entry.get("isDeleted", [b"FALSE"])[0].upper() == b"TRUE"
+                        or b"cn=person," not in category
+                        or not self._inBase(dn)):
+                    self._records.pop(guid, None)
+                else:
+                    self._records[guid] = self._decode(dn, entry)
+
+        self._invocationId = invocationid
+        self._usn = usn
+        self._dirty = set()
+        self._rebuildIndex()
+        return full
+
+    def covers(self, attributes) -> bool:
+        """
+        Returns true if every one of the provided attribute names is held in
+        the cache.
+        """
+        for atr in attributes:
+            if atr.lower() not in self._attributeKeys:
+                return False
+        return True
+
+    def isDirty(self, linkid: str) -> bool:
+        """
+        Returns true if the cache cannot be relied on for the provided linkid
+        and AD should be queried instead.
+        """
+        return linkid in self._dirty or linkid in self._duplicateLinkIds
+
+    def linkids(self):
+        """
+        Returns the set of linkids held in the cache.
+        """
+        return self._linkIndex.keys()
+
+    def getLinkedUser(self, linkid: str, *attributes: str) -> dict:
+        """
+        Returns the cached user with the provided linkid as a dictionary of
+        the form { attribute name: [values] }, the same as
+        ADAccountManager.getUserInfo, including the distinguishedName and
+        the requested attributes (None where not set).
+        Returns None if no user with the linkid is cached.
+        """
+        guid = self._linkIndex.get(linkid)
+        if guid is None:
+            return None
+        record = self._records[guid]
+        retval = {"distinguishedName": [record.dn]}
+        for atr in attributes:
+            retval[atr] = record.get(atr)
+        return retval
+
+    def update(self, linkid: str, attributeName: str, values: list):
+        """
+        Records a change made in AD to an attribute of the user with the
+        provided linkid.  Attributes that are not cached are ignored.
+        """
+        guid = self._linkIndex.get(linkid)
+        if guid is not None:
+            self._records[guid].set(attributeName, values)
+
+    def invalidate(self, linkid: str):
+        """
+        Marks the provided linkid so that lookups for it go to AD for the rest
+        of this run.
+        """
+        self._dirty.add(linkid)
+
+    def _decode(self, dn: str, entry: dict):
+        """
+        Converts a search result entry into a cache record.  Values are kept
+        as raw bytes and only decoded when looked up.
+        """
+        return self._layout.newRecord(dn, entry)
+
+    def _inBase(self, dn: str) -> bool:
+        """
+        Returns true if the provided DN is within the base user DN.
+        """
+        return canonicalDN(dn).isWithin(self._baseUserDN)
+
+    def _rebuildIndex(self):
+        """
+        Rebuilds the linkid index from the cached records.
+        """
+        index = {}
+        duplicates = set()
+        linkkey = self._linkAttribute.lower()
+        for guid, record in self._records.items():
+            values = record.get(linkkey)
+            if not values:
+                continue
+            linkid = values[0]
+            if linkid in index:
+                duplicates.add(linkid)
+            index[linkid] = guid
+        self._linkIndex = index
+        self._duplicateLinkIds = duplicates
@@ -0,0 +1,167 @@
+"""
+Description: Compact in-memory records of AD users, for holding a large part
+of the directory at once (as the AD user cache does).  A record keeps the raw
+bytes values returned by the LDAP search in a tuple laid out by an
+ADRecordLayout shared by every record, rather than a dictionary of decoded
+strings per user, and values are only decoded when they are asked for.
+Values of DN attributes such as memberOf, which repeat across thousands of
+users, are interned so each distinct value is held in memory once.
+"""
+
+import sys
+
+from AccountManager_Module_AD.ADAttributeSyntax import SYNTAX_DN, \
+    getAttributeSyntax
+
+
+class ADRecordLayout():
+
+    def __init__(self, attributes, targetEncoding: str = "utf-8",
+                 internAttributes=None):
+        """
+        attributes: the names of the AD attributes held in each record.  The
+        distinguishedName is always held, apart from the other attributes.
+
+        targetEncoding: the character set encoding in use by the directory.
+
+        internAttributes: the names of the attributes whose values are
+        interned.  If not provided, the values of every DN attribute are
+        interned.
+        """
+        self._attributes = tuple(atr for atr in attributes
+                                 if atr.lower() != "distinguishedname")
+        self._positions = {atr.lower(): i
+                           for i, atr in enumerate(self._attributes)}
+        self._targetEncoding = targetEncoding
+        if internAttributes is None:
+            internAttributes = [atr for atr in self._attributes
+                                if getAttributeSyntax(atr).syntax == SYNTAX_DN]
+        self._intern = frozenset(self._positions[atr.lower()]
+                                 for atr in internAttributes
+                                 if atr.lower() in self._positions)
+        self._pool = {}
+
+    @property
+    def attributes(self) -> tuple:
+        """
+        Returns the names of the attributes held in each record, other than
+        the distinguishedName.
+        """
+        return self._attributes
+
+    def newRecord(self, dn: str, entry: dict) -> "ADUserRecord":
+        """
+        Returns a record of the provided search result entry, of the form
+        { attribute name: [raw values] }.  Attributes not in this layout
+        are left out.
+        """
+        values = [None] * len(self._attributes)
+        for atr, vals in entry.items():
+            i = self._positions.get(atr.lower())
+            if i is not None and vals:
+                values[i] = self._pack(i, vals)
+        return ADUserRecord(self, dn, tuple(values))
+
+    def restoreRecord(self, dn: str, values: tuple) -> "ADUserRecord":
+        """
+        Returns a record with the provided dn and raw values (as returned by
+        ADUserRecord.rawValues for a record of this layout), interning the
+        values again.
+        """
+        return ADUserRecord(self, dn,
+                            tuple(None if vals is None else self._pack(i, vals)
+                                  for i, vals in enumerate(values)))
+
+    def _position(self, attributeName: str) -> int:
+        """
+        Returns the index of the named attribute in a record's values, or
+        None if it is not held.
+        """
+        return self._positions.get(attributeName.lower())
+
+    def _pack(self, i: int, values):
+        """
+        Converts the raw values of the attribute at index i into the form
+        they are stored in: the bytes value itself for a single value,
+        otherwise a tuple of bytes values.
+        """
+        if isinstance(values, bytes):
+            values = (values,)
+        if i in self._intern:
+            values = [self._pool.setdefault(val, val) for val in values]
+        if len(values) == 1:
+            return values[0]
+        return tuple(values)
+
+    def _unpack(self, values) -> list:
+        """
+        Decodes stored raw values into a list of str.
+        """
+        if isinstance(values, bytes):
+            return [values.decode(self._targetEncoding)]
+        return [val.decode(self._targetEncoding) for val in values]
+
+
+class ADUserRecord():
+    __slots__ = ("_layout", "_dn", "_values")
+
+    def __init__(self, layout: ADRecordLayout, dn: str, values: tuple):
+        """
+        Records are created by ADRecordLayout.newRecord.
+
+        layout: the layout of values.
+
+        dn: the distinguishedName of the user.
+
+        values: a tuple holding the raw values of each attribute of the
+        layout, or None where the attribute is not set.
+        """
+        self._layout = layout
+        self._dn = sys.intern(dn)
+        self._values = values
+
+    @property
+    def dn(self) -> str:
+        """
+        Returns the distinguishedName of the user.
+        """
+        return self._dn
+
+    @property
+    def rawValues(self) -> tuple:
+        """
+        Returns the raw values of each attribute of the record's layout, in
+        the form stored.
+        """
+        return self._values
+
+    def get(self, attributeName: str) -> list:
+        """
+        Returns the values of the named attribute decoded into a list of
+        str, or None if the attribute is not set or not held.
+        """
+        if attributeName.lower() == "distinguishedname":
+            return [self._dn]
+        i = self._layout._position(attributeName)
+        if i is None or self._values[i] is None:
+            return None
+        return self._layout._unpack(self._values[i])
+
+    def set(self, attributeName: str, values: list):
+        """
+        Replaces the values of the named attribute with the provided list of
+        str.  None or an empty list clears the attribute.  Attributes not
+        held are ignored.
+        """
+        if attributeName.lower() == "distinguishedname":
+            if values:
+                self._dn = sys.intern(values[0])
+            return
+        i = self._layout._position(attributeName)
+        if i is None:
+            return
+        packed = None
+        if values:
+            packed = self._layout._pack(
+                i, [val.encode(self._layout._targetEncoding) for val in values])
+        self._values = self._values[:i] + (packed,) + self._values[i + 1:]
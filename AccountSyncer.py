@@ -0,0 +1,261 @@
+"""
+Description: Abstract class for syncing the datasource to a target system,
+along with the work shared by every target: opening the datasource (selecting
+just this host's shard of it for a sharded run) and reading it a page at a
+time, with each record parsed once into a dictionary of
+{ column name: value }.
+"""
+
+from abc import ABC, abstractmethod
+import logging
+from CSVPager import CSVPager, compressionOf
+from DatasourceValidator import DatasourceValidator
+from MappedCSVPager import MappedCSVPager
+from MergedCSVPager import MergedCSVPager
+from SQLPager import SQLPager
+from SyncLedger import shardOf
+import Settings
+from Settings import IMPORT_CHUNK_SIZE, DS_COLUMN_DEFINITION, \
+    DS_ACCOUNT_IDENTIFIER, DS_SECONDARY_MATCH_COLUMN
+
+
+# Settings added after the first release are read with a default, so that a
+# Settings.py written for an earlier version still works.
+DS_PARSE_WORKERS = getattr(Settings, "DS_PARSE_WORKERS", 1)
+DS_PARSE_CHUNK_SIZE = getattr(Settings, "DS_PARSE_CHUNK_SIZE", 8388608)
+DS_SQL_CONNECT = getattr(Settings, "DS_SQL_CONNECT", None)
+DS_SQL_QUERY = getattr(Settings, "DS_SQL_QUERY", None)
+DS_SQL_INCREMENTAL_QUERY = getattr(Settings, "DS_SQL_INCREMENTAL_QUERY", None)
+DS_SQL_WATERMARK_COLUMN = getattr(Settings, "DS_SQL_WATERMARK_COLUMN", "updated_at")
+DS_SQL_WATERMARK_PATH = getattr(Settings, "DS_SQL_WATERMARK_PATH", None)
+DS_FILE_COLUMN_DEFINITIONS = getattr(Settings, "DS_FILE_COLUMN_DEFINITIONS", {})
+DS_FIELD_PRECEDENCE = getattr(Settings, "DS_FIELD_PRECEDENCE", {})
+DS_OVERRIDE_FILES = getattr(Settings, "DS_OVERRIDE_FILES", ())
+DS_FILES_SORTED = getattr(Settings, "DS_FILES_SORTED", False)
+SYNC_MERGE_JOIN_SORT_CHUNK_SIZE = getattr(Settings, "SYNC_MERGE_JOIN_SORT_CHUNK_SIZE", 100000)
+SYNC_MERGE_JOIN_TEMP_DIR = getattr(Settings, "SYNC_MERGE_JOIN_TEMP_DIR", None)
+DS_PARSED_CACHE_PATH = getattr(Settings, "DS_PARSED_CACHE_PATH", None)
+DS_VALIDATE = getattr(Settings, "DS_VALIDATE", False)
+DS_DUPLICATE_POLICY = getattr(Settings, "DS_DUPLICATE_POLICY", "last")
+DS_SECONDARY_MATCH_CONFLICT_POLICY = getattr(Settings, "DS_SECONDARY_MATCH_CONFLICT_POLICY",
+                                             "report")
+
+
+def shardFilter(shard):
+    """
+    Returns a function that tells whether a linkid belongs to the provided
+    shard (a tuple of (K, N) as given by the --Shard argument), or None if
+    shard is None.
+    """
+    if shard is None:
+        return None
+    shardnum, shardcount = shard
+    return lambda linkid: shardOf(linkid, shardcount) == shardnum
+
+
+def openDatasource(args):
+    """
+    Opens the datasource given by the command line arguments, paged
+    IMPORT_CHUNK_SIZE records at a time.  For a sharded run, only the
+    records in this host's shard are read.  With DS_PARSED_CACHE_PATH set, a
+    single file is read through its parsed cache.  Otherwise, with
+    DS_PARSE_WORKERS above 1, an uncompressed file is parsed by that many
+    processes with a MappedCSVPager.  Several files are merged by linkid with a
+    MergedCSVPager.  A SQL datasource is read with DS_SQL_QUERY (or
+    DS_SQL_INCREMENTAL_QUERY) by a SQLPager.
+    """
+    if args.DatasourceFileType == 'SQL':
+        watermarkpath = DS_SQL_WATERMARK_PATH
+        if watermarkpath and args.Shard is not None:
+            shardnum, shardcount = args.Shard
+            watermarkpath += ".shard" + str(shardnum) + "of" + str(shardcount)
+        return SQLPager(DS_SQL_CONNECT,
+                        DS_SQL_QUERY,
+                        IMPORT_CHUNK_SIZE,
+                        DS_COLUMN_DEFINITION,
+                        DS_ACCOUNT_IDENTIFIER,
+                        shardFilter(args.Shard),
+                        incrementalQuery=DS_SQL_INCREMENTAL_QUERY,
+                        watermarkColumn=DS_SQL_WATERMARK_COLUMN,
+                        watermarkPath=watermarkpath)
+    if args.DatasourceFileType == 'TSV':
+        dsfiletype = CSVPager.FILE_TYPE_TSV
+    else:
+        dsfiletype = CSVPager.FILE_TYPE_CSV
+    paths = args.DatasourcePath
+    if isinstance(paths, str):
+        paths = [paths]
+    if len(paths) > 1:
+        return MergedCSVPager(paths,
+                              dsfiletype,
+                              IMPORT_CHUNK_SIZE,
+                              DS_COLUMN_DEFINITION,
+                              DS_ACCOUNT_IDENTIFIER,
+                              shardFilter(args.Shard),
+                              fileColumnDefinitions=DS_FILE_COLUMN_DEFINITIONS,
+                              precedence=DS_FIELD_PRECEDENCE,
+                              overrideFiles=DS_OVERRIDE_FILES,
+                              presorted=DS_FILES_SORTED,
+                              sortChunkSize=SYNC_MERGE_JOIN_SORT_CHUNK_SIZE,
+                              tempDir=SYNC_MERGE_JOIN_TEMP_DIR)
+    path = paths[0]
+    if (DS_PARSE_WORKERS > 1 and not DS_PARSED_CACHE_PATH
+            and compressionOf(path) is None):
+        return MappedCSVPager(path,
+                              dsfiletype,
+                              IMPORT_CHUNK_SIZE,
+                              DS_COLUMN_DEFINITION.get(DS_ACCOUNT_IDENTIFIER),
+                              shardFilter(args.Shard),
+                              workers=DS_PARSE_WORKERS,
+                              chunkSize=DS_PARSE_CHUNK_SIZE)
+    return CSVPager(path,
+                    dsfiletype,
+                    IMPORT_CHUNK_SIZE,
+                    DS_COLUMN_DEFINITION.get(DS_ACCOUNT_IDENTIFIER),
+                    shardFilter(args.Shard),
+                    cachePath=DS_PARSED_CACHE_PATH)
+
+
+def finishDatasource(pager, validator: DatasourceValidator = None):
+    """
+    Records that every record read from the datasource has been synced to
+    every target.  For an incremental SQL datasource, this saves the
+    watermark the next run reads the changes from.  Call this only if every
+    target's syncDatasource returned true.
+
+    validator: the DatasourceValidator the pages were filtered with, if
+    any.  If it left records out of the sync, nothing is recorded, so that
+    they are read again once they have been corrected.
+    """
+    if validator is not None and validator.quarantinedCount:
+        return
+    if isinstance(pager, SQLPager):
+        pager.saveWatermark()
+
+
+def validateDatasource(logger: logging.Logger, pager):
+    """
+    With DS_VALIDATE set, checks the whole datasource before any of it is
+    synced (see DatasourceValidator) and returns the validator to filter its
+    pages with; otherwise returns None.
+    """
+    if not DS_VALIDATE:
+        return None
+    validator = DatasourceValidator(logger,
+                                    DS_COLUMN_DEFINITION,
+                                    DS_ACCOUNT_IDENTIFIER,
+                                    DS_SECONDARY_MATCH_COLUMN,
+                                    duplicatePolicy=DS_DUPLICATE_POLICY,
+                                    conflictPolicy=DS_SECONDARY_MATCH_CONFLICT_POLICY)
+    validator.validate(pager)
+    return validator
+
+
+def parseRecord(row: list) -> dict:
+    """
+    Converts a datasource record into a dictionary of
+    { column name: value }, using the columns in DS_COLUMN_DEFINITION.
+    """
+    return {col: row[index] for col, index in DS_COLUMN_DEFINITION.items()}
+
+
+def readPages(pager: CSVPager, startIndex: int = 0,
+              validator: DatasourceValidator = None):
+    """
+    Reads the datasource a page at a time, starting with the record at
+    startIndex, and yields a work item
+    for each page of the form:
+    { "index": index of the first record of the page,
+      "page": { linkid: record },
+      "users": [ parsed record (see parseRecord) for each record ],
+      "withheld": [ linkid of each record on the page left out by the
+                    validator ],
+      "next": index of the first record of the next page, or -1 after the
+              last page }
+
+    validator: the DatasourceValidator returned by validateDatasource, if
+    any, to filter the pages with.
+    """
+    i = startIndex
+    try:
+        while True:
+            nexti = pager.getPage(i)
+            page = pager.page
+            withheld = []
+            if validator is not None:
+                page, withheld = validator.filterPage(page, i, nexti)
+            yield {"index": i, "page": page,
+                   "users": [parseRecord(row) for row in page.values()],
+                   "withheld": withheld, "next": nexti}
+            if nexti == -1:
+                break
+            i = nexti
+    finally:
+        if isinstance(pager, SQLPager):
+            # Close the connection on the thread that read the pages, as the
+            # SQL driver may require, if the sync stops before the last page.
+            pager.close()
+
+
+class AccountSyncer(ABC):
+
+    def __init__(self, logger: logging.Logger, args):
+        """
+        logger: the logger to report the progress of the sync to.
+
+        args: the parsed command line arguments.
+        """
+        self._logger = logger
+        self._args = args
+
+    @property
+    def name(self) -> str:
+        """
+        Returns the name of the target system, as used in log messages.
+        """
+        return type(self).__name__
+
+    def runSyncProcess(self):
+        """
+        Reads the datasource and syncs this target with it.  To sync several
+        targets from one read of the datasource, use a SyncDispatcher.
+        """
+        pager = openDatasource(self._args)
+        try:
+            validator = validateDatasource(self._logger, pager)
+            pages = readPages(pager, self.resumeIndex(pager), validator)
+            if self.syncDatasource(pager, pages):
+                finishDatasource(pager, validator)
+        finally:
+            pager.close()
+
+    def resumeIndex(self, pager: CSVPager) -> int:
+        """
+        Returns the index of the first datasource record this target still
+        needs, such as where a resumed run picks up from.  The records before
+        it are not read into pages, so a resumed run does not read the whole
+        datasource again.  Called once, before syncDatasource.  By default
+        every record is needed.
+        """
+        return 0
+
+    @abstractmethod
+    def syncDatasource(self, pager: CSVPager, pages):
+        """
+        Syncs the target system with the datasource.
+
+        pager: the CSVPager the datasource is read with.  Targets may use
+        its record count and fingerprint but must not read pages with it,
+        since the pages may be shared with other targets.
+
+        pages: an iterable of the work items returned by readPages, covering
+        the datasource in order from no later than resumeIndex.  The items
+        belong to this target and may be added to, but the records in them
+        must not be changed.
+
+        Returns true if every record was synced, or false if any failed or
+        were skipped to be tried again.  The next run of an incremental
+        datasource then reads every record changed since the last run that
+        returned true, not just the last one.
+        """
+        pass
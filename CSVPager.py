@@ -5,7 +5,61 @@ Description: Works with csv.reader to returns data paged in chunks
 for handling large datasets.
 """
 
+import bz2
 import csv
+import gzip
+import hashlib
+import lzma
+
+from DatasourceCache import DatasourceCache
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+
+# The leading bytes of each compressed file format that can be read, and the
+# name of the format.
+COMPRESSION_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+
+def compressionOf(filepath: str) -> str:
+    """
+    Returns the name of the format the file at filepath is compressed with,
+    judged by its leading bytes, or None if it is not compressed.
+    """
+    with open(filepath, 'rb') as f:
+        head = f.read(8)
+    for magic, name in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def _openCompressed(filepath: str, compression: str):
+    """
+    Opens a compressed file for reading as text, decompressing it as it is
+    read.
+    """
+    if compression == 'gzip':
+        return gzip.open(filepath, 'rt')
+    if compression == 'bz2':
+        return bz2.open(filepath, 'rt')
+    if compression == 'xz':
+        return lzma.open(filepath, 'rt')
+    if zstd is None:
+        raise ImportError("The file at the provided path is zstd compressed, "
+                          "which requires the zstandard package.")
+    return zstd.open(filepath, 'rt')
 
 
 class CSVPager():
@@ -13,7 +67,7 @@ class CSVPager():
     FILE_TYPE_TSV = 'excel-tab'
 
     def __init__(self, filepath: str, filetype: str, pageSize: int,
-                 keyIndex: int = 0):
+                 keyIndex: int = 0, keyFilter=None, cachePath: str = None):
         """
         filepath is the path to the file to iterate through for pagination
         filetype is a string representing the format of the data source file
@@ -21,25 +75,104 @@ class CSVPager():
         pageSize is the number of records that should be returned per page.
         keyIndex is the zero-based index of the field in the file containing
         the key for the data dictionary.
+        keyFilter is an optional function that is called with the key of each
+        record.  Records for which it returns false are skipped and do not
+        count towards the page size.  Records too short to have a key (such
+        as blank lines) are skipped too.
+
+        A file compressed with gzip, bz2, xz or zstd is decompressed as it is
+        read.  It is read in one pass, so its record count is not known
+        until the last page has been read, and pages can only be found by
+        index (reading an earlier page decompresses the file again from the
+        beginning).
+
+        cachePath is the optional location of a binary cache of the parsed
+        records of the file.  If the cache was written for a file with the
+        same contents, pages are read from it without parsing the file;
+        otherwise it is written (in place of the usual pass to count the
+        records) and then read from.
         """
         try:
-            self._file = open(filepath)
+            self._compression = compressionOf(filepath)
+            if self._compression is not None:
+                self._file = _openCompressed(filepath, self._compression)
+            else:
+                self._file = open(filepath)
         except OSError:
             raise OSError("Error opening file at the provided path.")
             return None
-        self._reader = csv.reader(self._file, filetype)
+        self._filepath = filepath
+        self._filetype = filetype
         self._pageSize: int = pageSize
         self._page: dict = {}
         self._keyIndex = keyIndex
+        self._keyFilter = keyFilter
+        self._fingerprint = None
+
+        # Index and file position of the record following the last page read,
+        # so sequential pages do not have to rescan the file from the start.
+        self._nextIndex = 0
+        self._nextOffset = 0
+
+        self._cache = None
+        if cachePath is not None:
+            self._cache = self._openCache(cachePath)
+            if self._cache is not None:
+                self._csvRecordCount = self._cache.count
+                return
+
+        if self._compression is not None:
+            # The reader over the decompressed file, and the record read
+            # ahead of the last page to tell whether it was the last.
+            self._csvRecordCount = None
+            self._reader = csv.reader(self._file, self._filetype)
+            self._lookahead = None
+            return
 
         # Get the CSV file record count without storing the whole thing in
         # memory
         i = 0
-        for row in self._reader:
+        for row in csv.reader(self._lines(), self._filetype):
             i += 1
         self._csvRecordCount = i
         self._reset_reader()
 
+    def _lines(self):
+        """
+        Internal generator that feeds csv.reader one line at a time.  Lines
+        are read with readline() rather than by iterating the file so that
+        tell() stays usable and gives the position of the end of the last
+        record parsed.
+        """
+        while True:
+            line = self._file.readline()
+            if not line:
+                return
+            yield line
+
+    def _openCache(self, cachePath: str) -> DatasourceCache:
+        """
+        Internal function that opens the parsed cache of the file, writing it
+        first if it is missing or was written for a different file.  Returns
+        None if the cache could not be written, and the file is read as
+        usual.
+        """
+        cache = DatasourceCache(cachePath)
+        if cache.load(self.fingerprint, self._filetype, self._keyIndex):
+            return cache
+        try:
+            cache.build(csv.reader(self._file, self._filetype), self.fingerprint,
+                        self._filetype, self._keyIndex)
+        except OSError:
+            cache.close()
+            cache = None
+        if self._compression is not None:
+            self._file.close()
+            self._file = _openCompressed(self._filepath, self._compression)
+        else:
+            self._reset_reader()
+        return cache
+
     def _reset_reader(self):
         """
         Internal function that sets the reader cursor back to the beginning of
@@ -56,27 +189,141 @@ class CSVPager():
         -1 to indicate we are done paging through the csv file.
         keyindex is the index of the field in the row that should be the key
         for _data (which is a dict).
+
+        If startIndex follows on from the previous page, reading starts at
+        the file position recorded by the previous call; otherwise the file
+        is scanned from the beginning.
         """
+        if self._cache is not None:
+            return self._getCachedPage(startIndex)
+        if self._compression is not None:
+            return self._getStreamedPage(startIndex)
 
-        i = 0
         p = {}
         retval = -1
-        pageEndIndex = startIndex + self._pageSize - 1
 
-        for row in self._reader:
-            if i >= startIndex:
+        if startIndex == self._nextIndex:
+            self._file.seek(self._nextOffset, 0)
+            i = startIndex
+        else:
+            self._reset_reader()
+            i = 0
+
+        for row in csv.reader(self._lines(), self._filetype):
+            if (i >= startIndex and len(row) > self._keyIndex
+                    and (self._keyFilter is None or self._keyFilter(row[self._keyIndex]))):
                 p[row[self._keyIndex]] = row
             if i == self._csvRecordCount - 1:
                 retval = -1
                 break
-            if i == pageEndIndex:
+            if len(p) == self._pageSize:
                 retval = i + 1
                 break
             i += 1
         self._page = p
+        if retval != -1:
+            self._nextIndex = retval
+            self._nextOffset = self._file.tell()
+        else:
+            self._nextIndex = 0
+            self._nextOffset = 0
         self._reset_reader()
         return retval
 
+    def _getCachedPage(self, startIndex: int) -> int:
+        """
+        getPage for a file with a parsed cache: reads the page from the
+        cache, starting straight at startIndex.
+        """
+        p = {}
+        retval = -1
+        i = startIndex
+        while i < self._csvRecordCount:
+            row = self._cache.row(i)
+            if len(row) > self._keyIndex and (self._keyFilter is None
+                                              or self._keyFilter(row[self._keyIndex])):
+                p[row[self._keyIndex]] = row
+            i += 1
+            if len(p) == self._pageSize:
+                if i < self._csvRecordCount:
+                    retval = i
+                break
+        self._page = p
+        return retval
+
+    def getRecord(self, key: str) -> list:
+        """
+        Returns the record with the provided key (compared without regard
+        to case, and whether or not keyFilter accepts it), or None if there
+        is none.  With a parsed cache this is a single lookup; otherwise the
+        file is scanned.
+        """
+        if self._cache is not None:
+            return self._cache.find(key)
+        key = key.lower()
+        found = None
+        for row in self.records():
+            if len(row) > self._keyIndex and row[self._keyIndex].lower() == key:
+                found = row
+        return found
+
+    def records(self):
+        """
+        Yields every record of the file in order, whether or not keyFilter
+        accepts it, without disturbing the pages being read.
+        """
+        if self._cache is not None:
+            for i in range(self._csvRecordCount):
+                yield self._cache.row(i)
+            return
+        if self._compression is not None:
+            f = _openCompressed(self._filepath, self._compression)
+        else:
+            f = open(self._filepath)
+        with f:
+            yield from csv.reader(f, self._filetype)
+
+    def _getStreamedPage(self, startIndex: int) -> int:
+        """
+        getPage for a compressed file: carries on reading from the end of the
+        previous page, or decompresses the file again from the beginning if
+        startIndex comes before it.
+        """
+        if self._reader is None or startIndex < self._nextIndex:
+            self._file.close()
+            self._file = _openCompressed(self._filepath, self._compression)
+            self._reader = csv.reader(self._file, self._filetype)
+            self._lookahead = None
+            self._nextIndex = 0
+
+        p = {}
+        retval = -1
+        i = self._nextIndex
+        while True:
+            if self._lookahead is not None:
+                row, self._lookahead = self._lookahead, None
+            else:
+                row = next(self._reader, None)
+                if row is None:
+                    break
+            if (i >= startIndex and len(row) > self._keyIndex
+                    and (self._keyFilter is None or self._keyFilter(row[self._keyIndex]))):
+                p[row[self._keyIndex]] = row
+            i += 1
+            if len(p) == self._pageSize:
+                self._lookahead = next(self._reader, None)
+                if self._lookahead is not None:
+                    retval = i
+                break
+        self._page = p
+        if retval != -1:
+            self._nextIndex = retval
+        else:
+            self._csvRecordCount = i
+            self._reader = None
+            self._nextIndex = 0
+        return retval
+
     @property
     def page(self) -> list:
         """
@@ -87,6 +334,29 @@ class CSVPager():
     @property
     def csvRecordCount(self) -> int:
         """
-        Return the record count on the this pager's CSV file.
+        Return the record count on the this pager's CSV file, or None for a
+        compressed file that has not yet been read to the end.
         """
         return self._csvRecordCount
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Returns a hash of the data source file contents, used to tell whether
+        saved progress information still applies to this file.
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            with open(self._filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(1048576), b''):
+                    h.update(chunk)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def close(self):
+        """
+        Closes the data source file.
+        """
+        if self._cache is not None:
+            self._cache.close()
+        self._file.close()
@@ -0,0 +1,231 @@
+"""
+Description: Binary cache of the parsed records of a datasource file, so that
+runs against a file that has not changed since the cache was written do not
+have to parse it again.  The cache is keyed by the fingerprint of the file.
+
+The cache file is memory-mapped rather than read in.  It holds the records
+(each stored as its fields joined by NUL characters), followed by a table of
+the position of each record, so any record can be read by index without
+reading those before it, and a hash table of the record index of each key,
+so a record can be found by key without scanning.  Keys are compared without
+regard to case.
+"""
+
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+
+
+# Bump when the layout of the cache file changes so old caches are discarded.
+CACHE_FORMAT_VERSION = 1
+
+_MAGIC = b"DSPC"
+# magic, format version, record count, position of the record positions,
+# position of the hash table, number of hash table slots, length of the
+# metadata that follows the header.
+_HEADER = struct.Struct("<4sHxxQQQQI")
+# The first byte of a record: its fields joined by NUL characters, or (for a
+# record with a NUL character in a field) pickled.
+_JOINED = b"\x00"
+_PICKLED = b"\x01"
+
+
+def _keyHash(key: str) -> int:
+    """
+    Returns the hash of a key used in the hash table, which (unlike hash())
+    is the same in every process.
+    """
+    return zlib.crc32(key.encode("utf-8", "surrogatepass"))
+
+
+def _encodeRecord(row: list) -> bytes:
+    """
+    Returns the cached form of a record.
+    """
+    text = "\x00".join(row)
+    if row and text.count("\x00") == len(row) - 1:
+        try:
+            return _JOINED + text.encode("utf-8")
+        except UnicodeEncodeError:
+            pass
+    return _PICKLED + pickle.dumps(row, pickle.HIGHEST_PROTOCOL)
+
+
+class DatasourceCache():
+
+    def __init__(self, path: str):
+        """
+        path: the location of the cache file.
+        """
+        self._path = path
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._keyIndex = 0
+        self._positions = None
+        self._hashes = None
+        self._indexes = None
+
+    @property
+    def count(self) -> int:
+        """
+        Returns the number of records in the cache.
+        """
+        return self._count
+
+    def load(self, fingerprint: str, filetype: str, keyIndex: int) -> bool:
+        """
+        Opens the cache file.  Returns true if it holds the records of the
+        datasource with the provided fingerprint, parsed as filetype and
+        keyed by the field at keyIndex; otherwise false, and the cache must
+        be built before it is used.
+        """
+        self.close()
+        try:
+            f = open(self._path, 'rb')
+        except OSError:
+            return False
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            f.close()
+            return False
+        try:
+            (magic, version, count, positionsat, tableat, slots,
+             metalength) = _HEADER.unpack_from(mm, 0)
+            meta = json.loads(mm[_HEADER.size:_HEADER.size + metalength])
+        except (struct.error, ValueError):
+            magic = None
+        # The tables are in the byte order of the machine that wrote them.
+        if (magic != _MAGIC or version != CACHE_FORMAT_VERSION
+                or meta != [fingerprint, filetype, keyIndex, sys.byteorder]):
+            mm.close()
+            f.close()
+            return False
+        view = memoryview(mm)
+        self._positions = view[positionsat:positionsat + 8 * (count + 1)].cast("Q")
+        self._hashes = view[tableat:tableat + 4 * slots].cast("I")
+        self._indexes = view[tableat + 4 * slots:tableat + 8 * slots].cast("I")
+        view.release()
+        self._file = f
+        self._map = mm
+        self._count = count
+        self._slots = slots
+        self._keyIndex = keyIndex
+        return True
+
+    def build(self, rows, fingerprint: str, filetype: str, keyIndex: int):
+        """
+        Writes the cache from the provided rows (lists of field values) of
+        the datasource with the provided fingerprint, and opens it.  The
+        cache is written to a temporary file that is then moved into place,
+        so a run reading the cache at the same time is not disturbed.
+        """
+        self.close()
+        meta = json.dumps([fingerprint, filetype, keyIndex, sys.byteorder]).encode("utf-8")
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmppath = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self._path))
+        try:
+            with open(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, CACHE_FORMAT_VERSION, 0, 0, 0, 0, len(meta)))
+                f.write(meta)
+                position = f.tell()
+                positions = array("Q", [position])
+                # { lower-case key: record index }, the last record with a
+                # key taking precedence as it does in a page.
+                keys = {}
+                for i, row in enumerate(rows):
+                    record = _encodeRecord(row)
+                    f.write(record)
+                    position += len(record)
+                    positions.append(position)
+                    if len(row) > keyIndex:
+                        keys[row[keyIndex].lower()] = i
+                count = len(positions) - 1
+                f.write(bytes(-f.tell() % 8))
+                positionsat = f.tell()
+                positions.tofile(f)
+
+                # A power of two at most two thirds full.
+                slots = 1
+                while 2 * slots < 3 * max(count, 1):
+                    slots *= 2
+                mask = slots - 1
+                hashes = array("I", [0]) * slots
+                # Record index + 1, or 0 for an empty slot.
+                indexes = array("I", [0]) * slots
+                for key, i in keys.items():
+                    keyhash = _keyHash(key)
+                    slot = keyhash & mask
+                    while indexes[slot]:
+                        slot = (slot + 1) & mask
+                    hashes[slot] = keyhash
+                    indexes[slot] = i + 1
+                tableat = f.tell()
+                hashes.tofile(f)
+                indexes.tofile(f)
+
+                f.seek(0)
+                f.write(_HEADER.pack(_MAGIC, CACHE_FORMAT_VERSION, count,
+                                     positionsat, tableat, slots, len(meta)))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmppath, self._path)
+        except BaseException:
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
+            raise
+        if not self.load(fingerprint, filetype, keyIndex):
+            raise OSError("The datasource cache at " + self._path
+                          + " could not be read back after it was written.")
+
+    def row(self, index: int) -> list:
+        """
+        Returns the record at the provided index.
+        """
+        start = self._positions[index]
+        end = self._positions[index + 1]
+        if self._map[start] == _JOINED[0]:
+            return self._map[start + 1:end].decode("utf-8").split("\x00")
+        return pickle.loads(self._map[start + 1:end])
+
+    def find(self, key: str) -> list:
+        """
+        Returns the record with the provided key, or None if there is none.
+        """
+        if self._map is None:
+            return None
+        key = key.lower()
+        keyhash = _keyHash(key)
+        mask = self._slots - 1
+        slot = keyhash & mask
+        while self._indexes[slot]:
+            if self._hashes[slot] == keyhash:
+                row = self.row(self._indexes[slot] - 1)
+                if row[self._keyIndex].lower() == key:
+                    return row
+            slot = (slot + 1) & mask
+        return None
+
+    def close(self):
+        """
+        Releases the cache file.
+        """
+        for view in (self._positions, self._hashes, self._indexes):
+            if view is not None:
+                view.release()
+        self._positions = self._hashes = self._indexes = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,221 @@
+"""
+Description: Checks the datasource before any of it is synced, reading it
+through once without holding it in memory, for the records that would
+otherwise cause trouble in the sync: records with no ID, records with fewer
+fields than the column definition needs, IDs found in more than one record
+(which overwrite each other on a page, or are synced once for each page they
+are on) and users who share a secondary match value (who cannot all be linked
+by it).  Each problem is logged.  The pages read for the sync are then
+filtered so that each ID is synced at most once, with the record the
+duplicate policy chooses, and the records quarantined are left out.
+"""
+
+import logging
+
+
+class DatasourceValidator():
+    # What is synced for an ID found in more than one record.
+    DUPLICATES_FIRST = "first"
+    DUPLICATES_LAST = "last"
+    DUPLICATES_MERGE = "merge"
+    DUPLICATES_QUARANTINE = "quarantine"
+    # What is done with users who share a secondary match value.
+    CONFLICTS_REPORT = "report"
+    CONFLICTS_QUARANTINE = "quarantine"
+
+    def __init__(self, logger: logging.Logger, columnDefinition: dict,
+                 keyColumn: str, secondaryMatchColumn: str = None,
+                 duplicatePolicy: str = "last", conflictPolicy: str = "report"):
+        """
+        logger: the logger to report the problems found to.
+
+        columnDefinition: { column name: column number } of the records, as
+        in DS_COLUMN_DEFINITION.
+
+        keyColumn: the name of the column holding the ID of each record.
+
+        secondaryMatchColumn: the name of the column holding the secondary
+        match value, or None not to check for shared values.
+
+        duplicatePolicy: for an ID found in more than one record, "first" or
+        "last" to sync only that record, "merge" to sync one record made up
+        of the last non-empty value of each field, or "quarantine" to sync
+        none of them.
+
+        conflictPolicy: for users who share a secondary match value,
+        "report" to sync them as usual or "quarantine" to sync none of them.
+        """
+        if duplicatePolicy not in (self.DUPLICATES_FIRST, self.DUPLICATES_LAST,
+                                   self.DUPLICATES_MERGE, self.DUPLICATES_QUARANTINE):
+            raise ValueError("Unknown duplicate policy " + repr(duplicatePolicy) + ".")
+        if conflictPolicy not in (self.CONFLICTS_REPORT, self.CONFLICTS_QUARANTINE):
+            raise ValueError("Unknown secondary match conflict policy "
+                             + repr(conflictPolicy) + ".")
+        self._logger = logger
+        self._keyIndex = columnDefinition[keyColumn]
+        self._secondaryMatchColumn = secondaryMatchColumn
+        self._secondaryIndex = columnDefinition.get(secondaryMatchColumn)
+        self._width = max(columnDefinition.values()) + 1
+        self._duplicatePolicy = duplicatePolicy
+        self._conflictPolicy = conflictPolicy
+        # The lower-case IDs of the records left out of the sync, and
+        # { lower-case ID: (record index, record) } of the record to sync
+        # for each ID found in more than one record.
+        self._quarantined = set()
+        self._chosen = {}
+
+    @property
+    def quarantinedCount(self) -> int:
+        """
+        Returns the number of IDs whose records are left out of the sync.
+        Records with no ID are not counted, since they can never be synced.
+        """
+        return sum(1 for key in self._quarantined if key.strip())
+
+    def validate(self, pager):
+        """
+        Reads every record of the datasource from pager (with its records()
+        method), logs the problems found and works out what is to be synced
+        for the IDs with problems.  If records are to be chosen between or
+        merged, the datasource is read a second time to collect them.
+        """
+        keyIndex = self._keyIndex
+        secondaryIndex = self._secondaryIndex
+        width = self._width
+        # { lower-case ID: (index, ID) } of the first complete record of each
+        # ID, and { lower-case ID: [indexes] } of the complete records of the
+        # IDs found more than once.
+        first = {}
+        repeated = {}
+        # The indexes of the records with no ID, and (index, ID) of those
+        # with too few fields.
+        keyless = []
+        short = []
+        # { lower-case secondary match value: lower-case ID } of the first
+        # user with each value, and { value: [lower-case IDs] } of the values
+        # shared by more than one user.
+        secondary = {}
+        shared = {}
+        count = 0
+        for index, row in enumerate(pager.records()):
+            count += 1
+            if len(row) <= keyIndex or not row[keyIndex].strip():
+                keyless.append(index)
+                if len(row) > keyIndex:
+                    self._quarantined.add(row[keyIndex].lower())
+                continue
+            key = row[keyIndex].lower()
+            if len(row) < width:
+                short.append((index, row[keyIndex]))
+                continue
+            if key in first:
+                repeated.setdefault(key, [first[key][0]]).append(index)
+            else:
+                first[key] = (index, row[keyIndex])
+            if secondaryIndex is not None:
+                value = row[secondaryIndex].strip().lower()
+                if value:
+                    owner = secondary.setdefault(value, key)
+                    if owner != key:
+                        owners = shared.setdefault(value, [owner])
+                        if key not in owners:
+                            owners.append(key)
+
+        for index in keyless:
+            self._logger.warning("Datasource record " + str(index)
+                                 + " has no ID and will not be synced.")
+        # The lower-case IDs whose record to sync is to be chosen from
+        # several, or picked out from among short records.
+        choose = set()
+        for index, linkid in short:
+            self._logger.warning(linkid + ": Datasource record " + str(index) + " has fewer than the "
+                                 + str(width) + " fields expected and will not be synced.")
+            key = linkid.lower()
+            if key in first:
+                choose.add(key)
+            else:
+                self._quarantined.add(key)
+        for key, indexes in repeated.items():
+            message = (first[key][1] + ": The ID is in " + str(len(indexes))
+                       + " datasource records (" + ", ".join(str(i) for i in indexes) + ").")
+            if self._duplicatePolicy == self.DUPLICATES_QUARANTINE:
+                self._logger.warning(message + " None of them will be synced.")
+                self._quarantined.add(key)
+            elif self._duplicatePolicy == self.DUPLICATES_MERGE:
+                self._logger.warning(message + " They will be merged into one.")
+                choose.add(key)
+            else:
+                self._logger.warning(message + " Only the " + self._duplicatePolicy
+                                     + " will be synced.")
+                choose.add(key)
+        for value, owners in shared.items():
+            message = (", ".join(first[key][1] for key in owners) + ": These users share the "
+                       + str(self._secondaryMatchColumn) + " value " + value + ".")
+            if self._conflictPolicy == self.CONFLICTS_QUARANTINE:
+                self._logger.warning(message + " None of them will be synced.")
+                self._quarantined.update(owners)
+            else:
+                self._logger.warning(message + " At most one of them can be linked by it.")
+        choose -= self._quarantined
+        if choose:
+            self._choose(pager, choose)
+
+        self._logger.info("Checked " + str(count) + " datasource records: "
+                          + str(len(keyless)) + " with no ID, "
+                          + str(len(short)) + " with too few fields, "
+                          + str(len(repeated)) + " IDs in more than one record and "
+                          + str(len(shared)) + " shared secondary match values. "
+                          + str(self.quarantinedCount) + " IDs will not be synced.")
+
+    def _choose(self, pager, choose: set):
+        """
+        Reads the datasource again to collect the complete records of the
+        IDs in choose, and picks or merges the record to sync for each.
+        """
+        keyIndex = self._keyIndex
+        width = self._width
+        found = {}
+        for index, row in enumerate(pager.records()):
+            if len(row) >= width and row[keyIndex].strip():
+                key = row[keyIndex].lower()
+                if key in choose:
+                    found.setdefault(key, []).append((index, row))
+        for key, records in found.items():
+            if self._duplicatePolicy == self.DUPLICATES_LAST:
+                self._chosen[key] = records[-1]
+            elif self._duplicatePolicy == self.DUPLICATES_MERGE:
+                merged = list(records[0][1])
+                for index, row in records[1:]:
+                    for n, value in enumerate(row[:len(merged)]):
+                        if value:
+                            merged[n] = value
+                self._chosen[key] = (records[0][0], merged)
+            else:
+                self._chosen[key] = records[0]
+
+    def filterPage(self, page: dict, index: int, nextIndex: int):
+        """
+        Filters a page read from the record at index up to the record at
+        nextIndex (-1 after the last page).  Returns the page with the
+        quarantined records left out and, for each ID found in more than one
+        record, the record chosen for it on the page that holds that record
+        (and no other page), along with a list of the IDs left out.
+        """
+        if not self._quarantined and not self._chosen:
+            return page, []
+        filtered = {}
+        withheld = []
+        for linkid, row in page.items():
+            key = linkid.lower()
+            if key in self._quarantined:
+                withheld.append(linkid)
+                continue
+            chosen = self._chosen.get(key)
+            if chosen is not None:
+                at, row = chosen
+                if at < index or (nextIndex != -1 and at >= nextIndex):
+                    withheld.append(linkid)
+                    continue
+                linkid = row[self._keyIndex]
+            filtered[linkid] = row
+        return filtered, withheld
@@ -0,0 +1,280 @@
+"""
+Description: Pages through a large datasource file like CSVPager, but parses
+it in several processes at once.  The file is memory-mapped and split into
+chunks of about chunkSize bytes that end on record boundaries, so each chunk
+can be parsed on its own with csv.reader in a process pool while the pages
+are handed out in file order.
+
+A newline ends a record only outside a quoted field.  Quotes inside a quoted
+field are doubled, so a newline is outside one when the number of quote
+characters before it is even.  This holds for any file written by a csv
+writer, but not for a file with stray quote characters inside unquoted
+fields, which should be read with CSVPager instead.
+"""
+
+import csv
+import hashlib
+import io
+import locale
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from CSVPager import CSVPager
+
+
+def _parseChunk(filepath: str, start: int, end: int, filetype: str,
+                encoding: str) -> list:
+    """
+    Process pool task: parses the records in bytes start to end of the file
+    and returns them as a list of rows.
+    """
+    with open(filepath, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode(encoding)
+    return list(csv.reader(io.StringIO(text, newline=None), filetype))
+
+
+def _countChunk(filepath: str, start: int, end: int, filetype: str,
+                encoding: str) -> int:
+    """
+    Process pool task: returns the number of records in bytes start to end
+    of the file.
+    """
+    return len(_parseChunk(filepath, start, end, filetype, encoding))
+
+
+class MappedCSVPager():
+    FILE_TYPE_CSV = CSVPager.FILE_TYPE_CSV
+    FILE_TYPE_TSV = CSVPager.FILE_TYPE_TSV
+
+    def __init__(self, filepath: str, filetype: str, pageSize: int,
+                 keyIndex: int = 0, keyFilter=None, workers: int = 4,
+                 chunkSize: int = 8388608, encoding: str = None):
+        """
+        filepath, filetype, pageSize, keyIndex and keyFilter are as for
+        CSVPager.
+
+        workers: the number of processes that parse the file.
+
+        chunkSize: the approximate size in bytes of the part of the file
+        each process parses at a time.
+
+        encoding: the character set encoding of the file.  Defaults to the
+        encoding CSVPager opens files with.
+        """
+        try:
+            self._file = open(filepath, 'rb')
+        except OSError:
+            raise OSError("Error opening file at the provided path.")
+        self._filepath = filepath
+        self._filetype = filetype
+        self._pageSize: int = pageSize
+        self._page: dict = {}
+        self._keyIndex = keyIndex
+        self._keyFilter = keyFilter
+        self._workers = workers
+        self._chunkSize = chunkSize
+        self._encoding = encoding or locale.getpreferredencoding(False)
+        self._quote = csv.get_dialect(filetype).quotechar.encode(self._encoding)
+        self._map = None
+        if self._size() > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._fingerprint = None
+        self._csvRecordCount = None
+        self._executor = None
+        # The rows of the chunk being paged, the position in it of the next
+        # row to page, the record index of that row, and the chunks to come.
+        self._rows = []
+        self._position = 0
+        self._nextIndex = 0
+        self._chunks = None
+
+    def _size(self) -> int:
+        self._file.seek(0, 2)
+        return self._file.tell()
+
+    def _chunkBounds(self):
+        """
+        Yields (start, end) byte positions of the chunks of the file, each
+        ending just after a newline that ends a record (or at the end of the
+        file).
+        """
+        mm = self._map
+        size = len(mm) if mm is not None else 0
+        start = 0
+        while start < size:
+            end = min(start + self._chunkSize, size)
+            if end < size:
+                quotes = mm[start:end].count(self._quote)
+                while True:
+                    newline = mm.find(b'\n', end)
+                    if newline == -1:
+                        end = size
+                        break
+                    quotes += mm[end:newline].count(self._quote)
+                    end = newline + 1
+                    if quotes % 2 == 0:
+                        break
+            yield (start, end)
+            start = end
+
+    def _pool(self) -> ProcessPoolExecutor:
+        """
+        Returns the process pool, starting it on first use.  The workers are
+        spawned rather than forked, since the sync's other threads may be
+        holding locks by then that a forked copy would never see released.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self._workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _parsedChunks(self, task=_parseChunk):
+        """
+        Yields the result of task for each chunk of the file in order,
+        keeping up to twice as many chunks as there are workers being parsed
+        ahead.  A file of a single chunk is parsed in this process.
+        """
+        bounds = self._chunkBounds()
+        first = next(bounds, None)
+        if first is None:
+            return
+        second = next(bounds, None)
+        args = (self._filepath,)
+        tail = (self._filetype, self._encoding)
+        if second is None:
+            yield task(*args, *first, *tail)
+            return
+        pool = self._pool()
+        pending = [pool.submit(task, *args, *first, *tail),
+                   pool.submit(task, *args, *second, *tail)]
+        for start, end in bounds:
+            while len(pending) >= 2 * self._workers:
+                yield pending.pop(0).result()
+            pending.append(pool.submit(task, *args, start, end, *tail))
+        while pending:
+            yield pending.pop(0).result()
+
+    def records(self):
+        """
+        Yields every record of the file in order, whether or not keyFilter
+        accepts it, without disturbing the pages being read.
+        """
+        for chunk in self._parsedChunks():
+            yield from chunk
+
+    def _restart(self):
+        """
+        Goes back to the beginning of the file.
+        """
+        self._chunks = self._parsedChunks()
+        self._rows = []
+        self._position = 0
+        self._nextIndex = 0
+
+    def _fill(self) -> bool:
+        """
+        Makes sure there is an unpaged row at self._position, parsing more
+        chunks as they are needed.  Returns false at the end of the file.
+        """
+        while self._position >= len(self._rows):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            self._rows = chunk
+            self._position = 0
+        return True
+
+    def getPage(self, startIndex: int = 0) -> int:
+        """
+        Reads the page starting with the record at startIndex into the page
+        property, as CSVPager.getPage does.  Returns the index of the record
+        following the page, or -1 after the last page.
+
+        Pages read in order follow on from each other without rescanning
+        the file; reading any other page parses the file from the
+        beginning.
+        """
+        if self._chunks is None or startIndex < self._nextIndex:
+            self._restart()
+        p = {}
+        retval = -1
+        i = self._nextIndex
+        keyIndex = self._keyIndex
+        keyFilter = self._keyFilter
+        while retval == -1 and self._fill():
+            rows = self._rows
+            position = self._position
+            if i < startIndex:
+                skip = min(startIndex - i, len(rows) - position)
+                position += skip
+                i += skip
+            while position < len(rows):
+                row = rows[position]
+                position += 1
+                i += 1
+                if len(row) > keyIndex and (keyFilter is None or keyFilter(row[keyIndex])):
+                    p[row[keyIndex]] = row
+                    if len(p) == self._pageSize:
+                        retval = i
+                        break
+            self._position = position
+        self._page = p
+        # A full last page is reported as the last, as CSVPager does.
+        if retval != -1 and not self._fill():
+            retval = -1
+        if retval == -1:
+            if self._csvRecordCount is None:
+                self._csvRecordCount = i
+            self._chunks = None
+            self._rows = []
+            self._position = 0
+            self._nextIndex = 0
+        else:
+            self._nextIndex = retval
+        return retval
+
+    @property
+    def page(self) -> dict:
+        """
+        Gets Current page of data or empty dict if not set.
+        """
+        return self._page
+
+    @property
+    def csvRecordCount(self) -> int:
+        """
+        Return the record count of the file.  Unless the file has already
+        been read through, the records are counted in the process pool.
+        """
+        if self._csvRecordCount is None:
+            self._csvRecordCount = sum(self._parsedChunks(_countChunk))
+        return self._csvRecordCount
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Returns a hash of the data source file contents, the same as
+        CSVPager.fingerprint gives for the file.
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            if self._map is not None:
+                h.update(self._map)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def close(self):
+        """
+        Stops the process pool and releases the file.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        self._chunks = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
@@ -0,0 +1,282 @@
+"""
+Description: Combines several datasource files into one datasource, such as
+separate student and staff exports along with a file of overrides for some
+users.  Each file is read in linkid order (sorted with an external merge sort
+first, unless the files are known to be sorted) and the files are merged in a
+single pass, so only a page of each file and a record from each file are held
+in memory at once.  Records with the same linkid are combined field by field,
+each field taken from the file with the highest precedence that has a value
+for it.
+"""
+
+import hashlib
+import heapq
+import itertools
+import os
+from operator import itemgetter
+
+from CSVPager import CSVPager
+from SortedMerge import externalSort
+
+
+class MergedCSVPager():
+
+    def __init__(self, filepaths: list, filetype: str, pageSize: int,
+                 columnDefinition: dict, keyColumn: str, keyFilter=None,
+                 fileColumnDefinitions: dict = None, precedence: dict = None,
+                 overrideFiles=(), presorted: bool = False,
+                 sortChunkSize: int = 100000, tempDir: str = None):
+        """
+        filepaths: the datasource files, in increasing order of precedence.
+        Where the files give different values for a field, the value from
+        the file listed last is used unless precedence says otherwise.
+
+        filetype, pageSize and keyFilter are as for CSVPager.
+
+        columnDefinition: { column name: column number } of the combined
+        records, as in DS_COLUMN_DEFINITION.
+
+        keyColumn: the name of the column holding the linkid.
+
+        fileColumnDefinitions: { file name: column definition } for the
+        files whose columns differ from columnDefinition.  Files are named
+        without their directory.  A file may leave out any column but the
+        linkid.
+
+        precedence: { column name: (file names) } giving the files to take
+        the value of a column from first, in order of preference.  The
+        other files follow in the default order.
+
+        overrideFiles: the names of the files that only change the fields
+        of users found in the other files.  Their records for any other
+        users are ignored.
+
+        presorted: true if each file is already sorted by linkid (compared
+        in lower case).  The files are then merged without being sorted,
+        and a file found out of order raises a ValueError.
+
+        sortChunkSize, tempDir: as for SortedMerge.externalSort.
+        """
+        names = [os.path.basename(path) for path in filepaths]
+        fileColumnDefinitions = fileColumnDefinitions or {}
+        precedence = precedence or {}
+        self._filepaths = list(filepaths)
+        self._filetype = filetype
+        self._pageSize = pageSize
+        self._columnDefinition = columnDefinition
+        self._keyColumn = keyColumn
+        self._keyIndex = columnDefinition[keyColumn]
+        self._keyFilter = keyFilter
+        self._definitions = [fileColumnDefinitions.get(name, columnDefinition)
+                             for name in names]
+        for path, definition in zip(self._filepaths, self._definitions):
+            if keyColumn not in definition:
+                raise ValueError("The column definition for " + path
+                                 + " has no " + keyColumn + " column.")
+        self._overrides = {n for n, name in enumerate(names) if name in overrideFiles}
+        self._presorted = presorted
+        self._sortChunkSize = sortChunkSize
+        self._tempDir = tempDir
+        self._width = max(columnDefinition.values()) + 1
+
+        # (record column, [file numbers in order of precedence]) for each
+        # column of the combined records.
+        default = list(reversed(range(len(names))))
+        self._orders = []
+        for column, index in columnDefinition.items():
+            preferred = [names.index(name) for name in precedence.get(column, ())
+                         if name in names]
+            order = preferred + [n for n in default if n not in preferred]
+            if column == keyColumn:
+                # The linkid is written as the main files have it.
+                order = ([n for n in order if n not in self._overrides]
+                         + [n for n in order if n in self._overrides])
+            self._orders.append((index, order))
+
+        self._page: dict = {}
+        self._fingerprint = None
+        self._csvRecordCount = None
+        # The combined records, the record read ahead of the last page to
+        # tell whether it was the last, the index of the next record and the
+        # pagers of the files being read.
+        self._records = None
+        self._lookahead = None
+        self._nextIndex = 0
+        self._pagers = []
+
+    def _fileRecords(self, fileno: int):
+        """
+        Yields (lower-case linkid, file number, record) for each record of a
+        file, with the record laid out as given by columnDefinition and None
+        for the columns the file does not have.
+        """
+        definition = self._definitions[fileno]
+        placement = [(definition[column], index)
+                     for column, index in self._columnDefinition.items()
+                     if column in definition]
+        pager = CSVPager(self._filepaths[fileno], self._filetype, self._pageSize,
+                         definition[self._keyColumn], self._keyFilter)
+        self._pagers.append(pager)
+        i = 0
+        while True:
+            nexti = pager.getPage(i)
+            for key, row in pager.page.items():
+                record = [None] * self._width
+                for source, index in placement:
+                    if source < len(row):
+                        record[index] = row[source]
+                yield (key.lower(), fileno, record)
+            if nexti == -1:
+                return
+            i = nexti
+
+    def _checkSorted(self, items, fileno: int):
+        """
+        Passes through the records of a file said to be sorted, raising
+        ValueError if one is out of order.
+        """
+        previous = None
+        for item in items:
+            if previous is not None and item[0] < previous:
+                raise ValueError(self._filepaths[fileno] + " is not sorted by linkid: "
+                                 + repr(item[0]) + " follows " + repr(previous))
+            previous = item[0]
+            yield item
+
+    def _combinedRecords(self):
+        """
+        Yields the combined record for each linkid in the files, in linkid
+        order.
+        """
+        streams = []
+        for fileno in range(len(self._filepaths)):
+            stream = self._fileRecords(fileno)
+            if self._presorted:
+                stream = self._checkSorted(stream, fileno)
+            else:
+                stream = externalSort(stream, key=itemgetter(0),
+                                      chunkSize=self._sortChunkSize,
+                                      tempDir=self._tempDir)
+            streams.append(stream)
+        merged = heapq.merge(*streams, key=itemgetter(0))
+        for key, group in itertools.groupby(merged, itemgetter(0)):
+            record = self._combine(group)
+            if record is not None:
+                yield record
+
+    def _combine(self, group) -> list:
+        """
+        Combines the records for one linkid, or returns None if they all
+        come from override files.
+        """
+        byfile = {}
+        for key, fileno, record in group:
+            byfile.setdefault(fileno, []).append(record)
+        if self._overrides.issuperset(byfile):
+            return None
+        combined = [""] * self._width
+        for index, order in self._orders:
+            for fileno in order:
+                # A later record in the same file takes precedence.
+                values = [record[index] for record in byfile.get(fileno, ())
+                          if record[index]]
+                if values:
+                    combined[index] = values[-1]
+                    break
+        return combined
+
+    def records(self):
+        """
+        Yields each combined record in order, as the pages hold them,
+        without disturbing the pages being read.  Since the files are
+        filtered before they are combined, the records keyFilter rejects
+        are left out.
+        """
+        records = self._combinedRecords()
+        try:
+            yield from records
+        finally:
+            records.close()
+
+    def getPage(self, startIndex: int = 0) -> int:
+        """
+        Reads the page starting with the record at startIndex into the page
+        property, as CSVPager.getPage does.  Returns the index of the record
+        following the page, or -1 after the last page.
+
+        Pages read in order follow on from each other; reading any other
+        page merges the files again from the beginning.
+        """
+        if self._records is None or startIndex < self._nextIndex:
+            self.close()
+            self._records = self._combinedRecords()
+            self._lookahead = None
+            self._nextIndex = 0
+
+        p = {}
+        retval = -1
+        i = self._nextIndex
+        while True:
+            if self._lookahead is not None:
+                record, self._lookahead = self._lookahead, None
+            else:
+                record = next(self._records, None)
+                if record is None:
+                    break
+            if i >= startIndex:
+                p[record[self._keyIndex]] = record
+            i += 1
+            if len(p) == self._pageSize:
+                self._lookahead = next(self._records, None)
+                if self._lookahead is not None:
+                    retval = i
+                break
+        self._page = p
+        if retval != -1:
+            self._nextIndex = retval
+        else:
+            self._csvRecordCount = i
+            self.close()
+        return retval
+
+    @property
+    def page(self) -> dict:
+        """
+        Gets Current page of data or empty dict if not set.
+        """
+        return self._page
+
+    @property
+    def csvRecordCount(self) -> int:
+        """
+        Return the number of combined records, or None if the files have
+        not yet been read to the end.
+        """
+        return self._csvRecordCount
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Returns a hash of the contents of the files, used to tell whether
+        saved progress information still applies to this datasource.
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            for path in self._filepaths:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1048576), b''):
+                        h.update(chunk)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def close(self):
+        """
+        Stops merging the files and closes them.
+        """
+        if self._records is not None:
+            self._records.close()
+            self._records = None
+        for pager in self._pagers:
+            pager.close()
+        self._pagers = []
+        self._nextIndex = 0
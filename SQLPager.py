@@ -0,0 +1,363 @@
+"""
+Description: Pages through the results of a SQL query in place of a
+datasource file, fetching IMPORT_CHUNK_SIZE rows at a time from the cursor so
+the whole result is never held in memory.  Pages have the same form as those
+of CSVPager: each record is a list of string values placed by the column
+numbers of DS_COLUMN_DEFINITION, taken from the result columns of the same
+names.
+
+With an incremental query and a watermark column, only the rows changed
+since the last sync are read.  The highest watermark value read is saved once
+a sync of every row has succeeded, and the next run passes it to the
+incremental query as its watermark parameter.  Until a watermark has been
+saved (or if the incremental query is changed), the full query is used.
+
+The query is read with a server-side (named) cursor where the driver's
+cursor() takes a name, as psycopg2's does, so that the database sends the
+rows as they are fetched.  Other drivers are given an ordinary cursor, and
+some of them (MySQLdb's default cursor, for one) load the whole result into
+memory when the query is run, whatever the page size.
+
+Connections are closed on the thread that opened them, since some drivers
+(sqlite3 among them) refuse to close a connection from any other thread.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+
+# Name of the server-side cursor the query is read with.
+CURSOR_NAME = "datasource"
+
+
+def _openCursor(connection):
+    """
+    Returns a server-side cursor on the connection if the driver supports
+    them, or else an ordinary cursor.
+    """
+    try:
+        return connection.cursor(name=CURSOR_NAME)
+    except TypeError:
+        return connection.cursor()
+
+
+def _closeConnection(connection, thread: int):
+    """
+    Closes a connection opened on the thread with the identifier thread.
+    From another thread, a driver that refuses to close it there is left to
+    close it when the connection is garbage collected.
+    """
+    if threading.get_ident() == thread:
+        connection.close()
+        return
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class SQLPager():
+
+    def __init__(self, connect, query: str, pageSize: int,
+                 columnDefinition: dict, keyColumn: str, keyFilter=None,
+                 incrementalQuery: str = None, watermarkColumn: str = None,
+                 watermarkPath: str = None):
+        """
+        connect: a function that returns a new DB-API connection to the
+        database, such as lambda: sqlite3.connect("sis.db")
+
+        query: the query that returns every datasource record.
+
+        pageSize: the number of records that should be returned per page.
+
+        columnDefinition: { column name: column number } for the records, as
+        in DS_COLUMN_DEFINITION.  The query must return a column of each
+        name (compared without regard to case).
+
+        keyColumn: the name of the column holding the key of each record.
+
+        keyFilter: as for CSVPager.
+
+        incrementalQuery: the query that returns the records changed since
+        the watermark, given as a parameter named watermark (for example
+        "... WHERE updated_at > :watermark") or as the only ? parameter.
+
+        watermarkColumn: the name of the column, returned by both queries,
+        whose highest value is the watermark for the next run.
+
+        watermarkPath: the file the watermark is kept in between runs.
+        """
+        self._connect = connect
+        self._pageSize = pageSize
+        self._columnDefinition = columnDefinition
+        self._keyColumn = keyColumn
+        self._keyFilter = keyFilter
+        self._incrementalQuery = incrementalQuery
+        self._watermarkColumn = watermarkColumn
+        self._watermarkPath = watermarkPath
+        self._page: dict = {}
+        self._csvRecordCount = None
+        self._fingerprint = None
+
+        self._query = query
+        self._params = ()
+        watermark = self._loadWatermark()
+        self._incremental = watermark is not None
+        if self._incremental:
+            self._query = incrementalQuery
+            if ":watermark" in incrementalQuery:
+                self._params = {"watermark": watermark}
+            else:
+                self._params = (watermark,)
+        # The highest watermark value read (None until a row with one has
+        # been read, in which case the saved watermark still stands), and
+        # whether every row of the query has been read since it was run.
+        self._highWatermark = None
+        self._complete = False
+
+        self._connection = None
+        self._connectionThread = None
+        self._cursor = None
+        self._described = False
+        # The rows fetched but not yet paged, the position in them of the
+        # next row to page and the record index of that row.
+        self._rows = []
+        self._position = 0
+        self._nextIndex = 0
+
+    @property
+    def incremental(self) -> bool:
+        """
+        Returns true if only the records changed since the last sync are
+        read, so that a record missing from the datasource has not
+        necessarily been removed.
+        """
+        return self._incremental
+
+    def _loadWatermark(self):
+        """
+        Returns the saved watermark, or None if there is none for the
+        incremental query.
+        """
+        if not (self._incrementalQuery and self._watermarkColumn
+                and self._watermarkPath):
+            return None
+        try:
+            with open(self._watermarkPath, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get("query") != self._incrementalQuery:
+            return None
+        return saved.get("watermark")
+
+    def saveWatermark(self) -> bool:
+        """
+        Saves the highest watermark value read, to be used by the next run.
+        Call this only once every record has been synced.  Returns false,
+        saving nothing, if the query was not read through to the end or no
+        rows were read.
+        """
+        if not (self._complete and self._incrementalQuery
+                and self._watermarkColumn and self._watermarkPath):
+            return False
+        if self._highWatermark is None:
+            return False
+        saved = {"query": self._incrementalQuery, "watermark": self._highWatermark}
+        tmppath = self._watermarkPath + ".tmp"
+        with open(tmppath, 'w') as f:
+            # Dates and times are saved as text, which databases convert back
+            # when the value is compared with a column.
+            json.dump(saved, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmppath, self._watermarkPath)
+        return True
+
+    def _execute(self):
+        """
+        Runs the query and works out where each result column goes in the
+        records.
+        """
+        self.close()
+        self._connection = self._connect()
+        self._connectionThread = threading.get_ident()
+        self._cursor = _openCursor(self._connection)
+        self._cursor.execute(self._query, self._params)
+        self._described = False
+        self._rows = []
+        self._position = 0
+        self._nextIndex = 0
+        self._complete = False
+        self._highWatermark = None
+
+    def _describe(self, cursor):
+        """
+        Works out where each result column of the query run on cursor goes
+        in the records.  A server-side cursor may only describe its columns
+        once rows have been fetched from it.
+        """
+        columns = {d[0].lower(): n for n, d in enumerate(cursor.description)}
+        missing = [name for name in self._columnDefinition
+                   if name.lower() not in columns]
+        if missing:
+            raise ValueError("The datasource query does not return the column(s) "
+                             + ", ".join(missing) + ".")
+        width = max(self._columnDefinition.values()) + 1
+        # (result column, record column) for each defined column.
+        self._placement = [(columns[name.lower()], index)
+                           for name, index in self._columnDefinition.items()]
+        self._width = width
+        self._keyPosition = columns[self._keyColumn.lower()]
+        self._watermarkPosition = None
+        if self._watermarkColumn and self._incrementalQuery:
+            if self._watermarkColumn.lower() not in columns:
+                raise ValueError("The datasource query does not return the watermark "
+                                 "column " + self._watermarkColumn + ".")
+            self._watermarkPosition = columns[self._watermarkColumn.lower()]
+
+    def _fill(self) -> bool:
+        """
+        Makes sure there is an unpaged row at self._position, fetching more
+        rows as they are needed.  Returns false after the last row.
+        """
+        while self._position >= len(self._rows):
+            if self._cursor is None:
+                return False
+            rows = self._cursor.fetchmany(self._pageSize)
+            if not self._described:
+                self._describe(self._cursor)
+                self._described = True
+            if not rows:
+                self._complete = True
+                self._csvRecordCount = self._nextIndex
+                self.close()
+                return False
+            if self._watermarkPosition is not None:
+                values = [row[self._watermarkPosition] for row in rows
+                          if row[self._watermarkPosition] is not None]
+                if values:
+                    high = max(values)
+                    if self._highWatermark is None or high > self._highWatermark:
+                        self._highWatermark = high
+            self._rows = rows
+            self._position = 0
+        return True
+
+    def _record(self, row) -> list:
+        """
+        Returns the datasource record for a result row.
+        """
+        record = [""] * self._width
+        for source, index in self._placement:
+            value = row[source]
+            record[index] = "" if value is None else str(value)
+        return record
+
+    def records(self):
+        """
+        Yields every record the query returns in order, whether or not
+        keyFilter accepts it.  The query is run on a connection of its own,
+        so the pages being read are not disturbed.
+        """
+        connection = self._connect()
+        thread = threading.get_ident()
+        try:
+            cursor = _openCursor(connection)
+            cursor.execute(self._query, self._params)
+            described = False
+            while True:
+                rows = cursor.fetchmany(self._pageSize)
+                if not described:
+                    self._describe(cursor)
+                    described = True
+                if not rows:
+                    return
+                for row in rows:
+                    yield self._record(row)
+        finally:
+            # The generator may be finished on another thread, or not until
+            # it is garbage collected.
+            _closeConnection(connection, thread)
+
+    def getPage(self, startIndex: int = 0) -> int:
+        """
+        Reads the page starting with the record at startIndex into the page
+        property, as CSVPager.getPage does.  Returns the index of the record
+        following the page, or -1 after the last page.
+
+        Pages read in order are fetched from the open cursor; reading any
+        other page runs the query again.
+        """
+        if self._cursor is None or startIndex < self._nextIndex:
+            self._execute()
+        p = {}
+        retval = -1
+        keyFilter = self._keyFilter
+        while retval == -1 and self._fill():
+            row = self._rows[self._position]
+            self._position += 1
+            self._nextIndex += 1
+            if self._nextIndex <= startIndex:
+                continue
+            key = row[self._keyPosition]
+            key = "" if key is None else str(key)
+            if keyFilter is None or keyFilter(key):
+                p[key] = self._record(row)
+                if len(p) == self._pageSize:
+                    retval = self._nextIndex
+        self._page = p
+        # A full last page is reported as the last, as CSVPager does.
+        if retval != -1 and not self._fill():
+            retval = -1
+        return retval
+
+    @property
+    def page(self) -> dict:
+        """
+        Gets Current page of data or empty dict if not set.
+        """
+        return self._page
+
+    @property
+    def csvRecordCount(self) -> int:
+        """
+        Return the number of records the query returns.  Unless every record
+        has already been read, they are counted by the database.
+        """
+        if self._csvRecordCount is None:
+            connection = self._connect()
+            try:
+                cursor = connection.cursor()
+                cursor.execute("SELECT COUNT(*) FROM (" + self._query + ") datasource",
+                               self._params)
+                self._csvRecordCount = cursor.fetchone()[0]
+            finally:
+                connection.close()
+        return self._csvRecordCount
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Returns a hash of the query and its watermark, used to tell whether
+        saved progress information still applies to this datasource.
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            h.update(json.dumps([self._query, self._params], default=str).encode())
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def close(self):
+        """
+        Closes the cursor and the connection to the database.  Called from a
+        thread other than the one that read the pages, the connection may
+        only be closed once it is garbage collected (see _closeConnection).
+        """
+        if self._connection is not None:
+            _closeConnection(self._connection, self._connectionThread)
+        self._connection = None
+        self._connectionThread = None
+        self._cursor = None
@@ -35,6 +35,79 @@ SMTP_FROM_ADDRESS = "blah@blah.org"
 # How many records should be processed at a time from the datasource file?
 IMPORT_CHUNK_SIZE = 500
 
+# The number of processes that parse the datasource file.  With more than one,
+# the file is memory-mapped and split into parts of about DS_PARSE_CHUNK_SIZE
+# bytes that are parsed at the same time, which speeds up very large files on
+# a machine with several cores.  Leave at 1 for a file that may contain quote
+# characters inside unquoted fields.  A compressed file is always read by one
+# process.
+DS_PARSE_WORKERS = 1
+DS_PARSE_CHUNK_SIZE = 8388608
+
+# Path to a binary cache of the parsed datasource file.  The cache is written
+# the first time a file is read and used by every later run against a file with
+# the same contents (such as a rerun after a failure), which then need not parse
+# the file at all.  Only used when a single datasource file is given, in which
+# case DS_PARSE_WORKERS is ignored.  Set to None to parse the file every run.
+DS_PARSED_CACHE_PATH = None
+
+# A SQL datasource, read with run.py --DatasourceFileType SQL in place of a
+# file.  DS_SQL_CONNECT is a function that returns a DB-API connection, and
+# DS_SQL_QUERY must return a column named for each column in
+# DS_COLUMN_DEFINITION (the column numbers are then ignored).  Rows are fetched
+# IMPORT_CHUNK_SIZE at a time, through a server-side cursor where the driver
+# has them (psycopg2 does); with other drivers the database may send the whole
+# result at once.
+# To read only the users changed since the last sync, set
+# DS_SQL_INCREMENTAL_QUERY to a query taking the watermark as a parameter
+# (:watermark, or ? for drivers that use that style), and DS_SQL_WATERMARK_COLUMN
+# to a column returned by both queries that increases as rows change.  The
+# highest value read is kept in DS_SQL_WATERMARK_PATH once a sync succeeds; the
+# full query is used until then, and whenever the file is deleted.  The orphan
+# sweep only runs on a full read.
+# Example:
+# import sqlite3
+# DS_SQL_CONNECT = lambda: sqlite3.connect("C:\\sis\\users.db")
+# DS_SQL_QUERY = "SELECT * FROM users ORDER BY ID"
+# DS_SQL_INCREMENTAL_QUERY = "SELECT * FROM users WHERE updated_at > :watermark ORDER BY ID"
+DS_SQL_CONNECT = None
+DS_SQL_QUERY = None
+DS_SQL_INCREMENTAL_QUERY = None
+DS_SQL_WATERMARK_COLUMN = "updated_at"
+DS_SQL_WATERMARK_PATH = ".\\sql.watermark"
+
+# Path to the checkpoint journal which records sync progress after each page of
+# the datasource.  If a sync run is interrupted, running again with --Resume
+# will pick up at the page following the last one completed.
+# Set to None to disable checkpointing.
+SYNC_CHECKPOINT_PATH = ".\\sync.checkpoint"
+
+# The sync runs as a pipeline of stages (reading the datasource, looking up the
+# users in AD, working out the changes needed, writing the changes and
+# collecting notifications) that work on different pages at the same time.
+# SYNC_PIPELINE_QUEUE_SIZE is the number of pages that may wait between two
+# stages; at most a few times this many pages are held in memory at once.
+SYNC_PIPELINE_QUEUE_SIZE = 2
+
+# The number of pages that may be looked up in AD, and written to AD, at the
+# same time (each on its own LDAP connection).  Generated usernames are
+# reserved as they are handed out, so new users on pages written at the same
+# time are never offered the same one.
+SYNC_PIPELINE_RESOLVE_WORKERS = 1
+SYNC_PIPELINE_WRITE_WORKERS = 1
+
+# Path to the sync ledger, a small database that records the usernames handed
+# out to new users so that concurrent syncs never offer the same one twice.
+# A sync can be spread across several hosts with run.py --Shard K/N --RunId ID
+# (each host syncs the users whose ID hashes to its shard, and every host of a
+# run is given the same run ID); the ledger is required for
+# this, must be on storage shared by every host, and also collects each shard's
+# new user notifications so the last shard to finish sends them all.  Those
+# notifications can include initial passwords, so restrict access to the
+# ledger file to the accounts the sync runs as.
+# Example: SYNC_LEDGER_PATH = "\\\\fileserver\\sync\\sync.ledger"
+SYNC_LEDGER_PATH = None
+
 # DS (Data Source) Column Definition: Defines names for each column in the
 # import CSV by column number (starting with zero).
 DS_COLUMN_DEFINITION = {
@@ -51,6 +124,27 @@ DS_COLUMN_DEFINITION = {
     "RESETPASS": 10,
 }
 
+# Several datasource files can be given to run.py --DatasourcePath, such as
+# separate student and staff exports and a file of overrides.  Records with the
+# same ID are combined into one, each field taken from the last file listed that
+# has a value for it, unless DS_FIELD_PRECEDENCE names the files to prefer for
+# that field.  Files whose columns differ from DS_COLUMN_DEFINITION are given
+# their own column definitions, by file name; they may leave out any column but
+# the ID.  Records in DS_OVERRIDE_FILES only change users found in the other
+# files.  The files are sorted by ID (as for SYNC_MERGE_JOIN, using
+# SYNC_MERGE_JOIN_SORT_CHUNK_SIZE and SYNC_MERGE_JOIN_TEMP_DIR) and merged in one
+# pass; set DS_FILES_SORTED if they are already sorted by ID to skip the sort.
+# Example:
+# DS_FILE_COLUMN_DEFINITIONS = {
+#     "overrides.csv": {"ID": 0, "EMAIL": 1, "TITLE": 2},
+# }
+# DS_FIELD_PRECEDENCE = {"STATUS": ("staff.csv", "students.csv")}
+# DS_OVERRIDE_FILES = ("overrides.csv",)
+DS_FILE_COLUMN_DEFINITIONS = {}
+DS_FIELD_PRECEDENCE = {}
+DS_OVERRIDE_FILES = ()
+DS_FILES_SORTED = False
+
 # The column defined below should contain a "1" to indicate that any target
 # databases which generate their own passwords should re-generate a new pass
 # for the user.
@@ -75,6 +169,21 @@ DS_ACCOUNT_IDENTIFIER = "ID"
 # that is guaranteed to be unique to the user.
 DS_SECONDARY_MATCH_COLUMN = "EMAIL"
 
+# Set DS_VALIDATE to check the whole datasource before any of it is synced, for
+# records with no ID, records with fewer columns than DS_COLUMN_DEFINITION needs
+# (neither of which is synced), IDs found in more than one record and users who
+# share a DS_SECONDARY_MATCH_COLUMN value.  Every problem found is logged.
+# DS_DUPLICATE_POLICY decides what is synced for an ID found in more than one
+# record: "first" or "last" syncs only that record, "merge" syncs one record
+# made up of the last non-empty value of each column, and "quarantine" syncs
+# none of them.  DS_SECONDARY_MATCH_CONFLICT_POLICY is "report" to sync users
+# sharing a secondary match value as usual, or "quarantine" to sync none of
+# them.  Users left out of the sync are not treated as orphaned.  Records the
+# policies pick between are collected with a second read of the datasource.
+DS_VALIDATE = False
+DS_DUPLICATE_POLICY = "last"
+DS_SECONDARY_MATCH_CONFLICT_POLICY = "report"
+
 # If the data source will be providing the username and/or password, define
 # the column names from the column definition that contain this information here.
 DS_USERNAME_COLUMN_NAME = "USERNAME"
@@ -182,13 +291,114 @@ SYNC_TO_AD = True
 # **** AD-Specific Sync Settings ****
 ###
 # AD Connection settings
+# AD_DC may be a single DC or a list of DCs.  With a list, the page lookups are
+# spread across all of them (set SYNC_PIPELINE_RESOLVE_WORKERS to the number of
+# DCs to use them all at once), while every write, and the AD user cache, stays
+# on the first DC in the list that is available.  A DC that cannot be reached
+# is passed over for AD_DC_RETRY_INTERVAL seconds.
+# Example: AD_DC = ["dc1.colchesterct.org", "dc2.colchesterct.org"]
 AD_DC = "server.colchesterct.org"
+AD_DC_RETRY_INTERVAL = 60
 AD_USERNAME = "syncsvc"
 AD_PASSWORD = "somepassword"
 
 # The base DN to search in AD for users
 AD_BASE_USER_DN = "OU=Users,OU=CPS,DC=colchesterct,DC=org"
 
+# Path to a local cache of AD user information.  The cache remembers where in
+# the DC's change history it was last read up to, so each run only needs to
+# read the AD users that changed since the previous run.  Users missing from
+# the cache are still looked up in AD before a new account is made for them.
+# Set to None to look up every user in AD directly.
+# Example: AD_USER_CACHE_PATH = ".\\adusers.cache"
+AD_USER_CACHE_PATH = None
+
+# How often (in days) the AD user cache should be rebuilt by reading every user,
+# regardless of whether an incremental update is possible.
+AD_USER_CACHE_FULL_REFRESH_DAYS = 7
+
+# A full read of the AD user cache is split into partitions that are read at
+# the same time, AD_USER_PREFETCH_WORKERS at once, each on its own connection
+# to the DC.  Set AD_USER_PREFETCH_WORKERS to 1 to read every user with a
+# single search.  By default there is one partition per OU directly under
+# AD_BASE_USER_DN.  If most users are in one OU, AD_USER_PREFETCH_PARTITIONS
+# can instead be set to a list of LDAP filters that each select part of the
+# users, such as ranges of the link attribute:
+#   ["(employeeID=1*)", "(employeeID=2*)", "(employeeID=3*)"]
+# Users selected by none of the filters are read as a partition of their own.
+AD_USER_PREFETCH_WORKERS = 4
+AD_USER_PREFETCH_PARTITIONS = None
+
+# Instead of looking up the linked AD users for each page of the datasource, a
+# merge join run reads the whole datasource and every linked AD user, each
+# sorted by linkid, and matches them up in a single pass, so memory use does
+# not grow with the number of users.  The datasource and the AD users are each
+# sorted SYNC_MERGE_JOIN_SORT_CHUNK_SIZE records at a time, with sorted chunks
+# written to temporary files in SYNC_MERGE_JOIN_TEMP_DIR (None for the system
+# default).
+# A merge join run does not use the AD user cache and cannot be resumed.
+SYNC_MERGE_JOIN = False
+SYNC_MERGE_JOIN_SORT_CHUNK_SIZE = 100000
+SYNC_MERGE_JOIN_TEMP_DIR = None
+
+# What to do, after each sync, with linked AD accounts whose linkid is no longer
+# in the datasource (orphans): None to leave them alone, "report" to log them,
+# "disable" to disable them, or "move" to disable them and move them to
+# AD_ORPHAN_OU.  As a safeguard against an incomplete datasource file, no
+# account is changed if more than AD_ORPHAN_MAX_COUNT accounts, or more than
+# AD_ORPHAN_MAX_PERCENT percent of the linked accounts, would be.
+AD_ORPHAN_ACTION = None
+AD_ORPHAN_OU = None
+AD_ORPHAN_MAX_COUNT = 100
+AD_ORPHAN_MAX_PERCENT = 5
+
+# Set to a file path to write the changes the sync would make in AD (new
+# accounts, attribute changes, moves and group membership changes) to an LDIF
+# change file at that path instead of making them, for a large batch of
+# changes such as the annual rollover.  Import the file in one go, for example
+# with "ldifde -i -k -h -f <path>" or "ldapmodify -c -f <path>" (the file
+# holds initial passwords, which AD only accepts over an encrypted
+# connection), then run the sync with --ReconcileLdif to check the new and
+# newly linked accounts and send their notifications.  A checksum of each
+# user's changes is written to <path>.sha256 so that a damaged or edited file
+# is reported, and the notifications wait in <path>.pending.  The user cache
+# and checkpoints are not used for an export.
+AD_LDIF_EXPORT_PATH = None
+
+# The maximum number of users looked up in AD with a single search when looking
+# up linked users and secondary matches for a page of the datasource.
+AD_LOOKUP_CHUNK_SIZE = 100
+
+# Adaptive limits on the LDAP operations sent to the DC, so that the sync does
+# not slow down the logons the DC also serves.
+# AD_RATE_LIMIT_OPS_PER_SECOND caps the operations started each second (None
+# for no cap).  AD_RATE_LIMIT_MAX_CONCURRENCY caps the operations outstanding at
+# once across all of the sync's connections; the limiter lowers this while the
+# average write takes longer than AD_RATE_LIMIT_TARGET_LATENCY seconds and
+# raises it again as the DC recovers.  When the DC reports that it is busy, all
+# operations are paused for a time that doubles while it stays busy, up to
+# AD_RATE_LIMIT_MAX_BACKOFF seconds.
+# The limiter is off while AD_RATE_LIMIT_MAX_CONCURRENCY is None.  To turn it
+# on, set for example:
+# AD_RATE_LIMIT_OPS_PER_SECOND = 200
+# AD_RATE_LIMIT_MAX_CONCURRENCY = 8
+AD_RATE_LIMIT_OPS_PER_SECOND = None
+AD_RATE_LIMIT_MAX_CONCURRENCY = None
+AD_RATE_LIMIT_TARGET_LATENCY = 0.25
+AD_RATE_LIMIT_MAX_BACKOFF = 60
+
+# LDAP operations that fail with one of the following errors (names of
+# python-ldap exceptions) are tried again, up to AD_RETRY_MAX_ATTEMPTS times in
+# all, after a random wait of up to AD_RETRY_BASE_DELAY seconds that doubles
+# with each retry (to at most AD_RETRY_MAX_DELAY seconds).  The connection to
+# the DC is re-opened first after SERVER_DOWN, TIMEOUT or CONNECT_ERROR.  Any
+# other error (a constraint violation, for example) is not retried.
+AD_RETRY_ERRORS = ("SERVER_DOWN", "BUSY", "UNAVAILABLE", "TIMEOUT",
+                   "TIMELIMIT_EXCEEDED")
+AD_RETRY_MAX_ATTEMPTS = 4
+AD_RETRY_BASE_DELAY = 0.5
+AD_RETRY_MAX_DELAY = 30
+
 # The DN of the default OU for users who do not match any OU assignment rules
 AD_DEFAULT_USER_OU = "OU=Unassigned,OU=Users,OU=CPS,DC=colchesterct,DC=org"
 
@@ -238,6 +448,21 @@ AD_ATTRIBUTE_MAP = (
     AttributeMapping("COPIERPIN", "pager", SYNCHRONIZED)
 )
 
+# AD Attribute syntaxes: How values of mapped attributes are compared when
+# deciding whether an attribute needs to be updated.  By default attributes are
+# treated as single-valued strings where case and surrounding whitespace do not
+# matter (as AD compares them), and a few well known attributes such as
+# userAccountControl, pwdLastSet and proxyAddresses are handled as integers or
+# sets of values.  Add entries here for any mapped attribute that differs,
+# naming its syntax: "caseIgnoreString", "caseExactString", "integer" or "dn".
+# For a multi-valued attribute, give a tuple of the syntax and the delimiter
+# separating its values in the single datasource column they are taken from.
+# Example:
+#   "extensionAttribute1": "caseExactString",
+#   "otherMailbox": ("caseIgnoreString", ";"),
+AD_ATTRIBUTE_SYNTAXES = {
+}
+
 # AD OU Assignments: A list of rules and matching OUs (by distinguished name)
 # If a user matches multiple rules, they will be assigned to the first matching
 # OU.  If a user does not match any of the assignment rules, they will be
@@ -0,0 +1,106 @@
+"""
+Description: Helpers for matching up two large streams of records in a single
+pass without holding either of them in memory: an external merge sort, which
+sorts a chunk of records at a time and spills each sorted chunk to a
+temporary file before merging them, and a merge join of two streams sorted
+on the same key.
+"""
+
+import heapq
+import itertools
+import pickle
+import tempfile
+
+
+def externalSort(items, key, chunkSize: int = 100000, tempDir: str = None):
+    """
+    Yields the provided items sorted by the provided key function.  At most
+    chunkSize items are held in memory while sorting; beyond that, sorted
+    chunks are written to temporary files (in tempDir, or the system default
+    if None) and merged back together as they are read.  Items must be
+    picklable.
+    """
+    runs = []
+    try:
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunkSize:
+                chunk.sort(key=key)
+                runs.append(_writeRun(chunk, tempDir))
+                chunk = []
+        chunk.sort(key=key)
+        if not runs:
+            yield from chunk
+            return
+        if chunk:
+            runs.append(_writeRun(chunk, tempDir))
+        chunk = None
+        yield from heapq.merge(*[_readRun(run) for run in runs], key=key)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _writeRun(chunk: list, tempDir: str):
+    """
+    Writes a sorted chunk of items to a temporary file and returns the file,
+    positioned at the start.  The file is deleted when closed.
+    """
+    run = tempfile.TemporaryFile(dir=tempDir)
+    for item in chunk:
+        pickle.dump(item, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _readRun(run):
+    """
+    Yields the items written to a temporary file by _writeRun.
+    """
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+def mergeJoin(left, right, leftKey, rightKey):
+    """
+    Matches up two streams of items that are both sorted by key, reading
+    each of them once.  Yields a tuple of (key, [left items], [right items])
+    for each distinct key found in either stream, in key order.  One of the
+    two lists is empty where the key is only in one stream.
+
+    Raises ValueError if either stream turns out not to be sorted.
+    """
+    lefts = _keyGroups(left, leftKey, "left")
+    rights = _keyGroups(right, rightKey, "right")
+    lgroup = next(lefts, None)
+    rgroup = next(rights, None)
+    while lgroup is not None or rgroup is not None:
+        if rgroup is None or (lgroup is not None and lgroup[0] < rgroup[0]):
+            yield (lgroup[0], lgroup[1], [])
+            lgroup = next(lefts, None)
+        elif lgroup is None or rgroup[0] < lgroup[0]:
+            yield (rgroup[0], [], rgroup[1])
+            rgroup = next(rights, None)
+        else:
+            yield (lgroup[0], lgroup[1], rgroup[1])
+            lgroup = next(lefts, None)
+            rgroup = next(rights, None)
+
+
+def _keyGroups(items, key, name: str):
+    """
+    Yields (key, [items]) for each run of items with the same key, checking
+    that the keys are in ascending order.
+    """
+    previous = None
+    for k, group in itertools.groupby(items, key):
+        if previous is not None and not previous[0] < k:
+            raise ValueError("The " + name + " stream of a merge join is not "
+                             "sorted: " + repr(k) + " follows "
+                             + repr(previous[0]))
+        previous = (k,)
+        yield (k, list(group))
@@ -0,0 +1,124 @@
+"""
+Description: Journal of sync progress that is written after each fully
+processed page of the data source.  If a sync run is interrupted, the next
+run can pick the journal back up and resume at the page following the last
+one completed instead of starting again from the first record.
+"""
+
+import json
+import os
+
+
+class SyncCheckpoint():
+
+    def __init__(self, path: str, fingerprint: str):
+        """
+        path: the location of the checkpoint journal file.
+
+        fingerprint: a value identifying the data source being synced (such as
+        CSVPager.fingerprint).  A saved checkpoint is only used if it was
+        written for a data source with the same fingerprint.
+        """
+        self._path = path
+        self._fingerprint = fingerprint
+        self._pageIndex = 0
+        self._notifications = {}
+        self._failedUsers = 0
+
+    @property
+    def pageIndex(self) -> int:
+        """
+        Returns the index of the first datasource record that has not yet
+        been processed.
+        """
+        return self._pageIndex
+
+    @property
+    def failedUsers(self) -> int:
+        """
+        Returns the number of users who could not be fully synced before
+        pageIndex.
+        """
+        return self._failedUsers
+
+    def notifications(self, name: str) -> dict:
+        """
+        Returns the pending notifications saved under the provided name as a
+        dictionary of the form { (contacts): [ account info rows ] }
+        """
+        return self._notifications.get(name, {})
+
+    def load(self) -> bool:
+        """
+        Reads the checkpoint journal.  Returns true if a checkpoint exists for
+        this data source, otherwise false (and the checkpoint is left at the
+        beginning of the data source).
+        """
+        try:
+            with open(self._path, 'r') as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if journal.get("fingerprint") != self._fingerprint:
+            return False
+
+        self._pageIndex = journal["pageIndex"]
+        self._failedUsers = journal.get("failedUsers", 0)
+        self._notifications = {}
+        for name, entries in journal["notifications"].items():
+            self._notifications[name] = {tuple(contacts): rows
+                                         for contacts, rows in entries}
+        return True
+
+    def save(self, pageIndex: int, notifications: dict,
+             failedUsers: int = 0):
+        """
+        Records that every datasource record before pageIndex has been
+        processed.
+
+        notifications: a dictionary of { name: pending notifications } where
+        the pending notifications are of the form
+        { (contacts): [ account info rows ] }
+
+        failedUsers: the number of users who could not be fully synced so
+        far, so a resumed run knows whether every user has been synced.
+
+        The journal is written to a temporary file and then moved into place
+        so an interruption while saving cannot leave a partial checkpoint.
+        Pending notifications may hold initial passwords, so the journal is
+        only readable by its owner.
+        """
+        self._pageIndex = pageIndex
+        self._notifications = notifications
+        self._failedUsers = failedUsers
+        journal = {
+            "fingerprint": self._fingerprint,
+            "pageIndex": pageIndex,
+            "failedUsers": failedUsers,
+            "notifications": {name: [[list(contacts), rows]
+                                     for contacts, rows in pending.items()]
+                              for name, pending in notifications.items()}
+        }
+        # A temporary file left behind by an interrupted save keeps the
+        # permissions it was made with, so it is removed and made afresh.
+        tmppath = self._path + ".tmp"
+        try:
+            os.remove(tmppath)
+        except FileNotFoundError:
+            pass
+        fd = os.open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with open(fd, 'w') as f:
+            json.dump(journal, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmppath, self._path)
+
+    def clear(self):
+        """
+        Removes the checkpoint journal once a sync run has completed.
+        """
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
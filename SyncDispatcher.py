@@ -0,0 +1,140 @@
+"""
+Description: Syncs several target systems from a single read of the
+datasource.  The datasource is read and parsed once, and each page is handed
+to every target.  Each target runs on its own thread, fed through its own
+bounded queue, so a run takes about as long as its slowest target rather
+than the sum of all of them.  A target that fails is logged and dropped
+without stopping the others.
+"""
+
+import logging
+import queue
+import threading
+
+from AccountSyncer import AccountSyncer, openDatasource, readPages, \
+    finishDatasource, validateDatasource
+
+
+class DatasourceReadError(Exception):
+    """
+    Raised to the targets of a SyncDispatcher when the datasource could not
+    be read to the end, so that they do not finish as if it had been.
+    """
+    pass
+
+
+class _TargetFeed():
+    """
+    The queue of pages waiting to be synced by one target.
+    """
+    # Seconds between checks of whether the target has stopped reading.
+    POLL_INTERVAL = 0.5
+    _END = object()
+
+    def __init__(self, syncer: AccountSyncer, queueSize: int):
+        self.syncer = syncer
+        self.error = None
+        self.synced = False
+        self.finished = threading.Event()
+        self._queue = queue.Queue(queueSize)
+
+    def put(self, item):
+        """
+        Queues an item for the target, waiting for room in the queue unless
+        the target has stopped reading.
+        """
+        while not self.finished.is_set():
+            try:
+                self._queue.put(item, timeout=self.POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def pages(self):
+        """
+        Yields the items queued for the target until the end of the
+        datasource.  Raises DatasourceReadError if reading it failed.
+        """
+        while True:
+            item = self._queue.get()
+            if item is self._END:
+                return
+            if isinstance(item, Exception):
+                raise DatasourceReadError(str(item))
+            yield item
+
+
+class SyncDispatcher():
+
+    def __init__(self, logger: logging.Logger, args, syncers,
+                 queueSize: int = 2):
+        """
+        logger: the logger to report failed targets to.
+
+        args: the parsed command line arguments.
+
+        syncers: the AccountSyncers to sync from the datasource.
+
+        queueSize: the most pages read ahead of each target.
+        """
+        self._logger = logger
+        self._args = args
+        self._syncers = tuple(syncers)
+        self._queueSize = queueSize
+
+    def run(self) -> dict:
+        """
+        Reads the datasource and syncs every target with it.  Returns a
+        dictionary of { target name: the exception it failed with, or None
+        if it succeeded }.
+        """
+        pager = openDatasource(self._args)
+        try:
+            validator = validateDatasource(self._logger, pager)
+            # Reading starts with the first record any target still needs.
+            start = min(syncer.resumeIndex(pager) for syncer in self._syncers)
+        except Exception:
+            pager.close()
+            raise
+        feeds = [_TargetFeed(syncer, self._queueSize) for syncer in self._syncers]
+        threads = [threading.Thread(target=self._runTarget, args=(pager, feed),
+                                    name="sync-" + feed.syncer.name, daemon=True)
+                   for feed in feeds]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in readPages(pager, start, validator):
+                if all(feed.finished.is_set() for feed in feeds):
+                    break
+                for feed in feeds:
+                    # Each target gets its own work item to add to.
+                    feed.put(dict(item, users=[dict(user) for user in item["users"]]))
+            end = _TargetFeed._END
+        except Exception as e:
+            self._logger.error("An error occurred while reading the datasource. "
+                               "Error details: " + str(e))
+            end = e
+        for feed in feeds:
+            feed.put(end)
+        for thread in threads:
+            thread.join()
+        errors = {feed.syncer.name: feed.error for feed in feeds}
+        if end is _TargetFeed._END and all(feed.synced for feed in feeds):
+            finishDatasource(pager, validator)
+        pager.close()
+        return errors
+
+    def _runTarget(self, pager, feed: _TargetFeed):
+        """
+        Syncs one target from its feed, recording and logging the error if
+        it fails.
+        """
+        try:
+            feed.synced = feed.syncer.syncDatasource(pager, feed.pages())
+        except Exception as e:
+            feed.error = e
+            self._logger.error("The sync to " + feed.syncer.name + " failed. "
+                               "Error details: " + str(e))
+        finally:
+            feed.finished.set()
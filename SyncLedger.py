@@ -0,0 +1,175 @@
+"""
+Description: Shared ledger used to coordinate sync runs on more than one
+host (or more than one thread) against the same directory.  The ledger is a
+SQLite database on a path every sync host can reach.  It records the
+usernames that have been handed out to new users, so two hosts creating users
+at the same time cannot both pick the same one, and collects the pending
+notifications from each shard of a sharded run so they can be sent out
+together once the last shard finishes.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+
+# Reservations and spooled notifications older than this are removed.  A
+# reserved username only needs protecting until the account that uses it has
+# been created in AD.
+LEDGER_RETENTION_DAYS = 7
+
+
+def shardOf(key: str, shardCount: int) -> int:
+    """
+    Returns the shard (1 to shardCount) that the provided datasource key
+    belongs to.  The shard is computed from a stable hash of the key, so
+    every host agrees on it from run to run.  Keys are hashed lower-cased,
+    as linkids are matched case-insensitively, so an AD user lands in the
+    same shard as its datasource record whatever the case of either linkid.
+    """
+    return zlib.crc32(key.lower().encode("utf-8")) % shardCount + 1
+
+
+class _LedgerTransaction():
+    """
+    Wraps a ledger connection so that a 'with' block runs as a single
+    transaction that holds the write lock on the database throughout (so a
+    read followed by a write cannot interleave with another host), and closes
+    the connection afterwards.
+    """
+
+    def __init__(self, db: sqlite3.Connection):
+        self._db = db
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._db.execute("BEGIN IMMEDIATE")
+        return self._db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._db.execute("COMMIT")
+            else:
+                self._db.execute("ROLLBACK")
+        finally:
+            self._db.close()
+
+
+class SyncLedger():
+
+    def __init__(self, path: str, timeout: float = 60):
+        """
+        path: the location of the ledger database.  For a sharded run this
+        must be on storage shared by all of the sync hosts.  Spooled
+        notifications may hold initial passwords, so the ledger (and the
+        share it is on) should only be accessible to the accounts the sync
+        runs as.
+
+        timeout: the number of seconds to wait for another host to release
+        the ledger before giving up.
+        """
+        self._path = path
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS usernames ("
+                       "username TEXT PRIMARY KEY COLLATE NOCASE, "
+                       "linkid TEXT NOT NULL, "
+                       "reserved REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS notifications ("
+                       "run TEXT NOT NULL, "
+                       "shard INTEGER NOT NULL, "
+                       "name TEXT NOT NULL, "
+                       "contacts TEXT NOT NULL, "
+                       "info TEXT NOT NULL, "
+                       "spooled REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS shards ("
+                       "run TEXT NOT NULL, "
+                       "shard INTEGER NOT NULL, "
+                       "finished REAL NOT NULL, "
+                       "PRIMARY KEY (run, shard))")
+            expired = time.time() - LEDGER_RETENTION_DAYS * 86400
+            db.execute("DELETE FROM usernames WHERE reserved < ?", (expired,))
+            db.execute("DELETE FROM notifications WHERE spooled < ?", (expired,))
+            db.execute("DELETE FROM shards WHERE finished < ?", (expired,))
+
+    def _connect(self) -> _LedgerTransaction:
+        """
+        Opens a connection to the ledger.  Changes made in a 'with' block on
+        the connection are committed together when the block exits.
+        """
+        db = sqlite3.connect(self._path, timeout=self._timeout,
+                             isolation_level=None)
+        return _LedgerTransaction(db)
+
+    def reserveUserName(self, username: str, linkid: str) -> bool:
+        """
+        Reserves the provided username for the user with the provided linkid.
+        Returns true if the username is now reserved for this user (including
+        if it already was), or false if it is reserved for someone else.
+        Usernames are compared case-insensitively, as AD compares them.
+        """
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT linkid FROM usernames WHERE username = ?",
+                             (username,)).fetchone()
+            if row is not None:
+                return row[0] == linkid
+            db.execute("INSERT INTO usernames (username, linkid, reserved) "
+                       "VALUES (?, ?, ?)", (username, linkid, time.time()))
+            return True
+
+    def spoolNotifications(self, run: str, shard: int, shardCount: int,
+                           notifications: dict) -> dict:
+        """
+        Records the pending notifications of one shard of a sharded run and
+        marks that shard as finished.
+
+        run: a value identifying the run that all of the shards share, and
+        no other run does (see the --RunId argument).  Shards left behind by
+        an earlier run that did not finish are then never counted towards
+        this one.
+
+        notifications: a dictionary of { name: pending notifications } where
+        the pending notifications are of the form
+        { (contacts): [ account info rows ] }
+
+        The notifications, including any initial passwords in them, are
+        stored in the ledger in plain text until the last shard sends them,
+        so access to the ledger file must be restricted accordingly.
+
+        If this was the last of the shards to finish, the notifications from
+        every shard are removed from the ledger and returned merged together,
+        in the same form.  Otherwise None is returned and the notifications
+        are left for the last shard to send.
+        """
+        with self._lock, self._connect() as db:
+            now = time.time()
+            db.execute("DELETE FROM notifications WHERE run = ? AND shard = ?",
+                       (run, shard))
+            for name, pending in notifications.items():
+                for contacts, rows in pending.items():
+                    for info in rows:
+                        db.execute("INSERT INTO notifications (run, shard, name, "
+                                   "contacts, info, spooled) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)",
+                                   (run, shard, name, json.dumps(list(contacts)),
+                                    json.dumps(info), now))
+            db.execute("INSERT OR REPLACE INTO shards (run, shard, finished) "
+                       "VALUES (?, ?, ?)", (run, shard, now))
+            finished = db.execute("SELECT COUNT(*) FROM shards WHERE run = ?",
+                                  (run,)).fetchone()[0]
+            if finished < shardCount:
+                return None
+
+            merged = {name: {} for name in notifications.keys()}
+            for name, contacts, info in db.execute(
+                    "SELECT name, contacts, info FROM notifications "
+                    "WHERE run = ? ORDER BY shard, rowid", (run,)):
+                pending = merged.setdefault(name, {})
+                pending.setdefault(tuple(json.loads(contacts)), []).append(
+                    json.loads(info))
+            db.execute("DELETE FROM notifications WHERE run = ?", (run,))
+            db.execute("DELETE FROM shards WHERE run = ?", (run,))
+            return merged
@@ -0,0 +1,316 @@
+"""
+Description: Runs a sync as a series of stages joined by bounded queues.
+Each stage runs on its own thread (or several, for stages whose work can be
+done in parallel) so that, for example, parsing the data source and
+evaluating rules for one page of users overlaps with the LDAP traffic for
+the page before it.  Because the queues are bounded, a fast stage waits on
+a slow one rather than reading ahead without limit, keeping memory use flat.
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+
+class PipelineStageStats():
+    """
+    Throughput counters for a single pipeline stage.
+    """
+
+    def __init__(self, name: str, workers: int):
+        self._name = name
+        self._workers = workers
+        self._items = 0
+        self._busyTime = 0.0
+        self._inputWaitTime = 0.0
+        self._outputWaitTime = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        """
+        Returns the name of the stage.
+        """
+        return self._name
+
+    @property
+    def workers(self) -> int:
+        """
+        Returns the number of threads the stage runs on.
+        """
+        return self._workers
+
+    @property
+    def items(self) -> int:
+        """
+        Returns the number of items the stage has processed.
+        """
+        return self._items
+
+    @property
+    def busyTime(self) -> float:
+        """
+        Returns the total time, in seconds, the stage's threads spent
+        processing items.
+        """
+        return self._busyTime
+
+    @property
+    def inputWaitTime(self) -> float:
+        """
+        Returns the total time, in seconds, the stage's threads spent waiting
+        for the previous stage to supply an item.
+        """
+        return self._inputWaitTime
+
+    @property
+    def outputWaitTime(self) -> float:
+        """
+        Returns the total time, in seconds, the stage's threads spent waiting
+        for room in the queue to the next stage.
+        """
+        return self._outputWaitTime
+
+    @property
+    def throughput(self) -> float:
+        """
+        Returns the number of items per second the stage can process while
+        busy, across all of its threads.  The stage with the lowest
+        throughput is the one limiting the pipeline.
+        """
+        if self._busyTime == 0:
+            return 0.0
+        return self._items * self._workers / self._busyTime
+
+    def record(self, busyTime: float, inputWaitTime: float,
+               outputWaitTime: float):
+        """
+        Adds the timings for one processed item.
+        """
+        with self._lock:
+            self._items += 1
+            self._busyTime += busyTime
+            self._inputWaitTime += inputWaitTime
+            self._outputWaitTime += outputWaitTime
+
+    def __str__(self) -> str:
+        return (self._name + ": " + str(self._items) + " items, "
+                + "%.1fs busy, %.1fs waiting for input, "
+                  "%.1fs waiting for output, %.2f items/s"
+                % (self._busyTime, self._inputWaitTime,
+                   self._outputWaitTime, self.throughput))
+
+
+class SyncPipeline():
+    # Seconds between checks for a failed stage while blocked on a queue.
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, source, sourceName: str = "source",
+                 queueSize: int = 2):
+        """
+        source: an iterable supplying the items to be processed.  It is
+        iterated on its own thread and counted as the first stage.  If the
+        pipeline stops before the source is used up, a source with a close
+        method (such as a generator) is closed on that same thread.
+
+        sourceName: the name reported in the statistics for the source stage.
+
+        queueSize: the maximum number of items waiting between any two
+        stages.
+        """
+        self._source = source
+        self._queueSize = queueSize
+        self._stages = []
+        self._stats = [PipelineStageStats(sourceName, 1)]
+        self._failed = threading.Event()
+        self._error = None
+        self._errorLock = threading.Lock()
+
+    def addStage(self, name: str, func, workers: int = 1,
+                 ordered: bool = False):
+        """
+        Adds a stage to the end of the pipeline.
+
+        func: called with each item from the previous stage.  Its return value
+        is passed on to the next stage.  An exception raised by func stops the
+        whole pipeline, so errors that only affect the item itself should be
+        handled within func.
+
+        workers: the number of threads the stage runs on.  Items may leave a
+        stage with more than one worker in a different order than they
+        arrived.
+
+        ordered: if true, items are handed to func in the order the source
+        supplied them, whatever order earlier stages finished them in.  An
+        ordered stage always runs on a single thread.
+        """
+        if ordered:
+            workers = 1
+        self._stages.append((func, max(1, workers), ordered))
+        self._stats.append(PipelineStageStats(name, max(1, workers)))
+
+    @property
+    def stats(self) -> list:
+        """
+        Returns a PipelineStageStats for each stage, starting with the
+        source.
+        """
+        return list(self._stats)
+
+    def run(self):
+        """
+        Runs every item from the source through all of the stages and waits
+        for the pipeline to drain.  If any stage raises an exception, the
+        pipeline is stopped and the exception is raised here.
+        """
+        queues = [queue.Queue(self._queueSize) for stage in self._stages]
+        threads = [threading.Thread(target=self._runSource,
+                                    args=(queues[0] if queues else None,),
+                                    daemon=True)]
+        remaining = []
+        for i, (func, workers, ordered) in enumerate(self._stages):
+            outqueue = queues[i + 1] if i + 1 < len(queues) else None
+            # The last worker of a stage to finish passes the end of input on.
+            remaining.append([workers, threading.Lock()])
+            for w in range(workers):
+                threads.append(threading.Thread(target=self._runStage,
+                                                args=(func, ordered,
+                                                      self._stats[i + 1],
+                                                      queues[i], outqueue,
+                                                      remaining[i]),
+                                                daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _runSource(self, outqueue: queue.Queue):
+        """
+        Thread body for the source stage.
+        """
+        stats = self._stats[0]
+        items = None
+        try:
+            items = iter(self._source)
+            for seq in itertools.count():
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                busy = time.perf_counter() - start
+                waited = self._put(outqueue, (seq, item))
+                stats.record(busy, 0.0, waited)
+                if self._failed.is_set():
+                    self._closeSource(items)
+                    return
+        except Exception as e:
+            self._fail(e)
+            self._closeSource(items)
+            return
+        self._put(outqueue, None)
+
+    def _closeSource(self, items):
+        """
+        Closes the source's iterator, if it can be closed, when the pipeline
+        stops early.
+        """
+        close = getattr(items, "close", None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            self._fail(e)
+
+    def _runStage(self, func, ordered: bool, stats: PipelineStageStats,
+                  inqueue: queue.Queue, outqueue: queue.Queue,
+                  remaining: list):
+        """
+        Thread body for a worker of a stage.
+        """
+        pending = []
+        nextseq = 0
+        done = False
+        try:
+            while not done:
+                start = time.perf_counter()
+                entry = self._get(inqueue)
+                inwait = time.perf_counter() - start
+                if self._failed.is_set():
+                    return
+                if entry is None:
+                    # End of input.  Let any other workers of this stage
+                    # see it too.
+                    self._put(inqueue, None)
+                    if not ordered:
+                        break
+                    done = True
+                else:
+                    if not ordered:
+                        pending = [entry]
+                    else:
+                        heapq.heappush(pending, entry)
+                # Hand over every item whose turn has come.
+                while pending and (not ordered or pending[0][0] == nextseq
+                                   or done):
+                    seq, item = heapq.heappop(pending) if ordered else pending.pop()
+                    nextseq = seq + 1
+                    start = time.perf_counter()
+                    item = func(item)
+                    busy = time.perf_counter() - start
+                    waited = self._put(outqueue, (seq, item))
+                    stats.record(busy, inwait, waited)
+                    inwait = 0.0
+                if self._failed.is_set():
+                    return
+        except Exception as e:
+            self._fail(e)
+            return
+        with remaining[1]:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            self._put(outqueue, None)
+
+    def _get(self, inqueue: queue.Queue):
+        """
+        Waits for the next entry on a queue.  Gives up with None if the
+        pipeline has failed.
+        """
+        while True:
+            try:
+                return inqueue.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                if self._failed.is_set():
+                    return None
+
+    def _put(self, outqueue: queue.Queue, entry) -> float:
+        """
+        Waits for room on a queue and adds the entry.  Nothing is done for
+        the last stage, which has no queue after it.  Returns the time spent
+        waiting.
+        """
+        if outqueue is None:
+            return 0.0
+        start = time.perf_counter()
+        while not self._failed.is_set():
+            try:
+                outqueue.put(entry, timeout=self.POLL_INTERVAL)
+                break
+            except queue.Full:
+                pass
+        return time.perf_counter() - start
+
+    def _fail(self, error: Exception):
+        """
+        Records the first error raised by a stage and stops the pipeline.
+        """
+        with self._errorLock:
+            if self._error is None:
+                self._error = error
+        self._failed.set()
@@ -4,10 +4,30 @@ import logging
 import logging.handlers
 from BufferingSMTPHandler import BufferingSMTPHandler
 from AccountManager_Module_AD.ADSyncer import ADSyncer
+from SyncDispatcher import SyncDispatcher
+import Settings
 from Settings import LOGGING_LEVEL, LOGGING_PATH, SMTP_SERVER_IP, \
                      SMTP_SERVER_PORT, SMTP_SERVER_USERNAME, SMTP_FROM_ADDRESS, \
                      SMTP_SERVER_PASSWORD, LOGGING_ALERTS_CONTACT, SYNC_TO_AD
 
+
+# Added after the first release, so read with a default for an older Settings.py.
+SYNC_PIPELINE_QUEUE_SIZE = getattr(Settings, "SYNC_PIPELINE_QUEUE_SIZE", 2)
+
+
+def shardArgument(value: str) -> tuple:
+    """
+    Parses a --Shard argument of the form K/N into a tuple of (K, N).
+    """
+    try:
+        shardnum, shardcount = [int(part) for part in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected K/N, for example 1/4")
+    if shardcount < 1 or not 1 <= shardnum <= shardcount:
+        raise argparse.ArgumentTypeError("K must be between 1 and N")
+    return (shardnum, shardcount)
+
+
 ###
 # Init script
 ###
@@ -19,17 +39,57 @@ if __name__ == '__main__':
 
     parser.add_argument(
         '--DatasourcePath',
-        help='Path to the data source file for user accounts.',
-        required=True
+        help='Path to the data source file for user accounts, which may be '
+        'compressed with gzip, bz2, xz or zstd.  Several files may be given '
+        'to merge them by ID (see DS_FILE_COLUMN_DEFINITIONS).  Not used '
+        'with a SQL datasource.',
+        nargs='+'
         )
     parser.add_argument(
         '--DatasourceFileType',
-        help='\'CSV\', or \'TSV\'',
+        help='\'CSV\', \'TSV\', or \'SQL\' to read the users with '
+        'DS_SQL_QUERY instead of from a file',
         required=True,
-        choices=['CSV', 'TSV']
+        choices=['CSV', 'TSV', 'SQL']
+    )
+    parser.add_argument(
+        '--Resume', '--resume',
+        help='Resume an interrupted sync from the last saved checkpoint.',
+        dest='Resume',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--Shard', '--shard',
+        help='Sync only shard K of N (for example 1/4), to spread a sync run '
+        'across several hosts.  Requires SYNC_LEDGER_PATH.',
+        dest='Shard',
+        type=shardArgument,
+        default=None
+    )
+    parser.add_argument(
+        '--RunId', '--runid',
+        help='A value that identifies this sync run, shared by every shard of '
+        'it and different for each run, for example the date and time the '
+        'run was scheduled.  Required with --Shard.  Give the same value when '
+        'resuming a shard with --Resume.',
+        dest='RunId',
+        default=None
+    )
+
+    parser.add_argument(
+        '--ReconcileLdif', '--reconcileldif',
+        help='After the LDIF export written to AD_LDIF_EXPORT_PATH has been '
+        'imported, check the accounts it created or linked and send their '
+        'notifications, instead of syncing.',
+        dest='ReconcileLdif',
+        action='store_true'
     )
 
     args = parser.parse_args()
+    if args.DatasourceFileType != 'SQL' and not args.DatasourcePath:
+        parser.error("--DatasourcePath is required for a CSV or TSV datasource")
+    if args.Shard is not None and not args.RunId:
+        parser.error("--RunId is required with --Shard")
 
     logger = logging.getLogger("accounts")
     fileformatter = logging.Formatter(
@@ -66,9 +126,16 @@ if __name__ == '__main__':
 
     logger.info("Logging initialized")
 
-    if (SYNC_TO_AD):
-        adsyncer = ADSyncer(logger, args)
-        adsyncer.runSyncProcess()
+    # Every target is synced from a single read of the datasource.
+    syncers = []
+    if args.ReconcileLdif:
+        ADSyncer(logger, args).reconcileExport()
+    elif (SYNC_TO_AD):
+        syncers.append(ADSyncer(logger, args))
+    if len(syncers) == 1:
+        syncers[0].runSyncProcess()
+    elif syncers:
+        SyncDispatcher(logger, args, syncers, SYNC_PIPELINE_QUEUE_SIZE).run()
 
     logger.info("Finished running sync scripts.")
     emailhandler.flush() # Ensure logging email gets sent...
@@ -0,0 +1,86 @@
+"""
+Tests for comparing datasource and AD values with ADAttributeSyntax.
+"""
+
+import unittest
+
+try:
+    from AccountManager_Module_AD.ADAttributeSyntax import ADAttributeSyntax, \
+        getAttributeSyntax, parseAttributeSyntaxes, SYNTAX_CASE_EXACT_STRING, \
+        SYNTAX_INTEGER, SYNTAX_DN
+except ImportError:  # python-ldap is not installed
+    ADAttributeSyntax = None
+
+
+@unittest.skipIf(ADAttributeSyntax is None, "python-ldap is not installed")
+class ADAttributeSyntaxTest(unittest.TestCase):
+
+    def testCaseIgnoreString(self):
+        syntax = ADAttributeSyntax()
+        self.assertTrue(syntax.equal(["Smith Jones "], [" smith jones"]))
+        self.assertFalse(syntax.equal(["Smith"], ["Smyth"]))
+
+    def testInternalWhitespaceKept(self):
+        syntax = ADAttributeSyntax()
+        self.assertFalse(syntax.equal(["Smith  Jones"], ["Smith Jones"]))
+        self.assertFalse(syntax.equal(["Smith\tJones"], ["Smith Jones"]))
+
+    def testCaseExactString(self):
+        syntax = ADAttributeSyntax(SYNTAX_CASE_EXACT_STRING)
+        self.assertTrue(syntax.equal(["Smith"], ["Smith "]))
+        self.assertFalse(syntax.equal(["Smith"], ["smith"]))
+
+    def testInteger(self):
+        syntax = ADAttributeSyntax(SYNTAX_INTEGER)
+        self.assertTrue(syntax.equal(["0512"], ["512"]))
+        self.assertFalse(syntax.equal(["512"], ["514"]))
+        self.assertFalse(syntax.equal(["n/a"], ["N/A"]))
+
+    def testDN(self):
+        syntax = ADAttributeSyntax(SYNTAX_DN)
+        self.assertTrue(syntax.equal(["CN=Jane Doe, OU=Staff,DC=example,DC=org"],
+                                     ["cn=jane doe,ou=staff,dc=example,dc=org"]))
+        self.assertFalse(syntax.equal(["CN=Jane Doe,OU=Staff,DC=example,DC=org"],
+                                      ["CN=Jane Doe,OU=Students,DC=example,DC=org"]))
+
+    def testEmptyValues(self):
+        syntax = ADAttributeSyntax()
+        self.assertTrue(syntax.equal([], None))
+        self.assertFalse(syntax.equal(["x"], None))
+        self.assertEqual(syntax.datasourceValues("  "), [])
+        self.assertEqual(syntax.datasourceValues(None), [])
+
+    def testSingleValuedUsesFirstValue(self):
+        syntax = ADAttributeSyntax()
+        self.assertEqual(syntax.datasourceValues(" a;b "), ["a;b"])
+        self.assertTrue(syntax.equal(["a"], ["a", "b"]))
+
+    def testMultiValuedIgnoresOrder(self):
+        syntax = ADAttributeSyntax(multiValued=True)
+        values = syntax.datasourceValues("SMTP:a@example.org; smtp:b@example.org;;")
+        self.assertEqual(values, ["SMTP:a@example.org", "smtp:b@example.org"])
+        self.assertTrue(syntax.equal(values, ["smtp:B@example.org", "smtp:a@example.org"]))
+        self.assertFalse(syntax.equal(values, ["smtp:a@example.org"]))
+
+    def testGetAttributeSyntax(self):
+        self.assertEqual(getAttributeSyntax("userAccountControl").syntax, SYNTAX_INTEGER)
+        self.assertTrue(getAttributeSyntax("proxyAddresses").multiValued)
+        self.assertEqual(getAttributeSyntax("givenName").syntax,
+                         ADAttributeSyntax().syntax)
+        override = ADAttributeSyntax(SYNTAX_CASE_EXACT_STRING)
+        self.assertIs(getAttributeSyntax("givenname", {"givenName": override}), override)
+
+    def testParseAttributeSyntaxes(self):
+        override = ADAttributeSyntax(SYNTAX_INTEGER)
+        syntaxes = parseAttributeSyntaxes({"extensionAttribute1": "caseExactString",
+                                           "otherMailbox": ("caseIgnoreString", ";"),
+                                           "employeeNumber": override})
+        self.assertEqual(syntaxes["extensionAttribute1"].syntax, SYNTAX_CASE_EXACT_STRING)
+        self.assertTrue(syntaxes["otherMailbox"].multiValued)
+        self.assertIs(syntaxes["employeeNumber"], override)
+        with self.assertRaises(ValueError):
+            parseAttributeSyntaxes({"title": "caseIgnore"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Tests for the canonical form of DNs given by canonicalDN.
+"""
+
+import unittest
+
+try:
+    from AccountManager_Module_AD.ADDistinguishedName import canonicalDN, sameDN
+except ImportError:  # python-ldap is not installed
+    canonicalDN = None
+
+
+@unittest.skipIf(canonicalDN is None, "python-ldap is not installed")
+class ADDistinguishedNameTest(unittest.TestCase):
+
+    def testCaseIgnored(self):
+        self.assertIs(canonicalDN("CN=Ann Lee,OU=Staff,DC=example,DC=org"),
+                      canonicalDN("cn=ann lee,ou=STAFF,dc=Example,dc=org"))
+
+    def testWhitespaceAroundValuesIgnored(self):
+        self.assertTrue(sameDN("CN=Ann Lee,OU=Staff,DC=example,DC=org",
+                               "CN=Ann Lee, OU=Staff,  DC=example,DC=org"))
+        self.assertFalse(sameDN("CN=Ann Lee,OU=Staff,DC=example,DC=org",
+                                "CN=AnnLee,OU=Staff,DC=example,DC=org"))
+
+    def testEscapingIgnored(self):
+        self.assertTrue(sameDN("CN=Lee\\, Ann,OU=Staff,DC=example,DC=org",
+                               "CN=Lee\\2C Ann,OU=Staff,DC=example,DC=org"))
+        self.assertEqual(canonicalDN("CN=Lee\\2C Ann,DC=org").rdn, "CN=Lee\\, Ann")
+
+    def testMultiValuedRdnOrderIgnored(self):
+        self.assertTrue(sameDN("CN=Ann+UID=alee,DC=example,DC=org",
+                               "UID=alee+CN=Ann,DC=example,DC=org"))
+
+    def testAttributeTypesUpperCased(self):
+        self.assertEqual(str(canonicalDN("cn=Ann Lee,dc=example,dc=org")),
+                         "CN=Ann Lee,DC=example,DC=org")
+
+    def testEqualityAndHash(self):
+        dn = canonicalDN("CN=Ann Lee,DC=example,DC=org")
+        self.assertEqual(dn, canonicalDN("cn=ANN LEE,dc=example,dc=org"))
+        self.assertIn(canonicalDN("cn=ann lee,dc=example,dc=org"), {dn})
+        self.assertIs(canonicalDN(dn), dn)
+
+    def testParentAndIsWithin(self):
+        dn = canonicalDN("CN=Ann Lee,OU=Staff,DC=example,DC=org")
+        self.assertIs(dn.parent, canonicalDN("ou=staff,dc=example,dc=org"))
+        self.assertTrue(dn.isWithin("DC=Example,DC=org"))
+        self.assertTrue(dn.isWithin(dn))
+        self.assertFalse(dn.isWithin("OU=Students,DC=example,DC=org"))
+        self.assertIsNone(canonicalDN("DC=org").parent)
+
+    def testInvalidDN(self):
+        for dn in ("", "not a dn", "CN=Ann\\"):
+            with self.assertRaises(ValueError):
+                canonicalDN(dn)
+
+
+if __name__ == "__main__":
+    unittest.main()
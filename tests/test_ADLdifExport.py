@@ -0,0 +1,110 @@
+"""
+Tests for the LDIF change file written by ADLdifWriter and checked by
+verifyExport.
+"""
+
+import base64
+import os
+import stat
+import tempfile
+import unittest
+
+try:
+    import ldap
+    from AccountManager_Module_AD.ADLdifExport import ADLdifWriter, verifyExport, \
+        manifestPath, LDIF_LINE_LENGTH
+except ImportError:  # python-ldap is not installed
+    ADLdifWriter = None
+
+
+ANN = "CN=Ann Lee,OU=Staff,DC=example,DC=org"
+BO = "CN=Bo Li,OU=Staff,DC=example,DC=org"
+
+
+@unittest.skipIf(ADLdifWriter is None, "python-ldap is not installed")
+class ADLdifWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "changes.ldif")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _read(self) -> str:
+        with open(self._path, "r", encoding="ascii") as f:
+            return f.read()
+
+    def _export(self) -> ADLdifWriter:
+        writer = ADLdifWriter(self._path)
+        writer.add(ANN, [("objectClass", [b"user"]), ("sAMAccountName", [b"alee"])])
+        writer.modify(BO, [(ldap.MOD_REPLACE, "title", [b"Teacher"])])
+        writer.modify(ANN, [(ldap.MOD_REPLACE, "title", [b"Principal"])])
+        writer.close()
+        return writer
+
+    def testRecords(self):
+        writer = self._export()
+        self.assertEqual(writer.records, 3)
+        text = self._read()
+        self.assertTrue(text.startswith("version: 1\n\n"))
+        self.assertIn("# user: " + BO + "\ndn: " + BO + "\nchangetype: modify\n"
+                      "replace: title\ntitle: Teacher\n-\n", text)
+
+    def testLongLinesFolded(self):
+        writer = ADLdifWriter(self._path)
+        writer.modify(ANN, [(ldap.MOD_REPLACE, "description", [b"x" * 200])])
+        writer.close()
+        lines = self._read().split("\n")
+        self.assertTrue(all(len(line) <= LDIF_LINE_LENGTH for line in lines))
+        start = lines.index("replace: description") + 1
+        value = lines[start] + "".join(line[1:] for line in lines[start + 1:]
+                                       if line.startswith(" "))
+        self.assertEqual(value, "description: " + "x" * 200)
+
+    def testUnsafeValuesEncoded(self):
+        writer = ADLdifWriter(self._path)
+        writer.modify(ANN, [(ldap.MOD_REPLACE, "sn", ["Løvlie"]),
+                            (ldap.MOD_REPLACE, "title", [b" leading space"])])
+        writer.close()
+        text = self._read()
+        self.assertIn("sn:: " + base64.b64encode("Løvlie".encode("utf-8")).decode(), text)
+        self.assertIn("title:: " + base64.b64encode(b" leading space").decode(), text)
+
+    def testDuplicateAddRefused(self):
+        writer = ADLdifWriter(self._path)
+        writer.add(ANN, [("sAMAccountName", [b"alee"])])
+        with self.assertRaises(ldap.ALREADY_EXISTS):
+            writer.add(BO, [("sAMAccountName", [b"ALEE"])])
+        writer.close()
+        self.assertEqual(writer.records, 1)
+
+    @unittest.skipIf(os.name != "posix", "file modes are POSIX only")
+    def testOnlyOwnerCanRead(self):
+        self._export()
+        self.assertEqual(stat.S_IMODE(os.stat(self._path).st_mode), 0o600)
+
+    def testVerifyUntouchedExport(self):
+        self._export()
+        self.assertEqual(verifyExport(self._path), [])
+        with open(manifestPath(self._path), "r", encoding="utf-8") as f:
+            self.assertEqual(sorted(line.split("  ")[1] for line in f), ["1", "2"])
+
+    def testVerifyFindsEditedRecord(self):
+        self._export()
+        text = self._read().replace("title: Teacher", "title: Janitor")
+        with open(self._path, "w", encoding="ascii", newline="\n") as f:
+            f.write(text)
+        self.assertEqual(verifyExport(self._path), [BO])
+
+    def testVerifyFindsMissingRecord(self):
+        self._export()
+        blocks = self._read().split("\n\n")
+        with open(self._path, "w", encoding="ascii", newline="\n") as f:
+            f.write("\n\n".join(block for block in blocks
+                                if "title: Principal" not in block))
+        self.assertEqual(verifyExport(self._path), [ANN])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Tests for ADRateLimiter's token bucket and its AIMD outstanding operation
+limit.
+"""
+
+import time
+import unittest
+
+try:
+    import ldap
+    from AccountManager_Module_AD.ADRateLimiter import ADRateLimiter
+except ImportError:  # python-ldap is not installed
+    ADRateLimiter = None
+
+
+@unittest.skipIf(ADRateLimiter is None, "python-ldap is not installed")
+class ADRateLimiterTest(unittest.TestCase):
+
+    def testTokenBucket(self):
+        limiter = ADRateLimiter(maxOpsPerSecond=5, maxConcurrency=100)
+        for _ in range(5):
+            self.assertTrue(limiter.acquire(blocking=False))
+        # The bucket starts full, and is then empty until it refills.
+        self.assertFalse(limiter.acquire(blocking=False))
+        time.sleep(0.25)
+        self.assertTrue(limiter.acquire(blocking=False))
+
+    def testConcurrencyLimit(self):
+        limiter = ADRateLimiter(maxConcurrency=2)
+        self.assertTrue(limiter.acquire(blocking=False))
+        self.assertTrue(limiter.acquire(blocking=False))
+        self.assertFalse(limiter.acquire(blocking=False))
+        limiter.release(time.monotonic())
+        self.assertTrue(limiter.acquire(blocking=False))
+
+    def testSlowOperationsCutLimit(self):
+        limiter = ADRateLimiter(maxConcurrency=8, targetLatency=0.1)
+        limiter.acquire()
+        limiter.release(time.monotonic() - 1)
+        self.assertEqual(limiter.concurrency, 4)
+
+    def testFastOperationsGrowLimit(self):
+        limiter = ADRateLimiter(maxConcurrency=8, targetLatency=0.1)
+        limiter.acquire()
+        limiter.release(time.monotonic() - 1)
+        self.assertEqual(limiter.concurrency, 4)
+        # A window of fast operations raises the limit by one, once the
+        # average has come back down under the target.
+        for _ in range(40):
+            limiter.acquire()
+            limiter.release(time.monotonic())
+        self.assertGreater(limiter.concurrency, 4)
+        self.assertLessEqual(limiter.concurrency, 8)
+
+    def testUnsampledOperationsLeaveLimit(self):
+        limiter = ADRateLimiter(maxConcurrency=8, targetLatency=0.1)
+        limiter.acquire()
+        limiter.release(time.monotonic() - 1, sample=False)
+        self.assertEqual(limiter.concurrency, 8)
+        self.assertIsNone(limiter.latency)
+        with limiter.operation(sample=False):
+            time.sleep(0.15)
+        self.assertEqual(limiter.concurrency, 8)
+
+    def testBusyErrorPausesOperations(self):
+        limiter = ADRateLimiter(maxConcurrency=8, maxBackoff=60)
+        limiter.acquire()
+        limiter.release(time.monotonic(), ldap.BUSY(), sample=False)
+        self.assertEqual(limiter.busyErrors, 1)
+        self.assertEqual(limiter.concurrency, 4)
+        self.assertFalse(limiter.acquire(blocking=False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Tests for which LDAP errors ADRetryPolicy retries and how long it waits.
+"""
+
+import unittest
+
+try:
+    import ldap
+    from AccountManager_Module_AD.ADRetryPolicy import ADRetryPolicy
+except ImportError:  # python-ldap is not installed
+    ADRetryPolicy = None
+
+
+@unittest.skipIf(ADRetryPolicy is None, "python-ldap is not installed")
+class ADRetryPolicyTest(unittest.TestCase):
+
+    def testTransientErrorsRetried(self):
+        policy = ADRetryPolicy(maxAttempts=3)
+        self.assertTrue(policy.shouldRetry(ldap.BUSY(), 0))
+        self.assertTrue(policy.shouldRetry(ldap.SERVER_DOWN(), 1))
+        # The third attempt is the last.
+        self.assertFalse(policy.shouldRetry(ldap.BUSY(), 2))
+        self.assertEqual(policy.retries, 2)
+
+    def testOtherErrorsNotRetried(self):
+        policy = ADRetryPolicy()
+        self.assertFalse(policy.shouldRetry(ldap.CONSTRAINT_VIOLATION(), 0))
+        self.assertFalse(policy.shouldRetry(ValueError(), 0))
+        self.assertEqual(policy.retries, 0)
+
+    def testErrorsByName(self):
+        policy = ADRetryPolicy(retryErrors=("BUSY",))
+        self.assertTrue(policy.shouldRetry(ldap.BUSY(), 0))
+        self.assertFalse(policy.shouldRetry(ldap.SERVER_DOWN(), 0))
+
+    def testNeedsReconnect(self):
+        policy = ADRetryPolicy()
+        self.assertTrue(policy.needsReconnect(ldap.SERVER_DOWN()))
+        self.assertFalse(policy.needsReconnect(ldap.BUSY()))
+
+    def testBackoffDoublesUpToMaxDelay(self):
+        policy = ADRetryPolicy(baseDelay=0.5, maxDelay=3)
+        for attempt, longest in ((0, 0.5), (1, 1), (2, 2), (3, 3), (10, 3)):
+            delays = [policy.delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= longest for delay in delays))
+            # The waits are jittered rather than all the same.
+            self.assertGreater(len(set(delays)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
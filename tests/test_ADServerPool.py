@@ -0,0 +1,60 @@
+"""
+Tests for how ADServerPool spreads reads and keeps writes on one DC.
+"""
+
+import time
+import unittest
+
+from AccountManager_Module_AD.ADServerPool import ADServerPool
+
+
+class ADServerPoolTest(unittest.TestCase):
+
+    def testWritesStayOnFirstServer(self):
+        pool = ADServerPool(["dc1", "dc2", "dc3"])
+        self.assertEqual({pool.writeServer() for _ in range(5)}, {"dc1"})
+
+    def testReadsTakeEachServerInTurn(self):
+        pool = ADServerPool(["dc1", "dc2", "dc3"])
+        self.assertEqual([pool.readServer() for _ in range(6)],
+                         ["dc1", "dc2", "dc3", "dc1", "dc2", "dc3"])
+
+    def testSingleServerName(self):
+        pool = ADServerPool("dc1")
+        self.assertEqual(pool.servers, ("dc1",))
+        self.assertEqual(pool.readServer(), "dc1")
+
+    def testNoServers(self):
+        with self.assertRaises(ValueError):
+            ADServerPool([])
+
+    def testDownServerPassedOver(self):
+        pool = ADServerPool(["dc1", "dc2", "dc3"], retryInterval=60)
+        pool.markDown("dc1")
+        self.assertEqual(pool.writeServer(), "dc2")
+        self.assertNotIn("dc1", [pool.readServer() for _ in range(4)])
+        self.assertEqual(pool.failures, {"dc1": 1, "dc2": 0, "dc3": 0})
+
+    def testDownServerTriedAgainAfterInterval(self):
+        pool = ADServerPool(["dc1", "dc2"], retryInterval=0.05)
+        pool.markDown("dc1")
+        self.assertEqual(pool.writeServer(), "dc2")
+        time.sleep(0.1)
+        self.assertEqual(pool.writeServer(), "dc1")
+
+    def testEveryServerDown(self):
+        pool = ADServerPool(["dc1", "dc2"], retryInterval=60)
+        pool.markDown("dc2")
+        pool.markDown("dc1")
+        # The DC due to be retried soonest is used rather than none.
+        self.assertEqual(pool.writeServer(), "dc2")
+        self.assertEqual(pool.readServer(), "dc2")
+
+    def testUnknownServerIgnored(self):
+        pool = ADServerPool(["dc1"])
+        pool.markDown("dc9")
+        self.assertEqual(pool.failures, {"dc1": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
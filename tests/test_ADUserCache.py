@@ -0,0 +1,122 @@
+"""
+Tests for ADUserCache, refreshed from a stand-in for ADAccountManager.
+"""
+
+import os
+import pickle
+import tempfile
+import unittest
+
+try:
+    from AccountManager_Module_AD.ADUserCache import ADUserCache, CACHE_FORMAT_VERSION
+except ImportError:  # python-ldap is not installed
+    ADUserCache = None
+
+
+BASE_DN = "OU=Users,DC=example,DC=org"
+
+
+def _entry(guid: bytes, linkid: str, *groups: str) -> dict:
+    entry = {"objectGUID": [guid], "employeeID": [linkid.encode("utf-8")],
+             "objectCategory": [b"CN=Person,CN=Schema,CN=Configuration,DC=example,DC=org"]}
+    if groups:
+        entry["memberOf"] = [group.encode("utf-8") for group in groups]
+    return entry
+
+
+class _Directory():
+    """
+    Answers the calls ADUserCache.refresh makes of an ADAccountManager from a
+    fixed set of users.
+    """
+
+    def __init__(self, users: dict, usn: int = 100):
+        self.users = users
+        self.usn = usn
+
+    def getDirectoryState(self):
+        return ("dc1", self.usn, "DC=example,DC=org")
+
+    def searchUsers(self, search, attributes, searchBase=None, showDeleted=False):
+        return list(self.users.items())
+
+
+@unittest.skipIf(ADUserCache is None, "python-ldap is not installed")
+class ADUserCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "adusers.cache")
+        self._directory = _Directory({
+            "CN=Ann Lee," + BASE_DN: _entry(b"\x01\xff", "1001", "CN=Staff," + BASE_DN),
+            "CN=Bo Li," + BASE_DN: _entry(b"\x02\x00", "1002",
+                                          "CN=Staff," + BASE_DN, "CN=Grade 7," + BASE_DN),
+        })
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _cache(self) -> ADUserCache:
+        return ADUserCache(self._path, BASE_DN, "employeeID", ("memberOf",))
+
+    def testLookup(self):
+        cache = self._cache()
+        self.assertTrue(cache.refresh(self._directory))
+        self.assertEqual(cache.getLinkedUser("1002", "memberOf"),
+                         {"distinguishedName": ["CN=Bo Li," + BASE_DN],
+                          "memberOf": ["CN=Staff," + BASE_DN, "CN=Grade 7," + BASE_DN]})
+        self.assertEqual(cache.getLinkedUser("1001", "title"),
+                         {"distinguishedName": ["CN=Ann Lee," + BASE_DN], "title": None})
+        self.assertIsNone(cache.getLinkedUser("1003"))
+
+    def testSaveAndLoad(self):
+        cache = self._cache()
+        cache.refresh(self._directory)
+        cache.save()
+        loaded = self._cache()
+        self.assertTrue(loaded.load())
+        self.assertEqual(set(loaded.linkids()), {"1001", "1002"})
+        for linkid in ("1001", "1002"):
+            self.assertEqual(loaded.getLinkedUser(linkid, "memberOf"),
+                             cache.getLinkedUser(linkid, "memberOf"))
+        # The watermark was kept, so the next refresh is incremental.
+        self.assertFalse(loaded.refresh(self._directory))
+
+    def testSavedAsJson(self):
+        cache = self._cache()
+        cache.refresh(self._directory)
+        cache.save()
+        with open(self._path, "rb") as f:
+            self.assertEqual(f.read(1), b"{")
+
+    def testPickledCacheNotLoaded(self):
+        with open(self._path, "wb") as f:
+            pickle.dump({"version": CACHE_FORMAT_VERSION, "baseUserDN": BASE_DN}, f)
+        self.assertFalse(self._cache().load())
+
+    def testOtherAttributesNotLoaded(self):
+        cache = self._cache()
+        cache.refresh(self._directory)
+        cache.save()
+        other = ADUserCache(self._path, BASE_DN, "employeeID", ("title",))
+        self.assertFalse(other.load())
+
+    def testDirtyAndDuplicateLinkids(self):
+        self._directory.users["CN=Ann Lee2," + BASE_DN] = _entry(b"\x03", "1001")
+        cache = self._cache()
+        cache.refresh(self._directory)
+        self.assertTrue(cache.isDirty("1001"))
+        self.assertFalse(cache.isDirty("1002"))
+        cache.invalidate("1002")
+        self.assertTrue(cache.isDirty("1002"))
+
+    def testUpdate(self):
+        cache = self._cache()
+        cache.refresh(self._directory)
+        cache.update("1001", "memberOf", ["CN=Grade 7," + BASE_DN])
+        self.assertEqual(cache.getLinkedUser("1001", "memberOf")["memberOf"],
+                         ["CN=Grade 7," + BASE_DN])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Tests for CSVPager reading compressed datasource files, compared against the
+same file uncompressed.
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import tempfile
+import unittest
+
+from CSVPager import CSVPager, compressionOf
+
+
+ROWS = "".join(str(i) + ",User " + str(i) + ',"multi\nline"\n' for i in range(10))
+COMPRESSORS = {"gzip": gzip.compress, "bz2": bz2.compress, "xz": lzma.compress}
+
+
+class CSVPagerCompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._plain = self._write("ds.csv", ROWS.encode("utf-8"))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self._dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def _compressed(self, compression: str) -> str:
+        # The file name says nothing of the compression, which is judged by
+        # the file's contents.
+        return self._write(compression + ".csv",
+                           COMPRESSORS[compression](ROWS.encode("utf-8")))
+
+    def _pages(self, path: str, pageSize: int = 3) -> list:
+        pager = CSVPager(path, CSVPager.FILE_TYPE_CSV, pageSize)
+        self.addCleanup(pager.close)
+        pages = []
+        i = 0
+        while True:
+            nexti = pager.getPage(i)
+            pages.append((i, nexti, dict(pager.page)))
+            if nexti == -1:
+                return pages
+            i = nexti
+
+    def testCompressionOf(self):
+        self.assertIsNone(compressionOf(self._plain))
+        for compression in COMPRESSORS:
+            self.assertEqual(compressionOf(self._compressed(compression)), compression)
+
+    def testCompressedPagesMatchPlain(self):
+        expected = self._pages(self._plain)
+        for compression in COMPRESSORS:
+            with self.subTest(compression=compression):
+                self.assertEqual(self._pages(self._compressed(compression)), expected)
+
+    def testFullLastPageIsTheLast(self):
+        for compression in COMPRESSORS:
+            with self.subTest(compression=compression):
+                pages = self._pages(self._compressed(compression), pageSize=5)
+                self.assertEqual([(i, nexti) for i, nexti, page in pages],
+                                 [(0, 5), (5, -1)])
+
+    def testRecordCountKnownOnceRead(self):
+        pager = CSVPager(self._compressed("gzip"), CSVPager.FILE_TYPE_CSV, 4)
+        self.addCleanup(pager.close)
+        self.assertIsNone(pager.csvRecordCount)
+        i = 0
+        while i != -1:
+            i = pager.getPage(i)
+        self.assertEqual(pager.csvRecordCount, 10)
+
+    def testEarlierPageReadAgain(self):
+        pager = CSVPager(self._compressed("bz2"), CSVPager.FILE_TYPE_CSV, 4)
+        self.addCleanup(pager.close)
+        pager.getPage(0)
+        pager.getPage(4)
+        self.assertEqual(pager.getPage(0), 4)
+        self.assertEqual(list(pager.page), ["0", "1", "2", "3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
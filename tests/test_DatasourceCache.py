@@ -0,0 +1,129 @@
+"""
+Tests for DatasourceCache, and for CSVPager reading through one.
+"""
+
+import csv
+import os
+import tempfile
+import unittest
+
+from CSVPager import CSVPager
+from DatasourceCache import DatasourceCache
+
+
+ROWS = [["1", "Alice", "Smith"],
+        ["2", "Bob", ""],
+        ["Abc", "Mixed", "Case"],
+        ["3", "Nul\x00In field", "x"],
+        ["4", "Ünïcode", "名前"],
+        ["2", "Bob", "Again"]]
+
+
+class DatasourceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "ds.cache")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _build(self, rows=ROWS) -> DatasourceCache:
+        cache = DatasourceCache(self._path)
+        self.addCleanup(cache.close)
+        cache.build(rows, "fingerprint", CSVPager.FILE_TYPE_CSV, 0)
+        return cache
+
+    def testRowsByIndex(self):
+        cache = self._build()
+        self.assertEqual(cache.count, len(ROWS))
+        self.assertEqual([cache.row(i) for i in range(cache.count)], ROWS)
+
+    def testFind(self):
+        cache = self._build()
+        self.assertEqual(cache.find("1"), ROWS[0])
+        self.assertEqual(cache.find("aBC"), ROWS[2])
+        self.assertEqual(cache.find("3"), ROWS[3])
+        self.assertEqual(cache.find("4"), ROWS[4])
+        self.assertIsNone(cache.find("5"))
+
+    def testLastRecordOfAKeyIsFound(self):
+        self.assertEqual(self._build().find("2"), ROWS[5])
+
+    def testManyKeys(self):
+        rows = [[str(i), "User " + str(i)] for i in range(5000)]
+        cache = self._build(rows)
+        for i in (0, 1, 2047, 2048, 4999):
+            self.assertEqual(cache.find(str(i)), rows[i])
+        self.assertIsNone(cache.find("5000"))
+
+    def testEmpty(self):
+        cache = self._build([])
+        self.assertEqual(cache.count, 0)
+        self.assertIsNone(cache.find("1"))
+
+    def testLoad(self):
+        self._build().close()
+        cache = DatasourceCache(self._path)
+        self.addCleanup(cache.close)
+        self.assertTrue(cache.load("fingerprint", CSVPager.FILE_TYPE_CSV, 0))
+        self.assertEqual(cache.find("1"), ROWS[0])
+        self.assertFalse(cache.load("other", CSVPager.FILE_TYPE_CSV, 0))
+        self.assertFalse(cache.load("fingerprint", CSVPager.FILE_TYPE_TSV, 0))
+        self.assertFalse(cache.load("fingerprint", CSVPager.FILE_TYPE_CSV, 1))
+
+    def testLoadMissingOrDamaged(self):
+        cache = DatasourceCache(self._path)
+        self.assertFalse(cache.load("fingerprint", CSVPager.FILE_TYPE_CSV, 0))
+        with open(self._path, "wb") as f:
+            f.write(b"not a cache")
+        self.assertFalse(cache.load("fingerprint", CSVPager.FILE_TYPE_CSV, 0))
+
+
+class CachedCSVPagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._csv = os.path.join(self._dir.name, "ds.csv")
+        self._cache = os.path.join(self._dir.name, "ds.cache")
+        with open(self._csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            for i in range(10):
+                writer.writerow([str(i), "line one\nline two" if i == 4 else "User", str(i)])
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _pages(self, pager) -> list:
+        self.addCleanup(pager.close)
+        pages = []
+        i = 0
+        while True:
+            nexti = pager.getPage(i)
+            pages.append((i, nexti, dict(pager.page)))
+            if nexti == -1:
+                return pages
+            i = nexti
+
+    def testSamePagesAsTheFile(self):
+        expected = self._pages(CSVPager(self._csv, CSVPager.FILE_TYPE_CSV, 3))
+        built = self._pages(CSVPager(self._csv, CSVPager.FILE_TYPE_CSV, 3,
+                                     cachePath=self._cache))
+        loaded = CSVPager(self._csv, CSVPager.FILE_TYPE_CSV, 3, cachePath=self._cache)
+        self.assertEqual(loaded.csvRecordCount, 10)
+        self.assertEqual(loaded.getRecord("4"), ["4", "line one\nline two", "4"])
+        self.assertEqual(built, expected)
+        self.assertEqual(self._pages(loaded), expected)
+
+    def testRebuiltWhenTheFileChanges(self):
+        self._pages(CSVPager(self._csv, CSVPager.FILE_TYPE_CSV, 3, cachePath=self._cache))
+        with open(self._csv, "a", newline="") as f:
+            csv.writer(f).writerow(["10", "New", "10"])
+        pager = CSVPager(self._csv, CSVPager.FILE_TYPE_CSV, 3, cachePath=self._cache)
+        self.assertEqual(pager.csvRecordCount, 11)
+        self.assertEqual(pager.getRecord("10"), ["10", "New", "10"])
+        pager.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
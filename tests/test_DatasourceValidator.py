@@ -0,0 +1,133 @@
+"""
+Tests for the DatasourceValidator policies.
+"""
+
+import logging
+import unittest
+
+from DatasourceValidator import DatasourceValidator
+
+
+COLUMNS = {"ID": 0, "FIRST": 1, "LAST": 2, "EMAIL": 3}
+
+
+class ListPager():
+    """
+    Stands in for a pager, holding its records in a list.
+    """
+
+    def __init__(self, rows: list):
+        self._rows = rows
+
+    def records(self):
+        return iter(self._rows)
+
+
+class DatasourceValidatorTest(unittest.TestCase):
+
+    ROWS = [["1", "Alice", "Smith", "alice@example.org"],
+            ["2", "Bob", "Jones", "shared@example.org"],
+            ["1", "Alicia", "", ""],
+            ["3", "Carl", "Lee", "shared@example.org"],
+            ["", "No", "ID", ""],
+            ["4", "Short"],
+            ["5", "Eve", "Ng", ""]]
+
+    def _validate(self, rows=ROWS, **kwargs) -> DatasourceValidator:
+        logger = logging.getLogger("tests.DatasourceValidator")
+        validator = DatasourceValidator(logger, COLUMNS, "ID", "EMAIL", **kwargs)
+        with self.assertLogs(logger, logging.INFO):
+            validator.validate(ListPager(rows))
+        return validator
+
+    def _synced(self, validator: DatasourceValidator, rows=ROWS,
+                pageSize: int = 2) -> tuple:
+        """
+        Returns a tuple of ({ linkid: record } of every record synced, [IDs
+        withheld]) when rows are paged pageSize at a time, as readPages
+        would page them.
+        """
+        synced = {}
+        withheld = []
+        for index in range(0, len(rows), pageSize):
+            nextIndex = index + pageSize if index + pageSize < len(rows) else -1
+            page = {row[0]: row for row in rows[index:index + pageSize]
+                    if len(row) > 0}
+            page, left = validator.filterPage(page, index, nextIndex)
+            for linkid, row in page.items():
+                self.assertNotIn(linkid, synced)
+                synced[linkid] = row
+            withheld += left
+        return synced, withheld
+
+    def testDuplicatesLast(self):
+        synced, withheld = self._synced(self._validate(duplicatePolicy="last"))
+        self.assertEqual(synced["1"], ["1", "Alicia", "", ""])
+        self.assertEqual(sorted(synced), ["1", "2", "3", "5"])
+        self.assertIn("1", withheld)
+
+    def testDuplicatesFirst(self):
+        synced, withheld = self._synced(self._validate(duplicatePolicy="first"))
+        self.assertEqual(synced["1"], ["1", "Alice", "Smith", "alice@example.org"])
+
+    def testDuplicatesMerge(self):
+        synced, withheld = self._synced(self._validate(duplicatePolicy="merge"))
+        self.assertEqual(synced["1"], ["1", "Alicia", "Smith", "alice@example.org"])
+
+    def testDuplicatesQuarantine(self):
+        validator = self._validate(duplicatePolicy="quarantine")
+        synced, withheld = self._synced(validator)
+        self.assertNotIn("1", synced)
+        self.assertEqual(withheld.count("1"), 2)
+        self.assertEqual(validator.quarantinedCount, 2)
+
+    def testShortAndKeylessRecordsLeftOut(self):
+        validator = self._validate()
+        synced, withheld = self._synced(validator)
+        self.assertNotIn("", synced)
+        self.assertNotIn("4", synced)
+        # Only the short record's ID counts, since a record with no ID can
+        # never be synced.
+        self.assertEqual(validator.quarantinedCount, 1)
+
+    def testShortDuplicateOfCompleteRecord(self):
+        rows = [["1", "Alice", "Smith", ""], ["1", "Short"]]
+        validator = self._validate(rows)
+        synced, withheld = self._synced(validator, rows, pageSize=1)
+        self.assertEqual(synced, {"1": ["1", "Alice", "Smith", ""]})
+        self.assertEqual(validator.quarantinedCount, 0)
+
+    def testIdsComparedWithoutCase(self):
+        rows = [["ab1", "Old", "L", ""], ["AB1", "New", "L", ""]]
+        synced, withheld = self._synced(self._validate(rows), rows, pageSize=1)
+        self.assertEqual(synced, {"AB1": ["AB1", "New", "L", ""]})
+
+    def testConflictsReported(self):
+        synced, withheld = self._synced(self._validate(conflictPolicy="report"))
+        self.assertIn("2", synced)
+        self.assertIn("3", synced)
+
+    def testConflictsQuarantined(self):
+        validator = self._validate(conflictPolicy="quarantine")
+        synced, withheld = self._synced(validator)
+        self.assertNotIn("2", synced)
+        self.assertNotIn("3", synced)
+        self.assertEqual(validator.quarantinedCount, 3)
+
+    def testCleanDatasourcePassesThrough(self):
+        rows = [["1", "A", "B", "a@example.org"], ["2", "C", "D", ""]]
+        validator = self._validate(rows)
+        page = {row[0]: row for row in rows}
+        self.assertEqual(validator.filterPage(page, 0, -1), (page, []))
+        self.assertEqual(validator.quarantinedCount, 0)
+
+    def testUnknownPolicies(self):
+        logger = logging.getLogger("tests.DatasourceValidator")
+        with self.assertRaises(ValueError):
+            DatasourceValidator(logger, COLUMNS, "ID", duplicatePolicy="newest")
+        with self.assertRaises(ValueError):
+            DatasourceValidator(logger, COLUMNS, "ID", conflictPolicy="merge")
+
+
+if __name__ == "__main__":
+    unittest.main()
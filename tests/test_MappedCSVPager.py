@@ -0,0 +1,96 @@
+"""
+Tests for MappedCSVPager, compared against CSVPager reading the same files.
+Chunks are kept small so that chunk boundaries fall inside quoted fields.
+"""
+
+import csv
+import os
+import random
+import tempfile
+import unittest
+
+from CSVPager import CSVPager
+from MappedCSVPager import MappedCSVPager
+
+
+VALUES = ["plain", 'has "quotes"', "multi\nline", "comma, here", '"\n"',
+          "crlf\r\nin", "ünïcode", ""]
+
+
+class MappedCSVPagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, count: int, filetype: str = CSVPager.FILE_TYPE_CSV,
+               lineterminator: str = "\n") -> str:
+        rng = random.Random(count)
+        path = os.path.join(self._dir.name, "ds" + str(count) + ".csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f, filetype, lineterminator=lineterminator)
+            for i in range(count):
+                value = rng.choice(VALUES)
+                writer.writerow([str(i), value, "x" * rng.randrange(20), value[::-1]])
+        return path
+
+    def _pages(self, pager) -> list:
+        self.addCleanup(pager.close)
+        pages = []
+        i = 0
+        while True:
+            nexti = pager.getPage(i)
+            pages.append((i, nexti, dict(pager.page)))
+            if nexti == -1:
+                return pages
+            i = nexti
+
+    def _assertSameAsCSVPager(self, path: str, filetype: str = CSVPager.FILE_TYPE_CSV,
+                              chunkSize: int = 16, workers: int = 2):
+        pager = CSVPager(path, filetype, 5)
+        expectedrows = list(pager.records())
+        expected = self._pages(pager)
+        mapped = MappedCSVPager(path, filetype, 5, workers=workers,
+                                chunkSize=chunkSize)
+        self.assertEqual(self._pages(mapped), expected)
+        self.assertEqual(list(mapped.records()), expectedrows)
+        self.assertEqual(mapped.csvRecordCount, len(expectedrows))
+
+    def testQuotedNewlinesAcrossChunks(self):
+        for chunkSize in (1, 7, 16, 64, 100000):
+            self._assertSameAsCSVPager(self._write(60), chunkSize=chunkSize)
+
+    def testCrlfLineEndings(self):
+        self._assertSameAsCSVPager(self._write(40, lineterminator="\r\n"))
+
+    def testTabSeparated(self):
+        path = self._write(40, CSVPager.FILE_TYPE_TSV)
+        self._assertSameAsCSVPager(path, CSVPager.FILE_TYPE_TSV)
+
+    def testSmallFiles(self):
+        for count in (0, 1, 5, 6):
+            self._assertSameAsCSVPager(self._write(count), workers=1)
+
+    def testPagesOutOfOrder(self):
+        path = self._write(60)
+        expected = self._pages(CSVPager(path, CSVPager.FILE_TYPE_CSV, 5))
+        mapped = MappedCSVPager(path, CSVPager.FILE_TYPE_CSV, 5, workers=2,
+                                chunkSize=16)
+        self.addCleanup(mapped.close)
+        for i, nexti, page in (expected[5], expected[2], expected[-1], expected[0]):
+            self.assertEqual(mapped.getPage(i), nexti)
+            self.assertEqual(mapped.page, page)
+
+    def testFingerprintMatchesCSVPager(self):
+        path = self._write(10)
+        pager = CSVPager(path, CSVPager.FILE_TYPE_CSV, 5)
+        mapped = MappedCSVPager(path, CSVPager.FILE_TYPE_CSV, 5)
+        self.addCleanup(pager.close)
+        self.addCleanup(mapped.close)
+        self.assertEqual(mapped.fingerprint, pager.fingerprint)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Tests for MergedCSVPager combining several datasource files by linkid.
+"""
+
+import os
+import tempfile
+import unittest
+
+from CSVPager import CSVPager
+from MergedCSVPager import MergedCSVPager
+
+
+COLUMNS = {"ID": 0, "NAME": 1, "EMAIL": 2}
+
+
+class MergedCSVPagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, name: str, text: str) -> str:
+        path = os.path.join(self._dir.name, name)
+        with open(path, "w", newline="") as f:
+            f.write(text)
+        return path
+
+    def _records(self, paths: list, pageSize: int = 2, **kwargs) -> dict:
+        pager = MergedCSVPager(paths, CSVPager.FILE_TYPE_CSV, pageSize,
+                               COLUMNS, "ID", **kwargs)
+        self.addCleanup(pager.close)
+        records = {}
+        i = 0
+        while i != -1:
+            i = pager.getPage(i)
+            records.update(pager.page)
+        self.assertEqual(pager.csvRecordCount, len(records))
+        return records
+
+    def testLaterFileTakesPrecedence(self):
+        students = self._write("students.csv", "3,Cy,cy@old\n1,Ann,\n")
+        staff = self._write("staff.csv", "2,Bo,bo@example\n3,Cyrus,\n")
+        self.assertEqual(self._records([students, staff]),
+                         {"1": ["1", "Ann", ""],
+                          "2": ["2", "Bo", "bo@example"],
+                          # An empty field is taken from the next file.
+                          "3": ["3", "Cyrus", "cy@old"]})
+
+    def testColumnPrecedence(self):
+        students = self._write("students.csv", "1,Ann,ann@students\n")
+        staff = self._write("staff.csv", "1,Annie,ann@staff\n")
+        self.assertEqual(self._records([students, staff],
+                                       precedence={"EMAIL": ("students.csv",)}),
+                         {"1": ["1", "Annie", "ann@students"]})
+
+    def testFileColumnDefinitions(self):
+        main = self._write("main.csv", "1,Ann,\n2,Bo,\n")
+        emails = self._write("emails.csv", "bo@example,2\n")
+        records = self._records([main, emails],
+                                fileColumnDefinitions={"emails.csv": {"EMAIL": 0, "ID": 1}})
+        self.assertEqual(records["2"], ["2", "Bo", "bo@example"])
+        self.assertEqual(records["1"], ["1", "Ann", ""])
+
+    def testOverrideFileOnlyChangesKnownUsers(self):
+        main = self._write("main.csv", "ab1,Ann,\n")
+        overrides = self._write("overrides.csv", "AB1,,ann@override\n9,Nobody,\n")
+        self.assertEqual(self._records([main, overrides],
+                                       overrideFiles=("overrides.csv",)),
+                         {"ab1": ["ab1", "Ann", "ann@override"]})
+
+    def testPresortedFiles(self):
+        first = self._write("first.csv", "1,Ann,\n3,Cy,\n")
+        second = self._write("second.csv", "2,Bo,\n4,Di,\n")
+        self.assertEqual(list(self._records([first, second], presorted=True)),
+                         ["1", "2", "3", "4"])
+
+    def testUnsortedFileSaidToBeSorted(self):
+        unsorted = self._write("unsorted.csv", "2,Bo,\n1,Ann,\n")
+        with self.assertRaises(ValueError):
+            self._records([unsorted], presorted=True)
+
+    def testMissingKeyColumn(self):
+        main = self._write("main.csv", "1,Ann,\n")
+        with self.assertRaises(ValueError):
+            MergedCSVPager([main], CSVPager.FILE_TYPE_CSV, 2, COLUMNS, "ID",
+                           fileColumnDefinitions={"main.csv": {"NAME": 0}})
+
+
+if __name__ == "__main__":
+    unittest.main()
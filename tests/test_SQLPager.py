@@ -0,0 +1,197 @@
+"""
+Tests for SQLPager, run against a SQLite database.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from SQLPager import SQLPager
+
+
+COLUMNS = {"ID": 0, "NAME": 1}
+QUERY = "SELECT id, name, updated FROM users ORDER BY id"
+INCREMENTAL_QUERY = ("SELECT id, name, updated FROM users "
+                     "WHERE updated > :watermark ORDER BY id")
+
+
+class SQLPagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._db = os.path.join(self._dir.name, "sis.db")
+        self._watermark = os.path.join(self._dir.name, "watermark.json")
+        with sqlite3.connect(self._db) as db:
+            db.execute("CREATE TABLE users (id TEXT, name TEXT, updated INTEGER)")
+            db.executemany("INSERT INTO users VALUES (?, ?, ?)",
+                           [(str(i), "User " + str(i), 100 + i) for i in range(7)])
+        db.close()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _pager(self, pageSize: int = 3, keyFilter=None) -> SQLPager:
+        pager = SQLPager(lambda: sqlite3.connect(self._db), QUERY, pageSize,
+                         COLUMNS, "ID", keyFilter,
+                         incrementalQuery=INCREMENTAL_QUERY,
+                         watermarkColumn="updated",
+                         watermarkPath=self._watermark)
+        self.addCleanup(pager.close)
+        return pager
+
+    def _readAll(self, pager: SQLPager) -> list:
+        pages = []
+        i = 0
+        while True:
+            nexti = pager.getPage(i)
+            pages.append((i, nexti, dict(pager.page)))
+            if nexti == -1:
+                return pages
+            i = nexti
+
+    def testPagesInOrder(self):
+        pager = self._pager()
+        pages = self._readAll(pager)
+        self.assertEqual([(i, nexti) for i, nexti, page in pages],
+                         [(0, 3), (3, 6), (6, -1)])
+        self.assertEqual(list(pages[1][2]), ["3", "4", "5"])
+        self.assertEqual(pages[2][2], {"6": ["6", "User 6"]})
+        self.assertEqual(pager.csvRecordCount, 7)
+
+    def testFullLastPageIsTheLast(self):
+        pager = self._pager(pageSize=7)
+        self.assertEqual(pager.getPage(0), -1)
+        self.assertEqual(len(pager.page), 7)
+
+    def testPageOutOfOrderRunsQueryAgain(self):
+        pager = self._pager()
+        self._readAll(pager)
+        self.assertEqual(pager.getPage(3), 6)
+        self.assertEqual(list(pager.page), ["3", "4", "5"])
+
+    def testKeyFilter(self):
+        pager = self._pager(keyFilter=lambda key: int(key) % 2 == 0)
+        pages = self._readAll(pager)
+        self.assertEqual([key for i, nexti, page in pages for key in page],
+                         ["0", "2", "4", "6"])
+        self.assertEqual(len(list(pager.records())), 7)
+
+    def testCountBeforeReading(self):
+        self.assertEqual(self._pager().csvRecordCount, 7)
+
+    def testMissingColumn(self):
+        pager = SQLPager(lambda: sqlite3.connect(self._db), QUERY, 3,
+                         {"ID": 0, "EMAIL": 1}, "ID")
+        self.addCleanup(pager.close)
+        with self.assertRaises(ValueError):
+            pager.getPage(0)
+
+    def testWatermarkSavedAndReloaded(self):
+        pager = self._pager()
+        self.assertFalse(pager.incremental)
+        self._readAll(pager)
+        self.assertTrue(pager.saveWatermark())
+
+        with sqlite3.connect(self._db) as db:
+            db.execute("UPDATE users SET name = 'Changed', updated = 200 WHERE id = '4'")
+        db.close()
+        pager = self._pager()
+        self.assertTrue(pager.incremental)
+        self.assertEqual(self._readAll(pager), [(0, -1, {"4": ["4", "Changed"]})])
+        self.assertTrue(pager.saveWatermark())
+
+        # Nothing has changed since, so there is nothing to read and the
+        # saved watermark stands.
+        pager = self._pager()
+        self.assertEqual(self._readAll(pager), [(0, -1, {})])
+        self.assertFalse(pager.saveWatermark())
+        self.assertTrue(self._pager().incremental)
+
+    def testWatermarkNotSavedUntilReadThrough(self):
+        pager = self._pager()
+        pager.getPage(0)
+        self.assertFalse(pager.saveWatermark())
+        self.assertFalse(os.path.exists(self._watermark))
+
+    def testWatermarkForAnotherQueryIgnored(self):
+        pager = self._pager()
+        self._readAll(pager)
+        pager.saveWatermark()
+        pager = SQLPager(lambda: sqlite3.connect(self._db), QUERY, 3, COLUMNS, "ID",
+                         incrementalQuery=INCREMENTAL_QUERY + " LIMIT 100",
+                         watermarkColumn="updated",
+                         watermarkPath=self._watermark)
+        self.addCleanup(pager.close)
+        self.assertFalse(pager.incremental)
+        self.assertEqual(pager.csvRecordCount, 7)
+
+
+    def testCloseFromAnotherThread(self):
+        pager = self._pager()
+        # Read the first page on another thread, as the sync pipeline does,
+        # then close the pager on this one.
+        reader = threading.Thread(target=pager.getPage, args=(0,))
+        reader.start()
+        reader.join()
+        pager.close()
+        self.assertEqual(pager.getPage(0), 3)
+
+    def testServerSideCursor(self):
+        connections = []
+
+        def connect():
+            connections.append(_NamedCursorConnection(self._db))
+            return connections[-1]
+
+        pager = SQLPager(connect, QUERY, 3, COLUMNS, "ID")
+        self.addCleanup(pager.close)
+        pages = self._readAll(pager)
+        self.assertEqual([(i, nexti) for i, nexti, page in pages],
+                         [(0, 3), (3, 6), (6, -1)])
+        self.assertEqual(len(list(pager.records())), 7)
+        self.assertEqual([connection.names for connection in connections],
+                         [["datasource"], ["datasource"]])
+
+
+class _NamedCursor():
+    """
+    Stands in for a server-side cursor, which (like psycopg2's) describes
+    its columns only once rows have been fetched.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.description = None
+
+    def execute(self, query, params):
+        self._cursor.execute(query, params)
+
+    def fetchmany(self, size):
+        rows = self._cursor.fetchmany(size)
+        self.description = self._cursor.description
+        return rows
+
+
+class _NamedCursorConnection():
+    """
+    A SQLite connection whose cursor() takes a name, as psycopg2's does.
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path)
+        self.names = []
+
+    def cursor(self, name: str = None):
+        if name is None:
+            return self._connection.cursor()
+        self.names.append(name)
+        return _NamedCursor(self._connection.cursor())
+
+    def close(self):
+        self._connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
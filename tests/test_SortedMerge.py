@@ -0,0 +1,76 @@
+"""
+Tests for the external sort and merge join in SortedMerge.
+"""
+
+import os
+import random
+import tempfile
+import unittest
+
+from SortedMerge import externalSort, mergeJoin
+
+
+class ExternalSortTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def testSortsInMemory(self):
+        items = ["b", "C", "a"]
+        self.assertEqual(list(externalSort(items, key=str.lower, chunkSize=10)),
+                         ["a", "b", "C"])
+
+    def testSortsAcrossSpilledChunks(self):
+        rng = random.Random(1)
+        items = [(str(rng.randrange(10000)), n) for n in range(1000)]
+        result = list(externalSort(items, key=lambda item: item[0],
+                                   chunkSize=64, tempDir=self._dir.name))
+        self.assertEqual(result, sorted(items, key=lambda item: item[0]))
+
+    def testChunkBoundaries(self):
+        for count in (0, 1, 63, 64, 65, 128):
+            items = list(range(count, 0, -1))
+            self.assertEqual(list(externalSort(items, key=lambda n: n, chunkSize=64,
+                                               tempDir=self._dir.name)),
+                             sorted(items))
+
+    def testTemporaryFilesRemoved(self):
+        sorted_ = externalSort(range(500, 0, -1), key=lambda n: n, chunkSize=50,
+                               tempDir=self._dir.name)
+        self.assertEqual(next(sorted_), 1)
+        sorted_.close()
+        self.assertEqual(os.listdir(self._dir.name), [])
+
+
+class MergeJoinTest(unittest.TestCase):
+
+    def testMatchesKeys(self):
+        left = [("a", 1), ("b", 2), ("b", 3), ("d", 4)]
+        right = [("b", "x"), ("c", "y"), ("d", "z"), ("e", "w")]
+        key = lambda item: item[0]
+        self.assertEqual(list(mergeJoin(left, right, key, key)),
+                         [("a", [("a", 1)], []),
+                          ("b", [("b", 2), ("b", 3)], [("b", "x")]),
+                          ("c", [], [("c", "y")]),
+                          ("d", [("d", 4)], [("d", "z")]),
+                          ("e", [], [("e", "w")])])
+
+    def testEmptyStreams(self):
+        key = lambda item: item
+        self.assertEqual(list(mergeJoin([], [], key, key)), [])
+        self.assertEqual(list(mergeJoin(["a"], [], key, key)), [("a", ["a"], [])])
+        self.assertEqual(list(mergeJoin([], ["a"], key, key)), [("a", [], ["a"])])
+
+    def testUnsortedStreamRaises(self):
+        key = lambda item: item
+        with self.assertRaises(ValueError):
+            list(mergeJoin(["a", "c", "b"], ["a"], key, key))
+        with self.assertRaises(ValueError):
+            list(mergeJoin(["a"], ["b", "a"], key, key))
+
+
+if __name__ == "__main__":
+    unittest.main()
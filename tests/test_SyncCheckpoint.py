@@ -0,0 +1,79 @@
+"""
+Tests for SyncCheckpoint.
+"""
+
+import os
+import stat
+import tempfile
+import unittest
+
+from SyncCheckpoint import SyncCheckpoint
+
+
+NOTIFICATIONS = {"new_user": {("a@example.com", "b@example.com"): [["AD", "jsmith", "pw1"]]},
+                 "pass_reset": {}}
+
+
+class SyncCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "sync.checkpoint")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def testSaveAndLoad(self):
+        SyncCheckpoint(self._path, "abc").save(300, NOTIFICATIONS, 2)
+        checkpoint = SyncCheckpoint(self._path, "abc")
+        self.assertTrue(checkpoint.load())
+        self.assertEqual(checkpoint.pageIndex, 300)
+        self.assertEqual(checkpoint.failedUsers, 2)
+        self.assertEqual(checkpoint.notifications("new_user"), NOTIFICATIONS["new_user"])
+        self.assertEqual(checkpoint.notifications("pass_reset"), {})
+        self.assertEqual(checkpoint.notifications("other"), {})
+
+    def testLaterSaveReplacesEarlier(self):
+        checkpoint = SyncCheckpoint(self._path, "abc")
+        checkpoint.save(100, NOTIFICATIONS, 1)
+        checkpoint.save(200, {"new_user": {}}, 0)
+        loaded = SyncCheckpoint(self._path, "abc")
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.pageIndex, 200)
+        self.assertEqual(loaded.failedUsers, 0)
+        self.assertEqual(loaded.notifications("new_user"), {})
+        self.assertFalse(os.path.exists(self._path + ".tmp"))
+
+    def testOtherDatasourceNotLoaded(self):
+        SyncCheckpoint(self._path, "abc").save(100, NOTIFICATIONS)
+        checkpoint = SyncCheckpoint(self._path, "xyz")
+        self.assertFalse(checkpoint.load())
+        self.assertEqual(checkpoint.pageIndex, 0)
+
+    def testMissingOrDamagedNotLoaded(self):
+        self.assertFalse(SyncCheckpoint(self._path, "abc").load())
+        with open(self._path, "w") as f:
+            f.write('{"fingerprint": "abc", "pageI')
+        self.assertFalse(SyncCheckpoint(self._path, "abc").load())
+
+    def testClear(self):
+        checkpoint = SyncCheckpoint(self._path, "abc")
+        checkpoint.save(100, NOTIFICATIONS)
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self._path))
+        checkpoint.clear()
+        self.assertFalse(SyncCheckpoint(self._path, "abc").load())
+
+    @unittest.skipIf(os.name != "posix", "file modes are only checked on POSIX")
+    def testReadableOnlyByOwner(self):
+        # A temporary file left by an interrupted save, readable by anyone.
+        with open(self._path + ".tmp", "w") as f:
+            f.write("stale")
+        os.chmod(self._path + ".tmp", 0o644)
+        SyncCheckpoint(self._path, "abc").save(100, NOTIFICATIONS)
+        self.assertEqual(stat.S_IMODE(os.stat(self._path).st_mode) & 0o077, 0)
+        self.assertTrue(SyncCheckpoint(self._path, "abc").load())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+Tests for SyncDispatcher feeding several targets from one read of the
+datasource.  These need a Settings.py, as the sync engine reads its settings
+when it is imported.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from CSVPager import CSVPager
+
+try:
+    import AccountSyncer
+    from SyncDispatcher import SyncDispatcher, DatasourceReadError
+    _Target = AccountSyncer.AccountSyncer
+except ImportError:  # no Settings.py
+    SyncDispatcher = None
+    _Target = object
+
+
+class _Recorder(_Target):
+    """
+    A target that records the linkids it is given, optionally failing after
+    a number of pages.
+    """
+
+    def __init__(self, name: str, failAfter: int = None, resumeAt: int = 0):
+        super().__init__(logging.getLogger("test"), None)
+        self.linkids = []
+        self.thread = None
+        self._name = name
+        self._failAfter = failAfter
+        self._resumeAt = resumeAt
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def resumeIndex(self, pager) -> int:
+        return self._resumeAt
+
+    def syncDatasource(self, pager, pages) -> bool:
+        self.thread = threading.current_thread()
+        for count, item in enumerate(pages):
+            if count == self._failAfter:
+                raise RuntimeError("target down")
+            self.linkids += [linkid for linkid in item["page"]
+                             if int(linkid) >= self._resumeAt]
+            # Targets may add to their own work items.
+            item["users"].append({})
+        return True
+
+
+@unittest.skipIf(SyncDispatcher is None, "Settings.py is not present")
+class SyncDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "ds.csv")
+        definition = AccountSyncer.DS_COLUMN_DEFINITION
+        keyIndex = definition[AccountSyncer.DS_ACCOUNT_IDENTIFIER]
+        width = max(definition.values()) + 1
+        with open(self._path, "w", newline="") as f:
+            for i in range(10):
+                row = ["x"] * width
+                row[keyIndex] = str(i)
+                f.write(",".join(row) + "\n")
+        self._pagers = []
+        patches = [mock.patch("SyncDispatcher.openDatasource", self._open),
+                   mock.patch("SyncDispatcher.validateDatasource",
+                              lambda logger, pager: None),
+                   mock.patch("SyncDispatcher.finishDatasource")]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _open(self, args):
+        keyIndex = AccountSyncer.DS_COLUMN_DEFINITION[AccountSyncer.DS_ACCOUNT_IDENTIFIER]
+        pager = CSVPager(self._path, CSVPager.FILE_TYPE_CSV, 3, keyIndex)
+        self._pagers.append(pager)
+        return pager
+
+    def _run(self, *syncers) -> dict:
+        return SyncDispatcher(logging.getLogger("test"), None, syncers).run()
+
+    def testEveryTargetSeesEveryRecord(self):
+        first, second = _Recorder("first"), _Recorder("second")
+        self.assertEqual(self._run(first, second), {"first": None, "second": None})
+        expected = [str(i) for i in range(10)]
+        self.assertEqual(first.linkids, expected)
+        self.assertEqual(second.linkids, expected)
+        self.assertIsNot(first.thread, second.thread)
+        self.assertEqual(len(self._pagers), 1)
+
+    def testFailedTargetDoesNotStopOthers(self):
+        failing, healthy = _Recorder("failing", failAfter=1), _Recorder("healthy")
+        errors = self._run(failing, healthy)
+        self.assertIsInstance(errors["failing"], RuntimeError)
+        self.assertIsNone(errors["healthy"])
+        self.assertEqual(len(healthy.linkids), 10)
+
+    def testReadingStartsAtEarliestResumeIndex(self):
+        early, late = _Recorder("early", resumeAt=3), _Recorder("late", resumeAt=6)
+        self._run(early, late)
+        self.assertEqual(early.linkids, [str(i) for i in range(3, 10)])
+        self.assertEqual(late.linkids, [str(i) for i in range(6, 10)])
+
+    def testReadErrorReachesTargets(self):
+        with mock.patch("SyncDispatcher.readPages",
+                        side_effect=OSError("disk gone")):
+            errors = self._run(_Recorder("target"))
+        self.assertIsInstance(errors["target"], DatasourceReadError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Tests for SyncLedger and the sharding of datasource keys.
+"""
+
+import os
+import tempfile
+import unittest
+
+from SyncLedger import SyncLedger, shardOf
+
+
+class ShardOfTest(unittest.TestCase):
+
+    def testInRange(self):
+        for key in ("0", "1", "a", "student-12345"):
+            self.assertIn(shardOf(key, 4), range(1, 5))
+
+    def testStable(self):
+        self.assertEqual(shardOf("student-12345", 7), shardOf("student-12345", 7))
+
+    def testLinkidCaseIgnored(self):
+        # A datasource linkid and the same linkid in AD with different case
+        # must be handled by the same shard.
+        for shardcount in (2, 3, 5, 16):
+            for dskey, adkey in (("ab12", "AB12"), ("Student-9", "sTUDENT-9")):
+                self.assertEqual(shardOf(dskey, shardcount), shardOf(adkey, shardcount))
+
+
+class SyncLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._ledger = SyncLedger(os.path.join(self._dir.name, "ledger.db"))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def testReserveUserName(self):
+        self.assertTrue(self._ledger.reserveUserName("jsmith", "1"))
+        self.assertTrue(self._ledger.reserveUserName("jsmith", "1"))
+        self.assertFalse(self._ledger.reserveUserName("JSmith", "2"))
+        self.assertTrue(self._ledger.reserveUserName("jsmith2", "2"))
+
+    def testLastShardSendsMergedNotifications(self):
+        first = {"new_user": {("a@example.com",): [["1", "jsmith"]]}}
+        second = {"new_user": {("a@example.com",): [["2", "jdoe"]]},
+                  "pass_reset": {("b@example.com",): [["3", "bbrown"]]}}
+        self.assertIsNone(self._ledger.spoolNotifications("run1", 2, 2, first))
+        merged = self._ledger.spoolNotifications("run1", 1, 2, second)
+        self.assertEqual(merged, {
+            "new_user": {("a@example.com",): [["2", "jdoe"], ["1", "jsmith"]]},
+            "pass_reset": {("b@example.com",): [["3", "bbrown"]]}})
+        # The spooled notifications were handed out and removed.
+        self.assertIsNone(self._ledger.spoolNotifications("run1", 1, 2, {}))
+
+    def testRespooledShardReplacesItsNotifications(self):
+        self._ledger.spoolNotifications("run1", 1, 2, {"new_user": {("a",): [["1"]]}})
+        self._ledger.spoolNotifications("run1", 1, 2, {"new_user": {("a",): [["2"]]}})
+        merged = self._ledger.spoolNotifications("run1", 2, 2, {"new_user": {}})
+        self.assertEqual(merged, {"new_user": {("a",): [["2"]]}})
+
+    def testCrashedEarlierRunNotCounted(self):
+        # Shard 1 of an earlier run finished, but shard 2 never did.
+        self._ledger.spoolNotifications("run1", 1, 2, {"new_user": {("a",): [["old"]]}})
+        # In the next run, shard 1 is the only one to have finished so far.
+        self.assertIsNone(self._ledger.spoolNotifications(
+            "run2", 2, 2, {"new_user": {("a",): [["2"]]}}))
+        merged = self._ledger.spoolNotifications("run2", 1, 2, {"new_user": {("a",): [["1"]]}})
+        self.assertEqual(merged, {"new_user": {("a",): [["1"], ["2"]]}})
+
+
+if __name__ == "__main__":
+    unittest.main()
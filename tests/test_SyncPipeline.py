@@ -0,0 +1,111 @@
+"""
+Tests for SyncPipeline.
+"""
+
+import random
+import threading
+import time
+import unittest
+
+from SyncPipeline import SyncPipeline
+
+
+def _jitter(item):
+    # Finish items out of order when a stage has several workers.
+    time.sleep(random.random() / 500)
+    return item
+
+
+class SyncPipelineTest(unittest.TestCase):
+
+    def testStagesRunInTurn(self):
+        results = []
+        pipeline = SyncPipeline(range(20), queueSize=2)
+        pipeline.addStage("double", lambda item: item * 2)
+        pipeline.addStage("add", lambda item: item + 1)
+        pipeline.addStage("collect", results.append)
+        pipeline.run()
+        self.assertEqual(results, [item * 2 + 1 for item in range(20)])
+
+    def testOrderedStageAfterParallelStage(self):
+        results = []
+        pipeline = SyncPipeline(range(50), queueSize=4)
+        pipeline.addStage("jitter", _jitter, workers=4)
+        pipeline.addStage("collect", results.append, ordered=True)
+        pipeline.run()
+        self.assertEqual(results, list(range(50)))
+
+    def testParallelStageSeesEveryItem(self):
+        results = []
+        lock = threading.Lock()
+
+        def collect(item):
+            with lock:
+                results.append(item)
+
+        pipeline = SyncPipeline(range(50))
+        pipeline.addStage("jitter", _jitter, workers=3)
+        pipeline.addStage("collect", collect, workers=2)
+        pipeline.run()
+        self.assertEqual(sorted(results), list(range(50)))
+
+    def testStats(self):
+        pipeline = SyncPipeline(range(5), "read")
+        pipeline.addStage("copy", lambda item: item, workers=2)
+        pipeline.run()
+        self.assertEqual([(stats.name, stats.workers, stats.items)
+                          for stats in pipeline.stats],
+                         [("read", 1, 5), ("copy", 2, 5)])
+
+    def testStageErrorStopsPipeline(self):
+        results = []
+
+        def fail(item):
+            if item == 3:
+                raise ValueError("item 3")
+            return item
+
+        pipeline = SyncPipeline(range(1000), queueSize=1)
+        pipeline.addStage("fail", fail)
+        pipeline.addStage("collect", results.append)
+        with self.assertRaisesRegex(ValueError, "item 3"):
+            pipeline.run()
+        # Items already past the failed stage may or may not have been
+        # handed on before the pipeline stopped, but nothing after it is.
+        self.assertEqual(results, [0, 1, 2][:len(results)])
+
+    def testSourceErrorStopsPipeline(self):
+        def source():
+            yield 1
+            raise OSError("disk gone")
+
+        results = []
+        pipeline = SyncPipeline(source())
+        pipeline.addStage("collect", results.append, workers=2)
+        with self.assertRaisesRegex(OSError, "disk gone"):
+            pipeline.run()
+
+
+    def testSourceClosedOnItsThreadWhenStopped(self):
+        closedOn = []
+
+        def source():
+            try:
+                for item in range(1000):
+                    yield item
+            finally:
+                closedOn.append(threading.current_thread())
+
+        def fail(item):
+            raise ValueError("stop")
+
+        pipeline = SyncPipeline(source(), queueSize=1)
+        pipeline.addStage("fail", fail)
+        with self.assertRaises(ValueError):
+            pipeline.run()
+        self.assertEqual(len(closedOn), 1)
+        self.assertIsNot(closedOn[0], threading.current_thread())
+
+
+if __name__ == "__main__":
+    unittest.main()